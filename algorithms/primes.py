@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+
+def is_prime(n: int) -> bool:
+    """
+    Check whether n is prime by trial division.
+
+    :complexity: Best Case O(1), when n is even. Worst Case O(sqrt(n)), when n is prime.
+    """
+    if n < 4:
+        return n > 1
+    if n % 2 == 0:
+        return False
+    divisor = 3
+    while divisor * divisor <= n:
+        if n % divisor == 0:
+            return False
+        divisor += 2
+    return True
+
+
+def next_prime(n: int) -> int:
+    """
+    Returns the smallest prime greater than or equal to n.
+
+    :complexity: O(G * sqrt(n)), where G is the gap to the next prime (O(log(n)) on average).
+    """
+    while not is_prime(n):
+        n += 1
+    return n
@@ -0,0 +1,42 @@
+"""
+Times hashing a batch of keys one at a time with LinearProbeTable.digest against
+hash_many, and a bulk load into a LinearProbeTable through `update` against
+inserting each pair.
+
+Usage: python -m benchmarks.batch_hash [number of keys]
+"""
+import sys
+from time import perf_counter
+
+from data_structures import batch_hash
+from data_structures.batch_hash import hash_many
+from data_structures.hash_table import LinearProbeTable
+
+
+def timed(function) -> float:
+    start = perf_counter()
+    function()
+    return perf_counter() - start
+
+
+def insert_each(keys: list[str]) -> None:
+    table = LinearProbeTable()
+    for key in keys:
+        table[key] = key
+
+
+def main(n: int) -> None:
+    keys = [f"mountain-{i}" for i in range(n)]
+    digest = LinearProbeTable().digest
+    print(f"hash_many backend: {'numpy' if batch_hash.np is not None else 'python'}")
+    print(f"{'operation':<24}{'scalar s':>10}{'batched s':>11}")
+    scalar = timed(lambda: [digest(key) for key in keys])
+    batched = timed(lambda: hash_many(keys, LinearProbeTable.DIGEST_MODULUS))
+    print(f"{'digests':<24}{scalar:>10.2f}{batched:>11.2f}")
+    scalar = timed(lambda: insert_each(keys))
+    batched = timed(lambda: LinearProbeTable().update([(key, key) for key in keys]))
+    print(f"{'bulk load':<24}{scalar:>10.2f}{batched:>11.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
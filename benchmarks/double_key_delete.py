@@ -0,0 +1,41 @@
+"""
+Times deleting the last pair of a top-level key at the front of a long outer
+cluster of a DoubleKeyTable, for several cluster lengths and inner table sizes.
+
+Every top-level key hashes to the same outer slot, so each delete has to move
+the whole rest of the cluster back.
+
+Usage: python -m benchmarks.double_key_delete [number of deletes]
+"""
+import sys
+from time import perf_counter
+
+from double_key_table import DoubleKeyTable
+
+
+def build(cluster: int, inner: int) -> DoubleKeyTable:
+    # A single outer size large enough that the table never resizes.
+    table = DoubleKeyTable(sizes=[4 * cluster + 1])
+    table.hash1 = lambda k: 0
+    for i in range(cluster):
+        # The front key has a single pair, so deleting it empties its outer slot.
+        for j in range(1 if i == 0 else inner):
+            table[f"region-{i}", f"mountain-{j}"] = j
+    return table
+
+
+def main(deletes: int) -> None:
+    print(f"{'cluster':>8}{'inner':>8}{'us/delete':>12}")
+    for cluster in (50, 200):
+        for inner in (1, 10, 100):
+            total = 0.0
+            for _ in range(deletes):
+                table = build(cluster, inner)
+                start = perf_counter()
+                del table["region-0", "mountain-0"]
+                total += perf_counter() - start
+            print(f"{cluster:>8}{inner:>8}{total / deletes * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,33 @@
+"""
+Measures the memory a DoubleKeyTable holds with many top-level keys, each with
+only a few second-level keys, with tracemalloc. Keys and values are created
+before tracing starts, so only the table's own allocations are counted.
+
+Usage: python -m benchmarks.double_key_memory [top-level keys] [second-level keys each]
+"""
+import gc
+import sys
+import tracemalloc
+
+from double_key_table import DoubleKeyTable
+
+
+def main(top: int, inner: int) -> None:
+    keys1 = [f"region-{i}" for i in range(top)]
+    keys2 = [f"mountain-{j}" for j in range(inner)]
+    gc.collect()
+    tracemalloc.start()
+    table = DoubleKeyTable()
+    for key1 in keys1:
+        for key2 in keys2:
+            table[key1, key2] = key2
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{top} top-level keys x {inner} second-level keys")
+    print(f"total MB: {current / 2 ** 20:.1f}")
+    print(f"bytes per top-level key: {current / top:.1f}")
+    print(f"bytes per pair: {current / (top * inner):.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000, int(sys.argv[2]) if len(sys.argv) > 2 else 3)
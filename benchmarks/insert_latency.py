@@ -0,0 +1,36 @@
+"""
+Times every insert into a LinearProbeTable and an IncrementalRehashTable,
+reporting the worst case and high percentiles of the per-operation latency.
+
+Usage: python -m benchmarks.insert_latency [number of keys]
+"""
+import sys
+from time import perf_counter
+
+from data_structures.hash_table import LinearProbeTable
+from data_structures.incremental_table import IncrementalRehashTable
+
+
+def latencies(table, keys: list[str]) -> list[float]:
+    res = []
+    for key in keys:
+        start = perf_counter()
+        table[key] = key
+        res.append(perf_counter() - start)
+    return res
+
+
+def main(n: int) -> None:
+    keys = [f"mountain-{i}" for i in range(n)]
+    print(f"{'table':<24}{'total s':>10}{'p99 us':>10}{'p99.99 us':>12}{'max ms':>10}")
+    for table in (LinearProbeTable(), IncrementalRehashTable()):
+        times = latencies(table, keys)
+        total = sum(times)
+        times.sort()
+        p99 = times[int(len(times) * 0.99)] * 1e6
+        p9999 = times[int(len(times) * 0.9999)] * 1e6
+        print(f"{type(table).__name__:<24}{total:>10.2f}{p99:>10.1f}{p9999:>12.1f}{times[-1] * 1e3:>10.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,51 @@
+"""
+Measures the cold start of a DoubleKeyTable: rebuilding it from a JSON file,
+against memory-mapping a file written by `DoubleKeyTable.save`, up to the first lookup.
+
+Usage: python -m benchmarks.mapped_open [pairs]
+"""
+import json
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+from double_key_table import DoubleKeyTable
+
+
+def main(n: int) -> None:
+    pairs = [(f"region-{i % (n // 10 or 1)}", f"mountain-{i}") for i in range(n)]
+    table = DoubleKeyTable()
+    table.set_many(pairs, range(n))
+    probe = pairs[n // 2]
+
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, "table.json")
+        with open(json_path, "w") as file:
+            json.dump([[key1, key2, value] for (key1, key2), value in zip(pairs, range(n))], file)
+        mapped_path = os.path.join(directory, "table.dkt")
+        table.save(mapped_path)
+        del table
+
+        start = perf_counter()
+        with open(json_path) as file:
+            rows = json.load(file)
+        rebuilt = DoubleKeyTable()
+        rebuilt.set_many([(key1, key2) for key1, key2, _ in rows], [value for _, _, value in rows])
+        assert rebuilt[probe] == n // 2
+        rebuild_time = perf_counter() - start
+        del rows, rebuilt
+
+        start = perf_counter()
+        mapped = DoubleKeyTable.open(mapped_path)
+        assert mapped[probe] == n // 2
+        open_time = perf_counter() - start
+        mapped.close()
+
+        print(f"{n} pairs, saved file {os.path.getsize(mapped_path) / 2 ** 20:.1f} MB")
+        print(f"rebuild from JSON: {rebuild_time * 1000:.1f} ms")
+        print(f"open mapped file:  {open_time * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,37 @@
+"""
+Measures the memory a LinearProbeTable and a ParallelArrayTable hold per entry,
+with tracemalloc. Keys and values are created before tracing starts, so only
+the table's own allocations are counted.
+
+Usage: python -m benchmarks.memory_per_entry [number of entries ...]
+"""
+import gc
+import sys
+import tracemalloc
+
+from data_structures.hash_table import LinearProbeTable
+from data_structures.parallel_array_table import ParallelArrayTable
+
+
+def bytes_per_entry(table_type, keys: list[str]) -> float:
+    gc.collect()
+    tracemalloc.start()
+    table = table_type()
+    for key in keys:
+        table[key] = key
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / len(keys)
+
+
+def main(sizes: list[int]) -> None:
+    print(f"{'entries':>10}{'LinearProbeTable':>20}{'ParallelArrayTable':>20}")
+    for n in sizes:
+        keys = [f"mountain-{i}" for i in range(n)]
+        before = bytes_per_entry(LinearProbeTable, keys)
+        after = bytes_per_entry(ParallelArrayTable, keys)
+        print(f"{n:>10}{before:>20.1f}{after:>20.1f}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000])
@@ -0,0 +1,51 @@
+"""
+Compares probe lengths of LinearProbeTable and RobinHoodTable on the
+prefix-heavy names the GUI generates.
+
+Usage: python -m benchmarks.probe_lengths [number of keys]
+"""
+import sys
+from statistics import mean, pvariance
+
+from data_structures.hash_table import LinearProbeTable
+from data_structures.robin_hood_table import RobinHoodTable
+
+
+def probe_lengths(table, keys):
+    """Number of slots past its home position each key sits at."""
+    return [(table._linear_probe(key, False) - table.hash(key)) % table.table_size for key in keys]
+
+
+def miss_lengths(table, keys):
+    """Number of slots a lookup for each (missing) key inspects before giving up."""
+    lengths = []
+    for key in keys:
+        position = table.hash(key)
+        length = 0
+        while True:
+            item = table.array[position]
+            if item is None:
+                break
+            if isinstance(table, RobinHoodTable) and table._displacement(position) < length:
+                break
+            position = (position + 1) % table.table_size
+            length += 1
+        lengths.append(length)
+    return lengths
+
+
+def main(n: int) -> None:
+    keys = [f"default-{i:04}" for i in range(n)]
+    missing = [f"default-x{i:04}" for i in range(n)]
+    print(f"{'table':<18}{'max':>6}{'mean':>8}{'variance':>10}{'miss max':>10}{'miss mean':>11}")
+    for table in (LinearProbeTable(), RobinHoodTable()):
+        for key in keys:
+            table[key] = key
+        hits = probe_lengths(table, keys)
+        misses = miss_lengths(table, missing)
+        print(f"{type(table).__name__:<18}{max(hits):>6}{mean(hits):>8.2f}{pvariance(hits):>10.2f}"
+              f"{max(misses):>10}{mean(misses):>11.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,57 @@
+"""
+Measures write throughput into a DoubleKeyTable behind one lock and into a
+ShardedDoubleKeyTable, with 1 to 8 writer threads each inserting its own pairs.
+
+With the GIL, threads take turns running Python code, so neither table gets faster
+with more threads; sharding only removes the lock contention. On a free-threaded
+build (python3.13t or later, with the GIL disabled), writes to different shards run in parallel.
+
+Usage: python -m benchmarks.sharded_ingest [pairs per run] [shards]
+"""
+import sys
+from threading import Lock, Thread
+from time import perf_counter
+
+from double_key_table import DoubleKeyTable
+from sharded_double_key_table import ShardedDoubleKeyTable
+
+
+class LockedDoubleKeyTable:
+    """ A DoubleKeyTable with every write serialised behind one lock. """
+
+    def __init__(self) -> None:
+        self.table = DoubleKeyTable()
+        self.lock = Lock()
+
+    def __setitem__(self, key, data) -> None:
+        with self.lock:
+            self.table[key] = data
+
+
+def throughput(table, pairs: list[tuple[str, str]], threads: int) -> float:
+    def write(part: list[tuple[str, str]]) -> None:
+        for pair in part:
+            table[pair] = 0
+
+    workers = [Thread(target=write, args=(pairs[i::threads],)) for i in range(threads)]
+    start = perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return len(pairs) / (perf_counter() - start)
+
+
+def main(n: int, shards: int) -> None:
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"Python {sys.version.split()[0]}, GIL {'enabled' if gil else 'disabled'}")
+    pairs = [(f"region-{i % 1000}", f"mountain-{i}") for i in range(n)]
+    print(f"{'threads':>8}{'locked pairs/s':>16}{'sharded pairs/s':>17}")
+    for threads in (1, 2, 4, 8):
+        locked = throughput(LockedDoubleKeyTable(), pairs, threads)
+        sharded = throughput(ShardedDoubleKeyTable(shards), pairs, threads)
+        print(f"{threads:>8}{locked:>16.0f}{sharded:>17.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000, int(sys.argv[2]) if len(sys.argv) > 2 else 16)
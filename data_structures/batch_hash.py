@@ -0,0 +1,126 @@
+""" Batched String Hashing
+
+Evaluates the polynomial hash used by the hash tables (`LinearProbeTable.digest`,
+`DoubleKeyTable.hash1` and `hash2`) over many keys at once.
+Uses NumPy when it is installed, and a plain Python loop otherwise.
+The results are identical to the scalar hash either way.
+"""
+from __future__ import annotations
+
+from typing import Sequence
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HASH_BASE = 31
+HASH_START = 31415
+
+# Number of keys encoded into one code point matrix at a time, to bound the memory of its rows.
+CHUNK_SIZE = 65536
+# Number of cells (rows times the longest key in them) in one code point matrix, to bound the
+# memory of its columns. Keys longer than this are hashed in plain Python instead.
+CHUNK_CELLS = 2 ** 22
+
+
+def _coefficients(length: int, table_size: int) -> list[int]:
+    """
+    Returns the multiplier applied at each character position: the scalar hash
+    starts at HASH_START and multiplies by HASH_BASE modulo (table_size - 1) after each character.
+
+    :complexity: O(length)
+    """
+    res = []
+    a = HASH_START
+    for _ in range(length):
+        res.append(a)
+        a = a * HASH_BASE % (table_size - 1)
+    return res
+
+
+def hash_string(key: str, table_size: int) -> int:
+    """
+    Hash a single key exactly as the scalar hash with the given table size would,
+    for code that hashes without a table at hand.
+
+    :complexity: O(len(key))
+    """
+    value = 0
+    a = HASH_START
+    for char in key:
+        value = (ord(char) + a * value) % table_size
+        a = a * HASH_BASE % (table_size - 1)
+    return value
+
+
+def _hash_many_python(keys: Sequence[str], table_size: int) -> list[int]:
+    """
+    :complexity: O(L) where L is the total length of the keys.
+    """
+    coefficients = _coefficients(max(map(len, keys), default=0), table_size)
+    res = []
+    for key in keys:
+        value = 0
+        for char, a in zip(key, coefficients):
+            value = (ord(char) + a * value) % table_size
+        res.append(value)
+    return res
+
+
+def _hash_many_numpy(keys: Sequence[str], table_size: int) -> list[int]:
+    """
+    Encodes the keys into zero-padded matrices of code points, one row per key,
+    and applies one step of the recurrence to every row per column.
+    Rows whose key has ended keep their value.
+
+    The keys are taken in order of length, so that each matrix is only as wide as the
+    keys in it, with at most CHUNK_SIZE rows and CHUNK_CELLS cells: a single long key
+    cannot pad every other row out to its length.
+
+    :complexity: O(N*log(N) + L) array operations, where N is the number of keys and L their total length.
+    """
+    # Lengths are taken from the keys, since NumPy strips trailing NUL characters.
+    lengths = np.fromiter(map(len, keys), dtype=np.int64, count=len(keys))
+    order = np.argsort(lengths, kind="stable")
+    lengths = lengths[order]
+    res = np.zeros(len(keys), dtype=np.int64)
+    start = 0
+    while start < len(keys):
+        # Taking one more key makes the matrix at least as long and as wide, so its cells only grow.
+        window = lengths[start:start + CHUNK_SIZE]
+        end = start + int(np.searchsorted(np.arange(1, len(window) + 1) * window, CHUNK_CELLS, side="right"))
+        if end == start:
+            # Every key left is too long to fit a matrix on its own.
+            rest = order[start:].tolist()
+            res[rest] = _hash_many_python([keys[i] for i in rest], table_size)
+            break
+        width = int(lengths[end - 1])
+        if width > 0:
+            chunk = [keys[i] for i in order[start:end].tolist()]
+            codes = np.array(chunk, dtype=f"U{width}").view(np.uint32).reshape(len(chunk), width)
+            value = np.zeros(len(chunk), dtype=np.int64)
+            for column, a in enumerate(_coefficients(width, table_size)):
+                # value < table_size <= 2**31 and a < max(table_size, HASH_START), so nothing overflows 64 bits.
+                stepped = (codes[:, column].astype(np.int64) + a * value) % table_size
+                value = np.where(lengths[start:end] > column, stepped, value)
+            res[order[start:end]] = value
+        start = end
+    return res.tolist()
+
+
+def hash_many(keys: Sequence[str], table_size: int) -> list[int]:
+    """
+    Hash every key in keys exactly as the scalar hash with the given table size would
+    (pass LinearProbeTable.DIGEST_MODULUS for digests).
+
+    :complexity: O(L) where L is the total length of the keys.
+    :raises ValueError: when table_size is less than 2.
+    """
+    if table_size < 2:
+        raise ValueError("table_size should be at least 2.")
+    if not isinstance(keys, (list, tuple)):
+        keys = list(keys)
+    if np is None or table_size > 2 ** 31 or not all(type(key) is str for key in keys):
+        return _hash_many_python(keys, table_size)
+    return _hash_many_numpy(keys, table_size)
@@ -0,0 +1,280 @@
+""" Compact Hash Table
+
+Defines a Hash Table using Linear Probing for conflict resolution, laid
+out like CPython's dict: the probed array only holds indices into dense,
+insertion-ordered entry arrays.
+"""
+from __future__ import annotations
+
+from array import array
+from typing import TypeVar, Iterator
+from data_structures.hash_table import LinearProbeTable, FullError, TOMBSTONE
+
+K = TypeVar('K')
+V = TypeVar('V')
+
+
+class CompactProbeTable(LinearProbeTable[K, V]):
+    """
+    Compact Probe Table.
+
+    Slot i of `indices` is EMPTY, DELETED, or the position of an entry in the dense
+    entry_keys, entry_values and entry_hashes lists, which grow by appending.
+    Iteration walks the dense lists, so it costs O(len) rather than O(tablesize)
+    and runs in insertion order.
+
+    A delete marks its slot DELETED (counted in tombstone_count) and leaves a hole
+    (a tombstone key) in the entry lists. DELETED slots are never reused: once they
+    and the live entries pass `max_load_factor` of the table, it is rebuilt, growing
+    only if the live entries need it. Holes are squeezed out of the entry lists
+    whenever they outnumber the live entries, so iteration stays O(len).
+
+    Type Arguments:
+        - K:    Key Type. In most cases should be string.
+                Otherwise `hash` should be overwritten.
+        - V:    Value Type.
+
+    Unless stated otherwise, all methods have O(1) complexity.
+    """
+
+    EMPTY = -1
+    DELETED = -2
+
+    def __init__(self, sizes=None, tombstones: bool = False, tombstone_threshold: float = 0.25,
+                 max_load_factor: float = 0.5, min_load_factor: float = 0.0) -> None:
+        """
+        Initialise the Hash Table.
+
+        :param tombstones: ignored, a delete always leaves a DELETED slot.
+        :param tombstone_threshold: ignored, DELETED slots are dropped when the table is rebuilt.
+        :param max_load_factor: fraction of slots in use above which the table is rebuilt.
+        :param min_load_factor: fraction of slots in use below which the table shrinks.
+        :raises ValueError: when the load factors could make the table grow and shrink back and forth.
+        """
+        LinearProbeTable.__init__(self, sizes, tombstones, tombstone_threshold, max_load_factor, min_load_factor)
+        del self.array
+        self.indices = array('q', [self.EMPTY]) * self.TABLE_SIZES[self.size_index]
+        self.entry_keys: list[K] = []
+        self.entry_values: list[V] = []
+        self.entry_hashes: list[int | None] = []
+
+    @property
+    def table_size(self) -> int:
+        return len(self.indices)
+
+    def _probe(self, key: K, digest: int | None, is_insert: bool) -> int:
+        """
+        Linear probe for the slot of key, given its (possibly None) digest.
+        DELETED slots are probed past and never handed out for an insert.
+
+        :complexity: See LinearProbeTable._probe.
+        :raises KeyError: When the key is not in the table, but is_insert is False.
+        :raises FullError: When a table is full and cannot be inserted.
+        """
+        position = self._home(key, digest)
+
+        for probes in range(self.table_size):
+            index = self.indices[position]
+            if index == self.EMPTY:
+                if self.probe_stats is not None:
+                    self.probe_stats.record_probe(probes, False, is_insert)
+                if is_insert:
+                    return position
+                else:
+                    raise KeyError(key)
+            elif index != self.DELETED and (digest is None or self.entry_hashes[index] == digest) \
+                    and self.entry_keys[index] == key:
+                if self.probe_stats is not None:
+                    self.probe_stats.record_probe(probes, True, is_insert)
+                return position
+            position = (position + 1) % self.table_size
+
+        if is_insert:
+            raise FullError("Table is full!")
+        else:
+            raise KeyError(key)
+
+    def _get(self, key: K, digest: int | None) -> V:
+        """
+        Get the value at key, given its (possibly None) digest.
+
+        :complexity: See _probe.
+        :raises KeyError: when the key doesn't exist.
+        """
+        return self.entry_values[self.indices[self._probe(key, digest, False)]]
+
+    def _set(self, key: K, data: V, digest: int | None) -> None:
+        """
+        Set the value at key, given its (possibly None) digest. New keys go to the end of the iteration order.
+
+        :complexity: See _probe.
+        :raises FullError: when the table cannot be resized further.
+        """
+        self._before_write()
+        position = self._probe(key, digest, True)
+
+        index = self.indices[position]
+        if index >= 0:
+            self.entry_values[index] = data
+            return
+
+        self.indices[position] = len(self.entry_keys)
+        self.entry_keys.append(key)
+        self.entry_values.append(data)
+        self.entry_hashes.append(digest)
+        self.count += 1
+        self.version += 1
+
+        if len(self) + self.tombstone_count > self.table_size * self.max_load_factor:
+            self._rehash()
+
+    def __delitem__(self, key: K) -> None:
+        """
+        Deletes a (key, value) pair in our hash table.
+
+        :complexity: See linear probe.
+        :raises KeyError: when the key doesn't exist.
+        """
+        self._before_write()
+        position = self._linear_probe(key, False)
+        index = self.indices[position]
+        self.version += 1
+        self.indices[position] = self.DELETED
+        self.entry_keys[index] = TOMBSTONE
+        self.entry_values[index] = None
+        self.entry_hashes[index] = None
+        self.count -= 1
+        self.tombstone_count += 1
+        if len(self.entry_keys) - len(self) > len(self):
+            self._squeeze()
+        self._check_shrink()
+
+    def _in_use(self, position: int) -> bool:
+        """
+        Whether the slot at position holds an entry index or is DELETED.
+        """
+        return self.indices[position] != self.EMPTY
+
+    def _unshare(self) -> None:
+        """
+        Replace the storage with a copy, leaving the original to a snapshot.
+
+        :complexity: O(N + E) where N is the tablesize and E the length of the entry lists.
+        """
+        self.indices = self.indices[:]
+        self.entry_keys = self.entry_keys[:]
+        self.entry_values = self.entry_values[:]
+        self.entry_hashes = self.entry_hashes[:]
+
+    def _squeeze(self) -> None:
+        """
+        Remove the holes from the entry lists in place, pointing each live entry's
+        slot at its new position.
+
+        :complexity: O(E) with no probing, O(E*N) with lots of probing,
+        where E is the length of the entry lists and N the tablesize.
+        """
+        new_index = 0
+        for index in range(len(self.entry_keys)):
+            key = self.entry_keys[index]
+            if key is not TOMBSTONE:
+                # Find the slot by the index it holds. Slots already moved hold smaller indices.
+                position = self._home(key, self.entry_hashes[index])
+                while self.indices[position] != index:
+                    position = (position + 1) % self.table_size
+                self.indices[position] = new_index
+                self.entry_keys[new_index] = key
+                self.entry_values[new_index] = self.entry_values[index]
+                self.entry_hashes[new_index] = self.entry_hashes[index]
+                new_index += 1
+        del self.entry_keys[new_index:]
+        del self.entry_values[new_index:]
+        del self.entry_hashes[new_index:]
+
+    def _rehash(self) -> None:
+        """
+        Rebuild the table once too many slots are in use: grow if the live entries
+        alone fill half of what is allowed (and it can), otherwise just drop the DELETED slots.
+
+        :complexity: See _rebuild.
+        """
+        if len(self) > self.table_size * self.max_load_factor / 2 and self._has_size(self.size_index + 1):
+            LinearProbeTable._rehash(self)
+        else:
+            self._compact()
+
+    def _rebuild(self, new_size: int) -> None:
+        """
+        Squeeze the holes out of the entry lists and re-index them into new_size slots,
+        dropping all DELETED slots.
+
+        :complexity: O(N) with no probing, O(N^2) with lots of probing, where N is len(self).
+        """
+        keys, values, hashes = self.entry_keys, self.entry_values, self.entry_hashes
+        self.indices = array('q', [self.EMPTY]) * new_size
+        self.entry_keys, self.entry_values, self.entry_hashes = [], [], []
+        self.tombstone_count = 0
+        for index in range(len(keys)):
+            if keys[index] is not TOMBSTONE:
+                position = self._home(keys[index], hashes[index])
+                while self.indices[position] != self.EMPTY:
+                    position = (position + 1) % self.table_size
+                self.indices[position] = len(self.entry_keys)
+                self.entry_keys.append(keys[index])
+                self.entry_values.append(values[index])
+                self.entry_hashes.append(hashes[index])
+
+    def keys(self) -> list[K]:
+        """
+        Returns all keys in the hash table, in insertion order.
+
+        :complexity: O(N) where N is len(self).
+        """
+        return list(self.iter_keys())
+
+    def values(self) -> list[V]:
+        """
+        Returns all values in the hash table, in insertion order of their keys.
+
+        :complexity: O(N) where N is len(self).
+        """
+        return list(self.iter_values())
+
+    def items(self) -> Iterator[tuple[K, V]]:
+        """
+        Returns an iterator of all (key, value) pairs, in insertion order.
+
+        :complexity: O(N) over the whole iteration, where N is len(self).
+        :raises ConcurrentModificationError: when keys are added or removed during the iteration.
+        """
+        version = self.version
+        for index in range(len(self.entry_keys)):
+            self._check_version(version)
+            key = self.entry_keys[index]
+            if key is not TOMBSTONE:
+                yield key, self.entry_values[index]
+        self._check_version(version)
+
+    def iter_keys(self) -> Iterator[K]:
+        """
+        Returns an iterator of all keys, in insertion order.
+
+        :complexity: O(N) over the whole iteration, where N is len(self).
+        :raises ConcurrentModificationError: when keys are added or removed during the iteration.
+        """
+        version = self.version
+        for key in self.entry_keys:
+            self._check_version(version)
+            if key is not TOMBSTONE:
+                yield key
+        self._check_version(version)
+
+    def __str__(self) -> str:
+        """
+        Returns all they key/value pairs in our hash table, in insertion order.
+        :complexity: O(N * (str(key) + str(value))) where N is len(self)
+        """
+        result = ""
+        for key, value in self.items():
+            result += "(" + str(key) + "," + str(value) + ")\n"
+        return result
@@ -7,8 +7,15 @@ __author__ = 'Jackson Goerner'
 __since__ = '07/02/2023'
 
 
-from typing import TypeVar, Generic
+import weakref
+from copy import copy
+from itertools import islice
+from time import perf_counter
+from typing import TypeVar, Generic, Iterable, Iterator
+from data_structures.batch_hash import CHUNK_SIZE, hash_many
 from data_structures.referential_array import ArrayR
+from data_structures.table_stats import ProbeStats, cluster_lengths
+from algorithms.primes import next_prime
 
 K = TypeVar('K')
 V = TypeVar('V')
@@ -17,6 +24,19 @@ class FullError(Exception):
     pass
 
 
+class ConcurrentModificationError(RuntimeError):
+    """
+    Raised by an iterator over a table that has had keys added or removed
+    (or been resized) since the iteration started.
+    """
+    pass
+
+
+# Marks a slot whose entry was deleted lazily. Probes continue past it,
+# and inserts may reuse it.
+TOMBSTONE = object()
+
+
 class LinearProbeTable(Generic[K, V]):
     """
     Linear Probe Table.
@@ -26,6 +46,22 @@ class LinearProbeTable(Generic[K, V]):
                 Otherwise `hash` should be overwritten.
         - V:    Value Type.
 
+    Deletion either shifts the rest of the cluster back into place (the default),
+    or, with `tombstones=True`, replaces the entry with a tombstone in O(1).
+    The table is compacted once tombstones make up more than `tombstone_threshold`
+    of its slots.
+
+    The table grows once more than `max_load_factor` of its slots are in use, and
+    shrinks once fewer than `min_load_factor` are (never, by default).
+    With the default sizes, primes past the end of TABLE_SIZES are generated as needed,
+    while a `sizes` list given to the constructor caps how far the table can grow.
+
+    `stats()` summarises the layout. After `instrument()`, it also reports probe
+    lengths, collisions and time spent resizing; otherwise nothing is recorded.
+
+    Iterators raise ConcurrentModificationError once keys are added or removed under them.
+    To iterate while writing, iterate over a `snapshot()`, which is copy-on-write.
+
     Unless stated otherwise, all methods have O(1) complexity.
     """
 
@@ -34,19 +70,120 @@ class LinearProbeTable(Generic[K, V]):
 
     HASH_BASE = 31
 
-    def __init__(self, sizes=None) -> None:
+    # Largest prime below 2**31, keeps every intermediate digest value within 64 bits.
+    DIGEST_MODULUS = 2147483647
+
+    def __init__(self, sizes=None, tombstones: bool = False, tombstone_threshold: float = 0.25,
+                 max_load_factor: float = 0.5, min_load_factor: float = 0.0) -> None:
         """
         Initialise the Hash Table.
+
+        :param tombstones: delete lazily with tombstones instead of shifting clusters.
+        :param tombstone_threshold: fraction of slots holding tombstones above which the table is compacted.
+        :param max_load_factor: fraction of slots in use above which the table grows.
+        :param min_load_factor: fraction of slots in use below which the table shrinks.
+        :raises ValueError: when the load factors could make the table grow and shrink back and forth.
         """
+        if not 0 < max_load_factor < 1:
+            raise ValueError("max_load_factor should be between 0 and 1.")
+        if not 0 <= min_load_factor < max_load_factor / 2:
+            raise ValueError("min_load_factor should be non-negative and below half of max_load_factor.")
+        self.extend_sizes = sizes is None
         if sizes is not None:
             self.TABLE_SIZES = sizes
+        self.max_load_factor = max_load_factor
+        self.min_load_factor = min_load_factor
         self.size_index = 0
-        self.array:ArrayR[tuple[K, V]] = ArrayR(self.TABLE_SIZES[self.size_index])
+        # Each entry is stored as (key, value, digest).
+        self.array:ArrayR[tuple[K, V, int | None]] = ArrayR(self.TABLE_SIZES[self.size_index])
         self.count = 0
+        self.use_tombstones = tombstones
+        self.tombstone_threshold = tombstone_threshold
+        self.tombstone_count = 0
+        self.probe_stats: ProbeStats | None = None
+        # Bumped whenever keys are added or removed, or entries move.
+        self.version = 0
+        self.read_only = False
+        # The most recent snapshot still sharing this table's storage, if any.
+        self.snapshot_ref: weakref.ref | None = None
+
+    @classmethod
+    def from_items(cls, items: Iterable[tuple[K, V]], expected: int | None = None) -> LinearProbeTable[K, V]:
+        """
+        Build a table from (key, value) pairs, sized up front so that no resizes happen while loading.
 
-    def hash(self, key: K) -> int:
+        :param expected: number of pairs, if items has no len(). Without it, items is read into a list first.
+        :complexity: O(N) with no probing, where N is the number of items. See linear probe.
         """
-        Hash a key for insert/retrieve/update into the hashtable.
+        table = cls()
+        if expected is None:
+            table.update(items)
+        else:
+            table._reserve(expected)
+            items = iter(items)
+            chunk = list(islice(items, CHUNK_SIZE))
+            while chunk:
+                table._set_all(chunk)
+                chunk = list(islice(items, CHUNK_SIZE))
+        return table
+
+    def update(self, items: Iterable[tuple[K, V]]) -> None:
+        """
+        Insert every (key, value) pair in items, resizing at most once, before inserting anything.
+        Nothing is shrunk to fit.
+
+        :complexity: O(N + M) with no probing, where N is len(self) and M the number of items.
+        :raises FullError: when the table cannot be resized further.
+        :raises TypeError: when the table is a snapshot, before anything is changed.
+        """
+        self._before_write()
+        items = list(items)
+        self._reserve(len(self) + len(items))
+        self._set_all(items)
+
+    def _set_all(self, items: list[tuple[K, V]]) -> None:
+        """
+        Insert every (key, value) pair in items, hashing all the keys in one batch first.
+
+        :complexity: O(L + M) with no probing, where L is the total length of the keys
+        and M the number of items. See linear probe.
+        :raises FullError: when the table cannot be resized further.
+        """
+        keys = [key for key, _ in items]
+        for (key, data), digest in zip(items, self._key_digests(keys)):
+            self._set(key, data, digest)
+
+    def _reserve(self, count: int) -> None:
+        """
+        Grow straight to the smallest size that holds count entries without resizing.
+
+        :complexity: O(N) with no probing, O(N^2) with lots of probing, where N is len(self).
+        """
+        size_index = self.size_index
+        while count > self.TABLE_SIZES[size_index] * self.max_load_factor and self._has_size(size_index + 1):
+            size_index += 1
+        if size_index != self.size_index:
+            self.size_index = size_index
+            self._resize(self.TABLE_SIZES[size_index])
+
+    def _has_size(self, size_index: int) -> bool:
+        """
+        Whether TABLE_SIZES has an entry at size_index. With the default sizes,
+        the next size up is generated when asked for: the first prime past double the largest size.
+
+        :complexity: O(1) for sizes in the list, O(sqrt(N)*log(N)) to generate the next size N.
+        """
+        if size_index == len(self.TABLE_SIZES) and self.extend_sizes:
+            # Copy, rather than append to, the class-wide list.
+            self.TABLE_SIZES = self.TABLE_SIZES + [next_prime(2 * self.TABLE_SIZES[-1] + 1)]
+        return size_index < len(self.TABLE_SIZES)
+
+    def digest(self, key: K) -> int:
+        """
+        Compute the table-independent digest of a key.
+
+        The digest is computed once when a key is inserted and cached in the entry,
+        so resizing only has to reduce it modulo the new table size.
 
         :complexity: O(len(key))
         """
@@ -54,10 +191,59 @@ class LinearProbeTable(Generic[K, V]):
         value = 0
         a = 31415
         for char in key:
-            value = (ord(char) + a * value) % self.table_size
-            a = a * self.HASH_BASE % (self.table_size - 1)
+            value = (ord(char) + a * value) % self.DIGEST_MODULUS
+            a = a * self.HASH_BASE % (self.DIGEST_MODULUS - 1)
         return value
 
+    def hash(self, key: K) -> int:
+        """
+        Hash a key for insert/retrieve/update into the hashtable.
+
+        :complexity: O(len(key))
+        """
+        return self.digest(key) % self.table_size
+
+    def _key_digest(self, key: K) -> int | None:
+        """
+        Returns the digest to cache for key, or None if `hash` has been overwritten
+        (on the instance or in a subclass), in which case positions always come from `hash`.
+
+        :complexity: O(len(key))
+        """
+        if "hash" in self.__dict__ or type(self).hash is not LinearProbeTable.hash:
+            return None
+        return self.digest(key)
+
+    def _key_digests(self, keys: list[K]) -> list[int | None]:
+        """
+        Returns the digest to cache for each of keys (see _key_digest), computed in one batch.
+
+        :complexity: O(L) where L is the total length of the keys.
+        """
+        if "hash" in self.__dict__ or type(self).hash is not LinearProbeTable.hash:
+            return [None] * len(keys)
+        return self._digests(keys)
+
+    def _digests(self, keys: list[K]) -> list[int]:
+        """
+        Returns the digest of each of keys, batched unless `digest` has been overwritten.
+
+        :complexity: O(L) where L is the total length of the keys.
+        """
+        if "digest" in self.__dict__ or type(self).digest is not LinearProbeTable.digest:
+            return [self.digest(key) for key in keys]
+        return hash_many(keys, self.DIGEST_MODULUS)
+
+    def _home(self, key: K, digest: int | None) -> int:
+        """
+        Returns the initial probe position of a key, reusing its cached digest if there is one.
+
+        :complexity: O(1) with a digest, O(hash(key)) otherwise.
+        """
+        if digest is None:
+            return self.hash(key)
+        return digest % self.table_size
+
     @property
     def table_size(self) -> int:
         return len(self.array)
@@ -77,23 +263,45 @@ class LinearProbeTable(Generic[K, V]):
         :raises KeyError: When the key is not in the table, but is_insert is False.
         :raises FullError: When a table is full and cannot be inserted.
         """
-        # Initial position
-        position = self.hash(key)
+        return self._probe(key, self._key_digest(key), is_insert)
 
-        for _ in range(self.table_size):
-            if self.array[position] is None:
+    def _probe(self, key: K, digest: int | None, is_insert: bool) -> int:
+        """
+        Linear probe for key, given its (possibly None) digest.
+        Entries with a different cached digest are skipped without comparing keys.
+        Tombstones are probed past, and the first one seen is reused for an insert.
+
+        :complexity: See linear probe, with hash(key) replaced by O(1) when digest is given.
+        :raises KeyError: When the key is not in the table, but is_insert is False.
+        :raises FullError: When a table is full and cannot be inserted.
+        """
+        # Initial position
+        position = self._home(key, digest)
+        free_position = None
+
+        for probes in range(self.table_size):
+            item = self.array[position]
+            if item is None:
+                if self.probe_stats is not None:
+                    self.probe_stats.record_probe(probes, False, is_insert)
                 # Empty spot. Am I upserting or retrieving?
                 if is_insert:
-                    return position
+                    return position if free_position is None else free_position
                 else:
                     raise KeyError(key)
-            elif self.array[position][0] == key:
+            elif item is TOMBSTONE:
+                if free_position is None:
+                    free_position = position
+            elif (digest is None or item[2] == digest) and item[0] == key:
+                if self.probe_stats is not None:
+                    self.probe_stats.record_probe(probes, True, is_insert)
                 return position
-            else:
-                # Taken by something else. Time to linear probe.
-                position = (position + 1) % self.table_size
+            # Taken by something else. Time to linear probe.
+            position = (position + 1) % self.table_size
 
         if is_insert:
+            if free_position is not None:
+                return free_position
             raise FullError("Table is full!")
         else:
             raise KeyError(key)
@@ -106,8 +314,9 @@ class LinearProbeTable(Generic[K, V]):
         """
         res = []
         for x in range(self.table_size):
-            if self.array[x] is not None:
-                res.append(self.array[x][0])
+            item = self.array[x]
+            if item is not None and item is not TOMBSTONE:
+                res.append(item[0])
         return res
 
     def values(self) -> list[V]:
@@ -118,10 +327,94 @@ class LinearProbeTable(Generic[K, V]):
         """
         res = []
         for x in range(self.table_size):
-            if self.array[x] is not None:
-                res.append(self.array[x][1])
+            item = self.array[x]
+            if item is not None and item is not TOMBSTONE:
+                res.append(item[1])
         return res
 
+    def items(self) -> Iterator[tuple[K, V]]:
+        """
+        Returns an iterator of all (key, value) pairs in the hash table.
+
+        :complexity: O(N) over the whole iteration, where N is self.table_size.
+        :raises ConcurrentModificationError: when keys are added or removed during the iteration.
+        """
+        version = self.version
+        for item in self.array:
+            self._check_version(version)
+            if item is not None and item is not TOMBSTONE:
+                yield item[0], item[1]
+        self._check_version(version)
+
+    def _check_version(self, version: int) -> None:
+        """
+        :raises ConcurrentModificationError: when the table has changed since it was at version.
+        """
+        if self.version != version:
+            raise ConcurrentModificationError("Table changed during iteration.")
+
+    def snapshot(self) -> LinearProbeTable[K, V]:
+        """
+        Returns a read-only copy of the table as it is now, which is safe to iterate while
+        this table keeps changing.
+
+        The copy shares this table's storage, which is only copied (once) by the next
+        write to this table, and only if the snapshot is still in use by then.
+
+        :complexity: O(1), plus O(N) for the first write while the snapshot is in use,
+        where N is self.table_size.
+        """
+        if self.snapshot_ref is not None and self.snapshot_ref() is not None:
+            # Nothing has been written since, so it still matches.
+            return self.snapshot_ref()
+        snapshot = copy(self)
+        snapshot.read_only = True
+        snapshot.snapshot_ref = None
+        snapshot.probe_stats = None
+        self.snapshot_ref = weakref.ref(snapshot)
+        return snapshot
+
+    def _before_write(self) -> None:
+        """
+        Called before anything in the table's storage is changed: stops a snapshot
+        from being written to, and unshares the storage of one that is still in use.
+
+        :complexity: O(1), or O(N) to unshare, where N is self.table_size.
+        :raises TypeError: when the table is a snapshot.
+        """
+        if self.read_only:
+            raise TypeError("Snapshots are read-only.")
+        if self.snapshot_ref is not None:
+            if self.snapshot_ref() is not None:
+                self._unshare()
+            self.snapshot_ref = None
+
+    def _unshare(self) -> None:
+        """
+        Replace the storage with a copy, leaving the original to a snapshot.
+
+        :complexity: O(N) where N is self.table_size.
+        """
+        self.array = self.array.copy()
+
+    def iter_keys(self) -> Iterator[K]:
+        """
+        Returns an iterator of all keys in the hash table.
+
+        :complexity: O(N) over the whole iteration, where N is self.table_size.
+        """
+        for key, _ in self.items():
+            yield key
+
+    def iter_values(self) -> Iterator[V]:
+        """
+        Returns an iterator of all values in the hash table.
+
+        :complexity: O(N) over the whole iteration, where N is self.table_size.
+        """
+        for _, value in self.items():
+            yield value
+
     def __contains__(self, key: K) -> bool:
         """
         Checks to see if the given key is in the Hash Table
@@ -142,8 +435,27 @@ class LinearProbeTable(Generic[K, V]):
         :complexity: See linear probe.
         :raises KeyError: when the key doesn't exist.
         """
-        position = self._linear_probe(key, False)
-        return self.array[position][1]
+        return self._get(key, self._key_digest(key))
+
+    def _get(self, key: K, digest: int | None) -> V:
+        """
+        Get the value at key, given its (possibly None) digest.
+
+        :complexity: See _probe.
+        :raises KeyError: when the key doesn't exist.
+        """
+        return self.array[self._probe(key, digest, False)][1]
+
+    def get_many(self, keys: Iterable[K]) -> list[V]:
+        """
+        Get the values at each of keys, in order, hashing all the keys in one batch first.
+
+        :complexity: O(L + N) with no probing, where L is the total length of the keys
+        and N the number of keys. See linear probe.
+        :raises KeyError: when any of the keys doesn't exist.
+        """
+        keys = list(keys)
+        return [self._get(key, digest) for key, digest in zip(keys, self._key_digests(keys))]
 
     def __setitem__(self, key: K, data: V) -> None:
         """
@@ -152,38 +464,104 @@ class LinearProbeTable(Generic[K, V]):
         :complexity: See linear probe.
         :raises FullError: when the table cannot be resized further.
         """
+        self._set(key, data, self._key_digest(key))
 
-        position = self._linear_probe(key, True)
+    def _set(self, key: K, data: V, digest: int | None) -> None:
+        """
+        Set the value at key, given its (possibly None) digest.
 
-        if self.array[position] is None:
+        :complexity: See _probe.
+        :raises FullError: when the table cannot be resized further.
+        """
+        self._before_write()
+        position = self._probe(key, digest, True)
+
+        item = self.array[position]
+        if item is None or item is TOMBSTONE:
+            if item is TOMBSTONE:
+                self.tombstone_count -= 1
             self.count += 1
+            self.version += 1
 
-        self.array[position] = (key, data)
+        self.array[position] = (key, data, digest)
 
-        if len(self) > self.table_size / 2:
+        if len(self) > self.table_size * self.max_load_factor:
             self._rehash()
 
     def __delitem__(self, key: K) -> None:
         """
         Deletes a (key, value) pair in our hash table.
 
+        With tombstones, only the probe for key is needed (plus the occasional compaction).
+
         :complexity best: O(hash(key)) deleting item is not probed and in correct spot.
         :complexity worst: O(N*hash(key)+N^2*comp(K)) deleting item is midway through large chain.
         :raises KeyError: when the key doesn't exist.
         """
+        self._before_write()
         position = self._linear_probe(key, False)
-        # Remove the element
-        self.array[position] = None
         self.count -= 1
-        # Start moving over the cluster
-        position = (position + 1) % self.table_size
-        while self.array[position] is not None:
-            key2, value = self.array[position]
+        self.version += 1
+        if self.use_tombstones:
+            self._bury(position)
+        else:
+            # Remove the element
             self.array[position] = None
-            # Reinsert.
-            newpos = self._linear_probe(key2, True)
-            self.array[newpos] = (key2, value)
+            # Start moving over the cluster
             position = (position + 1) % self.table_size
+            while self.array[position] is not None:
+                item = self.array[position]
+                self.array[position] = None
+                # Reinsert, reusing the cached digest.
+                self._place(item)
+                position = (position + 1) % self.table_size
+        self._check_shrink()
+
+    def _bury(self, position: int) -> None:
+        """
+        Replace the entry at position with a tombstone, compacting the table if
+        there are now too many of them.
+        A tombstone directly before an empty slot ends no probe early, so it is
+        cleared along with any tombstones just before it.
+
+        :complexity: O(1) amortised.
+        """
+        if self.array[(position + 1) % self.table_size] is None:
+            self.array[position] = None
+            position = (position - 1) % self.table_size
+            while self.array[position] is TOMBSTONE:
+                self.array[position] = None
+                self.tombstone_count -= 1
+                position = (position - 1) % self.table_size
+            return
+        self.array[position] = TOMBSTONE
+        self.tombstone_count += 1
+        if self.tombstone_count > self.table_size * self.tombstone_threshold:
+            self._compact()
+
+    def _check_shrink(self) -> None:
+        """
+        Once fewer than min_load_factor of the slots are in use, shrink to the smallest
+        size that is at most half of max_load_factor full, leaving room to grow again.
+
+        :complexity: O(1) when not shrinking, otherwise see _rebuild.
+        """
+        if len(self) >= self.table_size * self.min_load_factor or self.size_index == 0:
+            return
+        size_index = self.size_index
+        while size_index > 0 and len(self) <= self.TABLE_SIZES[size_index - 1] * self.max_load_factor / 2:
+            size_index -= 1
+        if size_index != self.size_index:
+            self.size_index = size_index
+            self._resize(self.TABLE_SIZES[size_index])
+
+    def _compact(self) -> None:
+        """
+        Drop all tombstones by reinserting the live entries into a fresh array of the same size.
+
+        :complexity: O(N) with no probing, O(N^2) with lots of probing, where N is the tablesize.
+        """
+        self._resize(self.table_size)
 
     def is_empty(self) -> bool:
         return self.count == 0
@@ -195,21 +573,89 @@ class LinearProbeTable(Generic[K, V]):
         """
         Need to resize table and reinsert all values
 
-        :complexity best: O(N*hash(K)) No probing.
-        :complexity worst: O(N*hash(K) + N^2*comp(K)) Lots of probing.
+        Keys are not rehashed: each entry is placed using its cached digest.
+
+        :complexity best: O(N) No probing.
+        :complexity worst: O(N^2) Lots of probing.
         Where N is len(self)
         """
-        old_array = self.array
-        self.size_index += 1
-        if self.size_index == len(self.TABLE_SIZES):
+        if not self._has_size(self.size_index + 1):
             # Cannot be resized further.
             return
-        self.array = ArrayR(self.TABLE_SIZES[self.size_index])
-        self.count = 0
+        self.size_index += 1
+        self._resize(self.TABLE_SIZES[self.size_index])
+
+    def _resize(self, new_size: int) -> None:
+        """
+        Rebuild the table with new_size slots, timing it when instrumented.
+
+        :complexity: See _rebuild.
+        """
+        self.version += 1
+        if self.probe_stats is None:
+            self._rebuild(new_size)
+        else:
+            start = perf_counter()
+            self._rebuild(new_size)
+            self.probe_stats.record_rehash(perf_counter() - start)
+
+    def _rebuild(self, new_size: int) -> None:
+        """
+        Move every live entry into a fresh array of new_size slots, dropping tombstones.
+
+        :complexity: O(N) with no probing, O(N^2) with lots of probing, where N is len(self).
+        """
+        old_array = self.array
+        self.array = ArrayR(new_size)
+        self.tombstone_count = 0
         for item in old_array:
-            if item is not None:
-                key, value = item
-                self[key] = value
+            if item is not None and item is not TOMBSTONE:
+                self._place(item)
+
+    def _place(self, item: tuple[K, V, int | None]) -> None:
+        """
+        Put an entry whose key is known not to be in the table into the first free slot
+        from its home position. No keys are compared and the count is left unchanged.
+
+        :complexity best: O(1) with a cached digest, O(hash(key)) otherwise.
+        :complexity worst: O(N) where N is the tablesize.
+        """
+        position = self._home(item[0], item[2])
+        while self.array[position] is not None:
+            position = (position + 1) % self.table_size
+        self.array[position] = item
+
+    def instrument(self, enabled: bool = True) -> None:
+        """
+        Start recording probe and resize statistics from scratch, or stop recording them.
+        """
+        self.probe_stats = ProbeStats() if enabled else None
+
+    def _in_use(self, position: int) -> bool:
+        """
+        Whether the slot at position holds an entry or a tombstone, i.e. extends a cluster.
+        """
+        return self.array[position] is not None
+
+    def stats(self) -> dict:
+        """
+        Returns the table size, number of entries and tombstones, load factor and the
+        number of clusters of each length. If instrumented, also the histograms of
+        probe lengths for hits and misses, the number of collisions, and the number
+        of and total seconds spent in resizes.
+
+        :complexity: O(N) where N is self.table_size.
+        """
+        res = {
+            "table_size": self.table_size,
+            "count": len(self),
+            "tombstones": self.tombstone_count,
+            "load_factor": len(self) / self.table_size,
+            "cluster_lengths": cluster_lengths(self._in_use(position) for position in range(self.table_size)),
+        }
+        if self.probe_stats is not None:
+            res.update(self.probe_stats.as_dict())
+        return res
 
     def __str__(self) -> str:
         """
@@ -219,7 +665,7 @@ class LinearProbeTable(Generic[K, V]):
         """
         result = ""
         for item in self.array:
-            if item is not None:
-                (key, value) = item
+            if item is not None and item is not TOMBSTONE:
+                key, value = item[0], item[1]
                 result += "(" + str(key) + "," + str(value) + ")\n"
         return result
@@ -0,0 +1,287 @@
+""" Incrementally Resized Hash Table
+
+Defines a Hash Table using Linear Probing for conflict resolution, which
+spreads the work of each resize over the operations that follow it.
+"""
+from __future__ import annotations
+
+from time import perf_counter
+from typing import TypeVar, Iterator
+from data_structures.hash_table import LinearProbeTable, TOMBSTONE
+from data_structures.referential_array import ArrayR
+
+K = TypeVar('K')
+V = TypeVar('V')
+
+
+class IncrementalRehashTable(LinearProbeTable[K, V]):
+    """
+    Incremental Rehash Table.
+
+    A Linear Probe Table whose resize only allocates the new array. The old array
+    is kept alongside it, and every later operation moves the next
+    MIGRATION_STEP slots of the old array across, until it is empty and dropped.
+    Until then each key lives in exactly one of the two arrays: new keys always
+    go into the new array, and lookups that miss it check the old one.
+    Entries leaving the old array are replaced by tombstones, so the probe
+    chains of the entries still in it stay intact.
+
+    Positions always come from `digest`, so that keys can be found in both arrays:
+    overwrite `digest` rather than `hash` for other key types.
+
+    Type Arguments:
+        - K:    Key Type. In most cases should be string.
+                Otherwise `digest` should be overwritten.
+        - V:    Value Type.
+
+    Unless stated otherwise, all methods have O(1) complexity.
+    """
+
+    # Number of old slots moved per operation. Moving at least two per insert
+    # empties the old array before the new one needs to grow, at the default load factor.
+    MIGRATION_STEP = 16
+
+    def __init__(self, sizes=None, tombstones: bool = False, tombstone_threshold: float = 0.25,
+                 max_load_factor: float = 0.5, min_load_factor: float = 0.0) -> None:
+        """
+        Initialise the Hash Table.
+
+        :param tombstones: delete lazily with tombstones instead of shifting clusters.
+        :param tombstone_threshold: fraction of slots holding tombstones above which the table is compacted.
+        :param max_load_factor: fraction of slots in use above which the table grows.
+        :param min_load_factor: fraction of slots in use below which the table shrinks.
+        :raises ValueError: when the load factors could make the table grow and shrink back and forth.
+        """
+        LinearProbeTable.__init__(self, sizes, tombstones, tombstone_threshold, max_load_factor, min_load_factor)
+        self.old_array: ArrayR[tuple[K, V, int]] | None = None
+        self.migrate_position = 0
+
+    def _key_digest(self, key: K) -> int:
+        """
+        :complexity: O(len(key))
+        """
+        return self.digest(key)
+
+    def _key_digests(self, keys: list[K]) -> list[int]:
+        """
+        :complexity: O(L) where L is the total length of the keys.
+        """
+        return self._digests(keys)
+
+    def is_migrating(self) -> bool:
+        """
+        Whether entries are still being moved out of the old array.
+        """
+        return self.old_array is not None
+
+    def _migrate(self, slots: int | None = None) -> None:
+        """
+        Move the next slots entries of the old array (all of them if slots is None)
+        into the current array.
+
+        :complexity: O(slots) with no probing, O(slots*N) with lots of probing.
+        """
+        if self.old_array is None:
+            return
+        self._before_write()
+        self.version += 1
+        old_size = len(self.old_array)
+        end = old_size if slots is None else min(old_size, self.migrate_position + slots)
+        for position in range(self.migrate_position, end):
+            item = self.old_array[position]
+            if item is not None and item is not TOMBSTONE:
+                self.old_array[position] = TOMBSTONE
+                self._place(item)
+        self.migrate_position = end
+        if end == old_size:
+            self.old_array = None
+
+    def _probe_old(self, key: K, digest: int) -> int:
+        """
+        Find the position of key in the old array.
+
+        :complexity: See linear probe.
+        :raises KeyError: When the key is not in the old array (or there is none).
+        """
+        if self.old_array is None:
+            raise KeyError(key)
+        old_size = len(self.old_array)
+        position = digest % old_size
+        for _ in range(old_size):
+            item = self.old_array[position]
+            if item is None:
+                break
+            elif item is not TOMBSTONE and item[2] == digest and item[0] == key:
+                return position
+            position = (position + 1) % old_size
+        raise KeyError(key)
+
+    def _get(self, key: K, digest: int) -> V:
+        """
+        Get the value at key, given its digest.
+
+        :complexity: See linear probe, plus the migration step.
+        :raises KeyError: when the key doesn't exist.
+        """
+        self._migrate(self.MIGRATION_STEP)
+        try:
+            return self.array[self._probe(key, digest, False)][1]
+        except KeyError:
+            return self.old_array[self._probe_old(key, digest)][1]
+
+    def _set(self, key: K, data: V, digest: int) -> None:
+        """
+        Set the value at key, given its digest.
+
+        :complexity: See linear probe, plus the migration step.
+        :raises FullError: when the table cannot be resized further.
+        """
+        self._before_write()
+        self._migrate(self.MIGRATION_STEP)
+        position = self._probe(key, digest, True)
+
+        item = self.array[position]
+        if item is None or item is TOMBSTONE:
+            if item is TOMBSTONE:
+                self.tombstone_count -= 1
+            self.version += 1
+            try:
+                # Take the key out of the old array instead of counting it again.
+                self.old_array[self._probe_old(key, digest)] = TOMBSTONE
+            except KeyError:
+                self.count += 1
+
+        self.array[position] = (key, data, digest)
+
+        if len(self) > self.table_size * self.max_load_factor:
+            self._rehash()
+
+    def __delitem__(self, key: K) -> None:
+        """
+        Deletes a (key, value) pair in our hash table.
+
+        :complexity: See LinearProbeTable.__delitem__, plus the migration step.
+        :raises KeyError: when the key doesn't exist.
+        """
+        self._before_write()
+        self._migrate(self.MIGRATION_STEP)
+        try:
+            LinearProbeTable.__delitem__(self, key)
+        except KeyError:
+            self.old_array[self._probe_old(key, self._key_digest(key))] = TOMBSTONE
+            self.count -= 1
+            self.version += 1
+            self._check_shrink()
+
+    def _rehash(self) -> None:
+        """
+        Start moving the table into the next size up.
+        Any migration still in progress is finished first.
+        When instrumented, only the time spent here is recorded, not the migration steps.
+
+        :complexity: O(N) to allocate the new array, where N is the new tablesize.
+        """
+        start = perf_counter()
+        self._migrate()
+        if not self._has_size(self.size_index + 1):
+            # Cannot be resized further.
+            return
+        self.size_index += 1
+        self.version += 1
+        self.old_array = self.array
+        self.migrate_position = 0
+        self.array = ArrayR(self.TABLE_SIZES[self.size_index])
+        self.tombstone_count = 0
+        if self.probe_stats is not None:
+            self.probe_stats.record_rehash(perf_counter() - start)
+
+    def _rebuild(self, new_size: int) -> None:
+        """
+        Finish any migration, then move every entry into a fresh array of new_size slots in one go.
+        Used for presizing, shrinking and compaction, which are not spread out.
+
+        :complexity: O(N) with no probing, O(N^2) with lots of probing, where N is len(self).
+        """
+        self._migrate()
+        LinearProbeTable._rebuild(self, new_size)
+
+    def _items(self) -> list[tuple[K, V, int]]:
+        """
+        Returns all entries, from both arrays.
+
+        :complexity: O(N) where N is the sum of both tablesizes.
+        """
+        res = []
+        for array in (self.array, self.old_array):
+            if array is not None:
+                for item in array:
+                    if item is not None and item is not TOMBSTONE:
+                        res.append(item)
+        return res
+
+    def items(self) -> Iterator[tuple[K, V]]:
+        """
+        Returns an iterator of all (key, value) pairs. Any migration is finished first,
+        so that lookups during the iteration do not move entries.
+
+        :complexity: O(N) over the whole iteration, where N is the tablesize, plus the rest of the migration.
+        :raises ConcurrentModificationError: when keys are added or removed during the iteration.
+        """
+        self._migrate()
+        yield from LinearProbeTable.items(self)
+
+    def snapshot(self) -> IncrementalRehashTable[K, V]:
+        """
+        Finish any migration, then see LinearProbeTable.snapshot.
+
+        :complexity: O(1), plus the rest of the migration.
+        """
+        self._migrate()
+        return LinearProbeTable.snapshot(self)
+
+    def _unshare(self) -> None:
+        """
+        Replace the storage with a copy, leaving the original to a snapshot.
+
+        :complexity: O(N) where N is the sum of both tablesizes.
+        """
+        self.array = self.array.copy()
+        if self.old_array is not None:
+            self.old_array = self.old_array.copy()
+
+    def stats(self) -> dict:
+        """
+        Finish any migration, so that every entry is counted in the current
+        array, then see LinearProbeTable.stats.
+
+        :complexity: O(N) where N is self.table_size, plus the rest of the migration.
+        """
+        self._migrate()
+        return LinearProbeTable.stats(self)
+
+    def keys(self) -> list[K]:
+        """
+        Returns all keys in the hash table.
+
+        :complexity: O(N) where N is the sum of both tablesizes.
+        """
+        return [item[0] for item in self._items()]
+
+    def values(self) -> list[V]:
+        """
+        Returns all values in the hash table.
+
+        :complexity: O(N) where N is the sum of both tablesizes.
+        """
+        return [item[1] for item in self._items()]
+
+    def __str__(self) -> str:
+        """
+        Returns all they key/value pairs in our hash table (no particular
+        order).
+        :complexity: O(N * (str(key) + str(value))) where N is the sum of both tablesizes
+        """
+        result = ""
+        for key, value, _ in self._items():
+            result += "(" + str(key) + "," + str(value) + ")\n"
+        return result
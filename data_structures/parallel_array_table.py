@@ -0,0 +1,293 @@
+""" Parallel Array Hash Table
+
+Defines a Hash Table using Linear Probing for conflict resolution, which
+stores its keys, values and digests in three parallel arrays rather than
+one array of entry tuples.
+"""
+from __future__ import annotations
+
+from copy import copy
+from ctypes import c_int64
+from typing import TypeVar, Iterator
+from data_structures.hash_table import LinearProbeTable, FullError, TOMBSTONE
+
+K = TypeVar('K')
+V = TypeVar('V')
+
+
+class ParallelArrayTable(LinearProbeTable[K, V]):
+    """
+    Parallel Array Table.
+
+    Behaves exactly like a LinearProbeTable (including the tombstone option), but
+    slot i is spread over key_array[i], value_array[i] and hash_array[i].
+    The digest array holds raw 64 bit integers, so inserts, updates and resizes
+    allocate no objects per entry.
+
+    Keys and values are kept in plain lists rather than ArrayR: a ctypes py_object
+    array records every reference stored in it in a dictionary keyed by the index
+    string, which costs around 100 bytes on each write.
+
+    Type Arguments:
+        - K:    Key Type. In most cases should be string.
+                Otherwise `hash` should be overwritten.
+        - V:    Value Type.
+
+    Unless stated otherwise, all methods have O(1) complexity.
+    """
+
+    # Stored in hash_array for keys without a cached digest (when `hash` is overwritten).
+    NO_DIGEST = -1
+
+    def __init__(self, sizes=None, tombstones: bool = False, tombstone_threshold: float = 0.25,
+                 max_load_factor: float = 0.5, min_load_factor: float = 0.0) -> None:
+        """
+        Initialise the Hash Table.
+
+        :param tombstones: delete lazily with tombstones instead of shifting clusters.
+        :param tombstone_threshold: fraction of slots holding tombstones above which the table is compacted.
+        :param max_load_factor: fraction of slots in use above which the table grows.
+        :param min_load_factor: fraction of slots in use below which the table shrinks.
+        :raises ValueError: when the load factors could make the table grow and shrink back and forth.
+        """
+        LinearProbeTable.__init__(self, sizes, tombstones, tombstone_threshold, max_load_factor, min_load_factor)
+        del self.array
+        self._allocate(self.TABLE_SIZES[self.size_index])
+
+    def _allocate(self, size: int) -> None:
+        """
+        Replace the storage with size empty slots.
+
+        :complexity: O(size)
+        """
+        self.key_array: list[K] = [None] * size
+        self.value_array: list[V] = [None] * size
+        self.hash_array = (size * c_int64)()
+
+    @property
+    def table_size(self) -> int:
+        return len(self.key_array)
+
+    def _probe(self, key: K, digest: int | None, is_insert: bool) -> int:
+        """
+        Linear probe for key, given its (possibly None) digest.
+        Slots with a different cached digest are skipped without comparing keys.
+        Tombstones are probed past, and the first one seen is reused for an insert.
+
+        :complexity: See LinearProbeTable._probe.
+        :raises KeyError: When the key is not in the table, but is_insert is False.
+        :raises FullError: When a table is full and cannot be inserted.
+        """
+        position = self._home(key, digest)
+        free_position = None
+
+        for probes in range(self.table_size):
+            slot_key = self.key_array[position]
+            if slot_key is None:
+                if self.probe_stats is not None:
+                    self.probe_stats.record_probe(probes, False, is_insert)
+                if is_insert:
+                    return position if free_position is None else free_position
+                else:
+                    raise KeyError(key)
+            elif slot_key is TOMBSTONE:
+                if free_position is None:
+                    free_position = position
+            elif (digest is None or self.hash_array[position] == digest) and slot_key == key:
+                if self.probe_stats is not None:
+                    self.probe_stats.record_probe(probes, True, is_insert)
+                return position
+            position = (position + 1) % self.table_size
+
+        if is_insert:
+            if free_position is not None:
+                return free_position
+            raise FullError("Table is full!")
+        else:
+            raise KeyError(key)
+
+    def keys(self) -> list[K]:
+        """
+        Returns all keys in the hash table.
+
+        :complexity: O(N) where N is self.table_size.
+        """
+        res = []
+        for x in range(self.table_size):
+            key = self.key_array[x]
+            if key is not None and key is not TOMBSTONE:
+                res.append(key)
+        return res
+
+    def values(self) -> list[V]:
+        """
+        Returns all values in the hash table.
+
+        :complexity: O(N) where N is self.table_size.
+        """
+        res = []
+        for x in range(self.table_size):
+            key = self.key_array[x]
+            if key is not None and key is not TOMBSTONE:
+                res.append(self.value_array[x])
+        return res
+
+    def items(self) -> Iterator[tuple[K, V]]:
+        """
+        Returns an iterator of all (key, value) pairs in the hash table.
+
+        :complexity: O(N) over the whole iteration, where N is self.table_size.
+        :raises ConcurrentModificationError: when keys are added or removed during the iteration.
+        """
+        version = self.version
+        for x in range(self.table_size):
+            self._check_version(version)
+            key = self.key_array[x]
+            if key is not None and key is not TOMBSTONE:
+                yield key, self.value_array[x]
+        self._check_version(version)
+
+    def _get(self, key: K, digest: int | None) -> V:
+        """
+        Get the value at key, given its (possibly None) digest.
+
+        :complexity: See _probe.
+        :raises KeyError: when the key doesn't exist.
+        """
+        return self.value_array[self._probe(key, digest, False)]
+
+    def _set(self, key: K, data: V, digest: int | None) -> None:
+        """
+        Set the value at key, given its (possibly None) digest.
+
+        :complexity: See _probe.
+        :raises FullError: when the table cannot be resized further.
+        """
+        self._before_write()
+        position = self._probe(key, digest, True)
+
+        slot_key = self.key_array[position]
+        if slot_key is None or slot_key is TOMBSTONE:
+            if slot_key is TOMBSTONE:
+                self.tombstone_count -= 1
+            self.count += 1
+            self.version += 1
+            self.key_array[position] = key
+            self.hash_array[position] = self.NO_DIGEST if digest is None else digest
+        self.value_array[position] = data
+
+        if len(self) > self.table_size * self.max_load_factor:
+            self._rehash()
+
+    def __delitem__(self, key: K) -> None:
+        """
+        Deletes a (key, value) pair in our hash table.
+
+        :complexity: See LinearProbeTable.__delitem__.
+        :raises KeyError: when the key doesn't exist.
+        """
+        self._before_write()
+        position = self._linear_probe(key, False)
+        self.count -= 1
+        self.version += 1
+        self.value_array[position] = None
+        if self.use_tombstones:
+            self._bury(position)
+        else:
+            self.key_array[position] = None
+            # Start moving over the cluster
+            position = (position + 1) % self.table_size
+            while self.key_array[position] is not None:
+                slot = self._take(position)
+                self._place(*slot)
+                position = (position + 1) % self.table_size
+        self._check_shrink()
+
+    def _bury(self, position: int) -> None:
+        """
+        Replace the key at position with a tombstone, compacting the table if
+        there are now too many of them.
+
+        :complexity: O(1) amortised.
+        """
+        if self.key_array[(position + 1) % self.table_size] is None:
+            self.key_array[position] = None
+            position = (position - 1) % self.table_size
+            while self.key_array[position] is TOMBSTONE:
+                self.key_array[position] = None
+                self.tombstone_count -= 1
+                position = (position - 1) % self.table_size
+            return
+        self.key_array[position] = TOMBSTONE
+        self.tombstone_count += 1
+        if self.tombstone_count > self.table_size * self.tombstone_threshold:
+            self._compact()
+
+    def _in_use(self, position: int) -> bool:
+        """
+        Whether the slot at position holds a key or a tombstone.
+        """
+        return self.key_array[position] is not None
+
+    def _unshare(self) -> None:
+        """
+        Replace the storage with a copy, leaving the original to a snapshot.
+
+        :complexity: O(N) where N is self.table_size.
+        """
+        self.key_array = self.key_array[:]
+        self.value_array = self.value_array[:]
+        self.hash_array = copy(self.hash_array)
+
+    def _take(self, position: int) -> tuple[K, V, int]:
+        """
+        Empty the slot at position, returning its key, value and raw digest.
+
+        :complexity: O(1)
+        """
+        slot = self.key_array[position], self.value_array[position], self.hash_array[position]
+        self.key_array[position] = None
+        self.value_array[position] = None
+        return slot
+
+    def _rebuild(self, new_size: int) -> None:
+        """
+        Move every live slot into fresh arrays of new_size slots, dropping tombstones.
+
+        :complexity: O(N) with no probing, O(N^2) with lots of probing, where N is len(self).
+        """
+        key_array, value_array, hash_array = self.key_array, self.value_array, self.hash_array
+        self._allocate(new_size)
+        self.tombstone_count = 0
+        for x in range(len(key_array)):
+            key = key_array[x]
+            if key is not None and key is not TOMBSTONE:
+                self._place(key, value_array[x], hash_array[x])
+
+    def _place(self, key: K, value: V, digest: int) -> None:
+        """
+        Put a key known not to be in the table into the first free slot from its
+        home position. No keys are compared and the count is left unchanged.
+
+        :complexity best: O(1) with a cached digest, O(hash(key)) otherwise.
+        :complexity worst: O(N) where N is the tablesize.
+        """
+        position = self._home(key, None if digest == self.NO_DIGEST else digest)
+        while self.key_array[position] is not None:
+            position = (position + 1) % self.table_size
+        self.key_array[position] = key
+        self.value_array[position] = value
+        self.hash_array[position] = digest
+
+    def __str__(self) -> str:
+        """
+        Returns all they key/value pairs in our hash table (no particular
+        order).
+        :complexity: O(N * (str(key) + str(value))) where N is the table size
+        """
+        result = ""
+        for x in range(self.table_size):
+            key = self.key_array[x]
+            if key is not None and key is not TOMBSTONE:
+                result += "(" + str(key) + "," + str(self.value_array[x]) + ")\n"
+        return result
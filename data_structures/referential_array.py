@@ -31,7 +31,7 @@ class ArrayR(Generic[T]):
         if length <= 0:
             raise ValueError("Array length should be larger than 0.")
         self.array = (length * py_object)() # initialises the space
-        self.array[:] =  [None for _ in range(length)]
+        self.array[:] = [None] * length
 
     def __len__(self) -> int:
         """ Returns the length of the array
@@ -53,3 +53,11 @@ class ArrayR(Generic[T]):
         """
         self.array[index] = value
 
+
+    def copy(self) -> "ArrayR[T]":
+        """ Returns a new array holding the same references
+        :complexity: O(length) for best/worst case
+        """
+        res = ArrayR(len(self))
+        res.array[:] = self.array[:]
+        return res
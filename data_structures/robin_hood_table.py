@@ -0,0 +1,164 @@
+""" Robin Hood Hash Table
+
+Defines a Hash Table using Linear Probing with Robin Hood displacement
+for conflict resolution.
+"""
+from __future__ import annotations
+
+from typing import TypeVar
+from data_structures.hash_table import LinearProbeTable, FullError
+
+K = TypeVar('K')
+V = TypeVar('V')
+
+
+class RobinHoodTable(LinearProbeTable[K, V]):
+    """
+    Robin Hood Table.
+
+    A Linear Probe Table where entries in each cluster are kept ordered by home
+    position. An insert takes the slot of the first entry that is closer to its
+    home than the new key would be, shifting the rest of the cluster along,
+    and a delete shifts the following entries back.
+    This evens out probe lengths, and a lookup for a missing key can stop as soon
+    as it passes where the key would have been.
+
+    Type Arguments:
+        - K:    Key Type. In most cases should be string.
+                Otherwise `hash` should be overwritten.
+        - V:    Value Type.
+
+    Unless stated otherwise, all methods have O(1) complexity.
+    """
+
+    def __init__(self, sizes=None, tombstones: bool = False, tombstone_threshold: float = 0.25,
+                 max_load_factor: float = 0.5, min_load_factor: float = 0.0) -> None:
+        """
+        Initialise the Hash Table.
+
+        :param tombstones: must be False, a delete always shifts the cluster back.
+        :param tombstone_threshold: unused, kept so the arguments line up with LinearProbeTable.
+        :param max_load_factor: fraction of slots in use above which the table grows.
+        :param min_load_factor: fraction of slots in use below which the table shrinks.
+        :raises ValueError: when tombstones are asked for, as they would break the ordering of clusters.
+        :raises ValueError: when the load factors could make the table grow and shrink back and forth.
+        """
+        if tombstones:
+            raise ValueError("RobinHoodTable does not support tombstones.")
+        LinearProbeTable.__init__(self, sizes, tombstones, tombstone_threshold, max_load_factor, min_load_factor)
+
+    def _displacement(self, position: int) -> int:
+        """
+        How far the entry at position is from its home position.
+
+        :complexity: O(1) with a cached digest, O(hash(key)) otherwise.
+        """
+        item = self.array[position]
+        return (position - self._home(item[0], item[2])) % self.table_size
+
+    def _probe(self, key: K, digest: int | None, is_insert: bool) -> int:
+        """
+        Robin Hood probe for key, given its (possibly None) digest.
+
+        Returns the position of key if it is present. Otherwise, when inserting,
+        returns the position key should take, which may currently hold an entry
+        that is closer to its own home.
+
+        :complexity best: O(1) first position is empty
+        :complexity worst: O(D*comp(K)) where D is the longest displacement in the table
+        :raises KeyError: When the key is not in the table, but is_insert is False.
+        :raises FullError: When a table is full and cannot be inserted.
+        """
+        position = self._home(key, digest)
+
+        for distance in range(self.table_size):
+            item = self.array[position]
+            if item is None or self._displacement(position) < distance:
+                if self.probe_stats is not None:
+                    self.probe_stats.record_probe(distance, False, is_insert)
+                # Key would have been placed here.
+                if is_insert:
+                    return position
+                else:
+                    raise KeyError(key)
+            elif (digest is None or item[2] == digest) and item[0] == key:
+                if self.probe_stats is not None:
+                    self.probe_stats.record_probe(distance, True, is_insert)
+                return position
+            position = (position + 1) % self.table_size
+
+        if is_insert:
+            raise FullError("Table is full!")
+        else:
+            raise KeyError(key)
+
+    def _set(self, key: K, data: V, digest: int | None) -> None:
+        """
+        Set the value at key, given its (possibly None) digest.
+
+        :complexity: See probe, plus O(C) to shift the rest of the cluster C on a new key.
+        :raises FullError: when the table cannot be resized further.
+        """
+        self._before_write()
+        position = self._probe(key, digest, True)
+
+        item = self.array[position]
+        if item is not None and (digest is None or item[2] == digest) and item[0] == key:
+            self.array[position] = (key, data, digest)
+            return
+
+        self._shift_in(position, (key, data, digest))
+        self.count += 1
+        self.version += 1
+
+        if len(self) > self.table_size * self.max_load_factor:
+            self._rehash()
+
+    def __delitem__(self, key: K) -> None:
+        """
+        Deletes a (key, value) pair in our hash table, shifting back the entries
+        after it that are not in their home position.
+
+        :complexity: See probe, plus O(C) where C is the rest of the cluster.
+        :raises KeyError: when the key doesn't exist.
+        """
+        self._before_write()
+        position = self._linear_probe(key, False)
+        self.count -= 1
+        self.version += 1
+
+        following = (position + 1) % self.table_size
+        while self.array[following] is not None and self._displacement(following) > 0:
+            self.array[position] = self.array[following]
+            position = following
+            following = (following + 1) % self.table_size
+        self.array[position] = None
+        self._check_shrink()
+
+    def _shift_in(self, position: int, item: tuple[K, V, int | None]) -> None:
+        """
+        Put item at position, moving the entries from there up to the next empty slot along by one.
+
+        :complexity: O(C) where C is the rest of the cluster.
+        :raises FullError: when there is no empty slot.
+        """
+        for _ in range(self.table_size):
+            item, self.array[position] = self.array[position], item
+            if item is None:
+                return
+            position = (position + 1) % self.table_size
+        raise FullError("Table is full!")
+
+    def _place(self, item: tuple[K, V, int | None]) -> None:
+        """
+        Put an entry whose key is known not to be in the table into its Robin Hood position.
+        No keys are compared and the count is left unchanged.
+
+        :complexity: O(D + C) where D is the displacement of the entry and C the rest of its cluster.
+        """
+        position = self._home(item[0], item[2])
+        distance = 0
+        while self.array[position] is not None and self._displacement(position) >= distance:
+            position = (position + 1) % self.table_size
+            distance += 1
+        self._shift_in(position, item)
@@ -0,0 +1,80 @@
+""" Hash Table Statistics
+
+Counters the hash tables fill in while instrumented, and helpers to
+summarise their layout on demand.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Iterable
+
+
+@dataclass
+class ProbeStats:
+    """
+    Counters recorded by an instrumented hash table.
+
+    A probe length is the number of slots inspected past the home slot.
+    Hits are probes that found their key (including updates), misses are
+    lookups that did not and inserts of new keys. A collision is an insert
+    of a new key whose home slot was already taken.
+    """
+
+    hits: dict[int, int] = field(default_factory=dict)
+    misses: dict[int, int] = field(default_factory=dict)
+    collisions: int = 0
+    rehashes: int = 0
+    rehash_time: float = 0.0
+
+    def record_probe(self, length: int, found: bool, is_insert: bool) -> None:
+        """
+        :complexity: O(1)
+        """
+        histogram = self.hits if found else self.misses
+        histogram[length] = histogram.get(length, 0) + 1
+        if is_insert and not found and length > 0:
+            self.collisions += 1
+
+    def record_rehash(self, seconds: float) -> None:
+        """
+        :complexity: O(1)
+        """
+        self.rehashes += 1
+        self.rehash_time += seconds
+
+    def as_dict(self) -> dict:
+        """
+        :complexity: O(H) where H is the number of distinct probe lengths.
+        """
+        return {
+            "hit_probe_lengths": dict(sorted(self.hits.items())),
+            "miss_probe_lengths": dict(sorted(self.misses.items())),
+            "collisions": self.collisions,
+            "rehashes": self.rehashes,
+            "rehash_time": self.rehash_time,
+        }
+
+
+def cluster_lengths(in_use: Iterable[bool]) -> dict[int, int]:
+    """
+    Returns how many clusters (maximal runs of slots in use, wrapping around
+    the end of the table) there are of each length.
+
+    :complexity: O(N) where N is the number of slots.
+    """
+    in_use = list(in_use)
+    if all(in_use):
+        return {len(in_use): 1} if in_use else {}
+    # Start just after an unused slot, so no cluster is split by the wrap around.
+    start = in_use.index(False) + 1
+    res = {}
+    length = 0
+    for offset in range(len(in_use)):
+        if in_use[(start + offset) % len(in_use)]:
+            length += 1
+        elif length > 0:
+            res[length] = res.get(length, 0) + 1
+            length = 0
+    if length > 0:
+        res[length] = res.get(length, 0) + 1
+    return dict(sorted(res.items()))
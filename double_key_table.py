@@ -1,14 +1,505 @@
 from __future__ import annotations
 
-from typing import Generic, TypeVar, Iterator
-from data_structures.hash_table import LinearProbeTable, FullError
+from bisect import bisect_left, insort
+import weakref
+from copy import copy
+from time import perf_counter
+from typing import Generic, TypeVar, Iterable, Iterator
+from data_structures.batch_hash import hash_many
+from data_structures.hash_table import LinearProbeTable, FullError, ConcurrentModificationError
 from data_structures.referential_array import ArrayR
+from algorithms.primes import next_prime
+from data_structures.table_stats import ProbeStats, cluster_lengths
+from mapped_double_key_table import MappedDoubleKeyTable, save_table
 
 K1 = TypeVar('K1')
 K2 = TypeVar('K2')
 V = TypeVar('V')
 
 
+class InnerTable(Generic[K2, V]):
+    """
+    Bottom-hash-table of one top-level key in a DoubleKeyTable.
+
+    With the default internal sizes, up to INLINE_LIMIT pairs are kept inline:
+    slot_keys and slot_values are short lists searched in order, and nothing is hashed.
+    Past that (or always, with custom internal sizes) it is a Linear Probe Table
+    whose slot arrays are those same two lists. Keys are hashed with the owner's
+    `hash2`, so no hash function is stored per table. While inline, the position
+    of a key is its index in the lists.
+
+    If the owner keeps a sorted index, sorted_keys also holds every key in ascending order.
+
+    Uses __slots__, so that each table carries no instance dictionary.
+
+    Unless stated otherwise, all methods have O(1) complexity.
+    """
+
+    __slots__ = ("owner", "slot_keys", "slot_values", "count", "inline", "sorted_keys", "version", "generation")
+
+    INLINE_LIMIT = 4
+
+    def __init__(self, owner: DoubleKeyTable[K1, K2, V]) -> None:
+        self.owner = owner
+        self.count = 0
+        self.inline = owner.internal_sizes is None
+        # Every key, in ascending order, if the owner keeps a sorted index.
+        self.sorted_keys: list[K2] | None = [] if owner.sorted_index else None
+        # Bumped whenever keys are added or removed.
+        self.version = 0
+        # The owner's generation when this table was last known not to be shared with a snapshot.
+        self.generation = owner.generation
+        if self.inline:
+            self.slot_keys: list[K2] = []
+            self.slot_values: list[V] = []
+        else:
+            self._allocate(self._sizes()[0])
+
+    def _sizes(self) -> list[int]:
+        return LinearProbeTable.TABLE_SIZES if self.owner.internal_sizes is None else self.owner.internal_sizes
+
+    def _allocate(self, size: int) -> None:
+        """
+        Replace the storage with size empty slots.
+
+        :complexity: O(size)
+        """
+        self.slot_keys = [None] * size
+        self.slot_values = [None] * size
+
+    @property
+    def table_size(self) -> int:
+        return self.INLINE_LIMIT if self.inline else len(self.slot_keys)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _linear_probe(self, key: K2, is_insert: bool, home: int | None = None) -> int:
+        """
+        Find the correct position for this key: its index while inline,
+        otherwise its slot found by linear probing from hash2 (or from home, if it has already been hashed).
+
+        :complexity best: O(hash2(key)) first position is empty
+        :complexity worst: O(hash2(key) + N*comp(K)) when we've searched the entire table
+                        where N is the tablesize
+        :raises KeyError: When the key is not in the table, but is_insert is False.
+        :raises FullError: When a table is full and cannot be inserted.
+        """
+        if self.inline:
+            for position in range(self.count):
+                if self.slot_keys[position] == key:
+                    return position
+            if is_insert:
+                return self.count
+            raise KeyError(key)
+
+        probe_stats = self.owner.inner_probe_stats
+        position = self.owner.hash2(key, self) if home is None else home
+        for probes in range(self.table_size):
+            slot_key = self.slot_keys[position]
+            if slot_key is None:
+                if probe_stats is not None:
+                    probe_stats.record_probe(probes, False, is_insert)
+                if is_insert:
+                    return position
+                else:
+                    raise KeyError(key)
+            elif slot_key == key:
+                if probe_stats is not None:
+                    probe_stats.record_probe(probes, True, is_insert)
+                return position
+            position = (position + 1) % self.table_size
+
+        if is_insert:
+            raise FullError("Table is full!")
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key: K2) -> bool:
+        """
+        :complexity: See linear probe.
+        """
+        try:
+            self._linear_probe(key, False)
+        except KeyError:
+            return False
+        else:
+            return True
+
+    def __getitem__(self, key: K2) -> V:
+        """
+        :complexity: See linear probe.
+        :raises KeyError: when the key doesn't exist.
+        """
+        return self.slot_values[self._linear_probe(key, False)]
+
+    def __setitem__(self, key: K2, data: V) -> None:
+        """
+        Set a (key, value) pair, leaving the inline representation if it would hold too many.
+
+        :complexity: See linear probe, plus O(N) to resize, where N is len(self).
+        :raises FullError: when the table cannot be resized further.
+        """
+        self._set(key, data, None)
+
+    def _set(self, key: K2, data: V, home: int | None) -> None:
+        """
+        Set a (key, value) pair, probing from home if key has already been hashed.
+
+        :complexity: See __setitem__.
+        :raises FullError: when the table cannot be resized further.
+        """
+        position = self._linear_probe(key, True, home)
+        if self.inline:
+            if position < self.count:
+                self.slot_values[position] = data
+                return
+            if self.count < self.INLINE_LIMIT:
+                self.slot_keys.append(key)
+                self.slot_values.append(data)
+                self.count += 1
+                self.version += 1
+                if self.sorted_keys is not None:
+                    insort(self.sorted_keys, key)
+                return
+            self._spread(self.count + 1)
+            position = self._linear_probe(key, True)
+
+        if self.slot_keys[position] is None:
+            self.count += 1
+            self.version += 1
+            self.slot_keys[position] = key
+            if self.sorted_keys is not None:
+                insort(self.sorted_keys, key)
+        self.slot_values[position] = data
+
+        if self.count > self.table_size / 2:
+            new_size = self._next_size(self.table_size)
+            if new_size is not None:
+                self._resize(new_size)
+
+    def __delitem__(self, key: K2) -> None:
+        """
+        Delete a (key, value) pair, going back to the inline representation once it is small enough.
+
+        :complexity: See linear probe, plus O(C) to re-place the rest of the cluster C.
+        :raises KeyError: when the key doesn't exist.
+        """
+        position = self._linear_probe(key, False)
+        self.count -= 1
+        self.version += 1
+        if self.sorted_keys is not None:
+            del self.sorted_keys[bisect_left(self.sorted_keys, key)]
+        if self.inline:
+            del self.slot_keys[position]
+            del self.slot_values[position]
+            return
+
+        self.slot_keys[position] = None
+        self.slot_values[position] = None
+        # Start moving over the cluster
+        position = (position + 1) % self.table_size
+        while self.slot_keys[position] is not None:
+            key, data = self.slot_keys[position], self.slot_values[position]
+            self.slot_keys[position] = None
+            self.slot_values[position] = None
+            self._place(key, data)
+            position = (position + 1) % self.table_size
+
+        if self.owner.internal_sizes is None and self.count <= self.INLINE_LIMIT:
+            keys, values = self.keys(), self.values()
+            self.slot_keys, self.slot_values = keys, values
+            self.inline = True
+
+    def _copy(self, generation: int) -> InnerTable[K2, V]:
+        """
+        Returns a copy of this table, of the given generation.
+
+        :complexity: O(N) where N is self.table_size.
+        """
+        res = InnerTable.__new__(InnerTable)
+        res.owner = self.owner
+        res.slot_keys = self.slot_keys[:]
+        res.slot_values = self.slot_values[:]
+        res.count = self.count
+        res.inline = self.inline
+        res.sorted_keys = None if self.sorted_keys is None else self.sorted_keys[:]
+        res.version = self.version
+        res.generation = generation
+        return res
+
+    def _homes(self, keys: list[K2]) -> list[int | None]:
+        """
+        Returns the home position of each of keys, computed in one batch unless `hash2`
+        has been overwritten, or None for each while inline.
+
+        :complexity: O(L) where L is the total length of the keys.
+        """
+        if self.inline:
+            return [None] * len(keys)
+        owner = self.owner
+        if "hash2" in owner.__dict__ or type(owner).hash2 is not DoubleKeyTable.hash2:
+            return [owner.hash2(key, self) for key in keys]
+        return hash_many(keys, self.table_size)
+
+    def _set_all(self, keys: list[K2], values: list[V]) -> None:
+        """
+        Set each of keys to the matching value, resizing at most once, before setting anything.
+
+        :complexity: O(N + M + L) with no probing, where N is len(self), M the number of keys
+        and L their total length. See linear probe.
+        :raises FullError: when the table cannot be resized further.
+        """
+        count = self.count + len(keys)
+        if count > (self.INLINE_LIMIT if self.inline else self.table_size / 2):
+            # Only count the keys that are actually new when they might not fit.
+            count = self.count + sum(1 for key in keys if key not in self)
+        self._reserve(count)
+        for key, data, home in zip(keys, values, self._homes(keys)):
+            self._set(key, data, home)
+
+    def _reserve(self, count: int) -> None:
+        """
+        Grow straight to the smallest size that holds count pairs without resizing.
+
+        :complexity: O(N) with no probing, O(N^2) with lots of probing, where N is len(self).
+        """
+        if self.inline:
+            if count > self.INLINE_LIMIT:
+                self._spread(count)
+            return
+        size = self.table_size
+        while count > size / 2:
+            new_size = self._next_size(size)
+            if new_size is None:
+                break
+            size = new_size
+        if size != self.table_size:
+            self._resize(size)
+
+    def _next_size(self, size: int) -> int | None:
+        """
+        Returns the next table size up from size, or None if the internal sizes have run out.
+        With the default sizes, the first prime past double the largest size is used.
+
+        :complexity: O(S) where S is the number of sizes, plus O(sqrt(N)*log(N)) to generate a size N.
+        """
+        for new_size in self._sizes():
+            if new_size > size:
+                return new_size
+        if self.owner.internal_sizes is None:
+            return next_prime(2 * size + 1)
+        return None
+
+    def _spread(self, count: int) -> None:
+        """
+        Move the inline pairs into the smallest table that holds count pairs without resizing.
+        The pairs are placed in a separate table first, so that if `hash2` cannot take one
+        of the keys (inline keys were never hashed) this table is left inline and unchanged.
+
+        :complexity: O(N) with no probing, where N is len(self).
+        """
+        size = self._sizes()[0]
+        while count > size / 2:
+            size = self._next_size(size)
+        spread = InnerTable(self.owner)
+        spread.inline = False
+        spread._allocate(size)
+        for key, data in zip(self.slot_keys, self.slot_values):
+            spread._place(key, data)
+        self.slot_keys, self.slot_values = spread.slot_keys, spread.slot_values
+        self.inline = False
+
+    def _resize(self, new_size: int) -> None:
+        """
+        Move every pair into fresh slot arrays of new_size slots.
+
+        :complexity: O(N) with no probing, O(N^2) with lots of probing, where N is len(self).
+        """
+        keys, values = self.slot_keys, self.slot_values
+        self._allocate(new_size)
+        for key, data in zip(keys, values):
+            if key is not None:
+                self._place(key, data)
+
+    def _place(self, key: K2, data: V) -> None:
+        """
+        Put a key known not to be in the table into the first free slot from its home position.
+
+        :complexity best: O(hash2(key))
+        :complexity worst: O(hash2(key) + N) where N is the tablesize.
+        """
+        position = self.owner.hash2(key, self)
+        while self.slot_keys[position] is not None:
+            position = (position + 1) % self.table_size
+        self.slot_keys[position] = key
+        self.slot_values[position] = data
+
+    def keys(self) -> list[K2]:
+        """
+        :complexity: O(N) where N is self.table_size.
+        """
+        return list(self.iter_keys())
+
+    def range_keys(self, lo: K2 | None, hi: K2 | None) -> list[K2]:
+        """
+        Returns the keys k with lo <= k < hi in ascending order. A bound of None is left open.
+
+        :complexity: O(log(N) + K) with a sorted index, otherwise O(N*log(N)),
+        where N is len(self) and K the number of keys returned.
+        """
+        keys = self.sorted_keys if self.sorted_keys is not None else sorted(self.iter_keys())
+        start = 0 if lo is None else bisect_left(keys, lo)
+        end = len(keys) if hi is None else bisect_left(keys, hi)
+        return keys[start:max(start, end)]
+
+    def prefix_keys(self, prefix: K2) -> list[K2]:
+        """
+        Returns the keys starting with prefix in ascending order.
+
+        :complexity: O(log(N) + K*len(prefix)) with a sorted index, otherwise O(N*log(N)),
+        where N is len(self) and K the number of keys returned.
+        """
+        keys = self.sorted_keys if self.sorted_keys is not None else sorted(self.iter_keys())
+        res = []
+        for position in range(bisect_left(keys, prefix), len(keys)):
+            if not keys[position].startswith(prefix):
+                break
+            res.append(keys[position])
+        return res
+
+    def values(self) -> list[V]:
+        """
+        :complexity: O(N) where N is self.table_size.
+        """
+        return list(self.iter_values())
+
+    def items(self) -> Iterator[tuple[K2, V]]:
+        """
+        :complexity: O(N) over the whole iteration, where N is self.table_size.
+        :raises ConcurrentModificationError: when keys are added or removed during the iteration.
+        """
+        version = self.version
+        for position in range(len(self.slot_keys)):
+            if self.version != version:
+                raise ConcurrentModificationError("Table changed during iteration.")
+            key = self.slot_keys[position]
+            if key is not None:
+                yield key, self.slot_values[position]
+        if self.version != version:
+            raise ConcurrentModificationError("Table changed during iteration.")
+
+    def iter_keys(self) -> Iterator[K2]:
+        """
+        :complexity: O(N) over the whole iteration, where N is self.table_size.
+        """
+        for key, _ in self.items():
+            yield key
+
+    def iter_values(self) -> Iterator[V]:
+        """
+        :complexity: O(N) over the whole iteration, where N is self.table_size.
+        """
+        for _, value in self.items():
+            yield value
+
+
+class SubTableView(Generic[K2, V]):
+    """
+    Read-only view of the bottom-hash-table of one top-level key in a DoubleKeyTable.
+
+    The bottom-hash-table is looked up again on every access, as the table may replace
+    it with a copy (see DoubleKeyTable._writable_inner) or delete it. Once the top-level
+    key is deleted, the view is empty.
+
+    Unless stated otherwise, all methods have the complexity of the same method on InnerTable,
+    plus the cost of looking the top-level key up (see DoubleKeyTable._outer_probe).
+    """
+
+    __slots__ = ("_owner", "_key")
+
+    def __init__(self, owner: DoubleKeyTable[K1, K2, V], key: K1) -> None:
+        self._owner = owner
+        self._key = key
+
+    def _find(self) -> InnerTable[K2, V] | None:
+        """
+        Returns the bottom-hash-table of the top-level key, or None if it has been deleted.
+        """
+        try:
+            return self._owner.array[self._owner._outer_probe(self._key, False)][1]
+        except KeyError:
+            return None
+
+    @property
+    def _table(self) -> InnerTable[K2, V]:
+        table = self._find()
+        return InnerTable(self._owner) if table is None else table
+
+    def __getitem__(self, key: K2) -> V:
+        return self._table[key]
+
+    def __contains__(self, key: K2) -> bool:
+        return key in self._table
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def __iter__(self) -> Iterator[K2]:
+        return self.iter_keys()
+
+    def keys(self) -> list[K2]:
+        return self._table.keys()
+
+    def values(self) -> list[V]:
+        return self._table.values()
+
+    def items(self) -> Iterator[tuple[K2, V]]:
+        """
+        Like InnerTable.items, but carries on in the copy if the bottom-hash-table is replaced
+        by one during the iteration, as the copy keeps the same positions.
+
+        :complexity: O(N) over the whole iteration, where N is the table size of the bottom-hash-table,
+        plus a look-up per step while it is shared with a snapshot.
+        :raises ConcurrentModificationError: when keys are added or removed during the iteration,
+        or the top-level key is deleted.
+        """
+        return self._items(self._table)
+
+    def _items(self, table: InnerTable[K2, V]) -> Iterator[tuple[K2, V]]:
+        """
+        See items, starting from table, the bottom-hash-table already looked up.
+        """
+        version = table.version
+        position = 0
+        while True:
+            if table.generation != self._owner.generation:
+                # Shared with a snapshot, so it may have been replaced.
+                table = self._find()
+            if table is None or table.version != version:
+                raise ConcurrentModificationError("Table changed during iteration.")
+            if position == len(table.slot_keys):
+                return
+            key = table.slot_keys[position]
+            if key is not None:
+                yield key, table.slot_values[position]
+            position += 1
+
+    def iter_keys(self) -> Iterator[K2]:
+        for key, _ in self.items():
+            yield key
+
+    def iter_values(self) -> Iterator[V]:
+        for _, value in self.items():
+            yield value
+
+    def range_keys(self, lo: K2 | None = None, hi: K2 | None = None) -> list[K2]:
+        return self._table.range_keys(lo, hi)
+
+    def prefix_keys(self, prefix: K2) -> list[K2]:
+        return self._table.prefix_keys(prefix)
+
+
 class DoubleKeyTable(Generic[K1, K2, V]):
     """
     Double Hash Table.
@@ -20,6 +511,15 @@ class DoubleKeyTable(Generic[K1, K2, V]):
                 Otherwise `hash2` should be overwritten.
         - V:    Value Type.
 
+    The pairs of each top-level key are kept in an InnerTable, which stores a few
+    pairs inline (with the default internal sizes) and hashes with `hash2`.
+    With `sorted_index=True`, each also keeps its 2nd keys sorted, so that
+    `range_keys` and `prefix_keys` take O(log(n) + k) rather than sorting them all.
+
+    Iterators raise ConcurrentModificationError once pairs are added or removed under them.
+    To iterate while writing, iterate over a `snapshot()`, which copies the outer array and
+    each inner table only when they are first written to.
+
     Unless stated otherwise, all methods have O(1) complexity.
     """
 
@@ -29,8 +529,12 @@ class DoubleKeyTable(Generic[K1, K2, V]):
 
     HASH_BASE = 31
 
-    def __init__(self, sizes: list | None = None, internal_sizes: list | None = None) -> None:
+    def __init__(self, sizes: list | None = None, internal_sizes: list | None = None,
+                 sorted_index: bool = False) -> None:
         """
+        :param sorted_index: keep the 2nd keys of each top-level key in sorted order as well,
+        for range_keys and prefix_keys.
+
         Complexity:
         #worst case: O(1), creating array and initialised class variables
         #best case: O(1), same as worst case
@@ -40,7 +544,18 @@ class DoubleKeyTable(Generic[K1, K2, V]):
         self.size_index = 0
         self.array = ArrayR(self.TABLE_SIZES[self.size_index])
         self.count = 0
+        self.pair_count = 0
         self.internal_sizes = internal_sizes
+        self.sorted_index = sorted_index
+        # Bumped whenever pairs are added or removed, or top-level keys move.
+        self.version = 0
+        self.read_only = False
+        # Snapshots that may still share the outer array, or inner tables older than generation.
+        self.snapshot_refs: list[weakref.ref] = []
+        self.generation = 0
+        self.outer_shared = False
+        self.probe_stats: ProbeStats | None = None
+        self.inner_probe_stats: ProbeStats | None = None
 
     def hash1(self, key: K1) -> int:
         """
@@ -56,7 +571,7 @@ class DoubleKeyTable(Generic[K1, K2, V]):
             a = a * self.HASH_BASE % (self.table_size - 1)
         return value
 
-    def hash2(self, key: K2, sub_table: LinearProbeTable[K2, V]) -> int:
+    def hash2(self, key: K2, sub_table: InnerTable[K2, V]) -> int:
         """
         Hash the 2nd key for insert/retrieve/update into the hashtable.
 
@@ -76,53 +591,80 @@ class DoubleKeyTable(Generic[K1, K2, V]):
         #worst case: O(n), where n represents the number of elements in self.table_size
         #best case: O(1), where there is only 1 element in self.table_size
         """
-        outer_position = self.hash1(key1)
-        inner_table = None
-        for _ in range(self.table_size):
+        outer_position = self._outer_probe(key1, is_insert)
+        inner_position = self.array[outer_position][1]._linear_probe(key2, is_insert)
+        return outer_position, inner_position
+
+    def _outer_probe(self, key1: K1, is_insert: bool, home: int | None = None) -> int:
+        """
+        Find the outer position of key1, creating an empty inner table for it if inserting.
+        Probing starts from home, if it has already been hashed.
+
+        :raises KeyError: When key1 is not in the table, but is_insert is False.
+        :raises FullError: When a table is full and cannot be inserted.
+
+        Complexity
+        #worst case: O(n), where n represents the number of elements in self.table_size
+        #best case: O(1), where there is only 1 element in self.table_size
+        """
+        outer_position = self.hash1(key1) if home is None else home
+        for probes in range(self.table_size):
             if self.array[outer_position] is None:
+                if self.probe_stats is not None:
+                    self.probe_stats.record_probe(probes, False, is_insert)
                 if is_insert:
-                    inner_table = LinearProbeTable(self.internal_sizes)
-                    self.array[outer_position]=(key1,inner_table)
-                    inner_table.hash = lambda k:self.hash2(k,inner_table)
-                    inner_position = self.array[outer_position][1]._linear_probe(key2, is_insert)
-                    return outer_position, inner_position
+                    self._before_write()
+                    self._unshare_outer()
+                    self.array[outer_position]=(key1,InnerTable(self))
+                    return outer_position
                 else:
                     raise KeyError(key1)
             elif self.array[outer_position][0] == key1:
-                inner_position = self.array[outer_position][1]._linear_probe(key2, is_insert)
-                return outer_position, inner_position
+                if self.probe_stats is not None:
+                    self.probe_stats.record_probe(probes, True, is_insert)
+                return outer_position
             else:
                 outer_position = (outer_position + 1) % self.table_size
 
         if is_insert:
             raise FullError("Table is full!")
+        else:
+            raise KeyError(key1)
+
     def iter_keys(self, key: K1 | None = None) -> Iterator[K1 | K2]:
-            """
-            key = None:
-                Returns an iterator of all top-level keys in hash table
-            key = k:
-                Returns an iterator of all keys in the bottom-hash-table for k.
-            Complexity
-            #worst case: O(n), where n represents the number of keys in self.array
-            #best case: O(1), where there is only one key inside self.array
-            """
-            if key is None:
-                for item in self.array:
-                    if item is not None:
-                        yield item[0]
-            else:
-                for item in self.array:
-                    if item is not None and item[0] == key:
-                        yield from item[1].keys()
+        """
+        key = None:
+            Returns an iterator of all top-level keys in hash table
+        key = k:
+            Returns an iterator of all keys in the bottom-hash-table for k.
 
-    def keys(self, key: K1 | None = None) -> list[K1]:
+        :raises KeyError: when k is not a top-level key.
+
+        Complexity
+        #worst case: O(n), where n represents self.table_size, or the size of the bottom-hash-table for k
+        #best case: O(n), same as worst case
+        """
+        if key is None:
+            version = self.version
+            for item in self.array:
+                self._check_version(version)
+                if item is not None:
+                    yield item[0]
+            self._check_version(version)
+        else:
+            for key2, _ in SubTableView(self, key)._items(self.array[self._outer_probe(key, False)][1]):
+                yield key2
+
+    def keys(self, key: K1 | None = None) -> list[K1 | K2]:
         """
         key = None: returns all top-level keys in the table.
         key = x: returns all bottom-level keys for top-level key x.
 
+        :raises KeyError: when x is not a top-level key.
+
         Complexity
-        # worst case: O(n), where n represents the number of keys in self.table_size
-        # best case: O(1), where there is only one key inside self.table_size
+        # worst case: O(n), where n represents self.table_size, or the size of the bottom-hash-table for x
+        # best case: O(n), same as worst case
         """
 
         keys = []
@@ -132,9 +674,7 @@ class DoubleKeyTable(Generic[K1, K2, V]):
                     keys.append(self.array[i][0])
             return keys
         else:
-            for i in range(self.table_size):
-                if self.array[i] is not None and self.array[i][0]==key:
-                    return self.array[i][1].keys()
+            return self.array[self._outer_probe(key, False)][1].keys()
 
     def iter_values(self, key: K1 | None = None) -> Iterator[V]:
         """
@@ -142,27 +682,37 @@ class DoubleKeyTable(Generic[K1, K2, V]):
             Returns an iterator of all values in hash table
         key = k:
             Returns an iterator of all values in the bottom-hash-table for k.
+
+        :raises KeyError: when k is not a top-level key.
+
         Complexity
-        # worst case: O(n), where n represents the number of values in self.array
-        # best case: O(1), where there is only one value inside self.array
+        # worst case: O(n), where n represents the size of all bottom-hash-tables, or of the one for k
+        # best case: O(n), same as worst case
         """
 
         if key is None:
+            version = self.version
             for item in self.array:
+                self._check_version(version)
                 if item is not None:
-                    yield from item[1].values()
+                    for value in item[1].iter_values():
+                        yield value
+                        self._check_version(version)
+            self._check_version(version)
         else:
-            for item in self.array:
-                if item is not None and item[0] == key:
-                    yield from item[1].values()
+            for _, value in SubTableView(self, key)._items(self.array[self._outer_probe(key, False)][1]):
+                yield value
 
     def values(self, key:K1|None=None) -> list[V]:
         """
         key = None: returns all values in the table.
         key = x: returns all values for top-level key x.
+
+        :raises KeyError: when x is not a top-level key.
+
         Complexity
-        # worst case: O(n), where n represents the number of values in self.array
-        # best case: O(1), where there is only one value inside self.array
+        # worst case: O(n), where n represents the size of all bottom-hash-tables, or of the one for x
+        # best case: O(n), same as worst case
         """
 
         values = []
@@ -172,10 +722,51 @@ class DoubleKeyTable(Generic[K1, K2, V]):
                     values.extend(item[1].values())
             return values
         else:
-            for i in range(self.table_size):
-                if self.array[i] is not None and self.array[i][0] == key:
-                    inner_table = self.array[i][1]
-                    return inner_table.values()
+            return self.array[self._outer_probe(key, False)][1].values()
+
+    def range_keys(self, key1: K1, lo: K2 | None = None, hi: K2 | None = None) -> list[K2]:
+        """
+        Returns the 2nd keys k under top-level key key1 with lo <= k < hi, in ascending order.
+        A bound of None is left open.
+
+        :raises KeyError: when key1 is not a top-level key.
+
+        Complexity:
+        # worst case: O(n + log(m) + k) with a sorted index, where n is self.table_size (linear probe),
+        # m is the number of 2nd keys under key1 and k the number returned. O(n + m*log(m)) without one.
+        # best case: O(log(m) + k) with a sorted index, no probing
+        """
+        return self.array[self._outer_probe(key1, False)][1].range_keys(lo, hi)
+
+    def prefix_keys(self, key1: K1, prefix: K2) -> list[K2]:
+        """
+        Returns the 2nd keys under top-level key key1 that start with prefix, in ascending order.
+
+        :raises KeyError: when key1 is not a top-level key.
+
+        Complexity:
+        # worst case: O(n + log(m) + k*len(prefix)) with a sorted index, where n is self.table_size
+        # (linear probe), m is the number of 2nd keys under key1 and k the number returned.
+        # O(n + m*log(m)) without one.
+        # best case: O(log(m) + k*len(prefix)) with a sorted index, no probing
+        """
+        return self.array[self._outer_probe(key1, False)][1].prefix_keys(prefix)
+
+    def subtable(self, key: K1) -> SubTableView[K2, V]:
+        """
+        Returns a read-only view of the bottom-hash-table for top-level key `key`.
+        The view is live: it sees later changes to the pairs under `key`,
+        and is left empty once `key` is deleted.
+
+        :raises KeyError: when key is not a top-level key.
+
+        Complexity:
+        # worst case: O(n), as it called linear probe on the outer table only,
+        # where n represents the number of elements in self.table_size
+        # best case: O(hash1(K)), no probing
+        """
+        self._outer_probe(key, False)
+        return SubTableView(self, key)
 
     def __contains__(self, key: tuple[K1, K2]) -> bool:
         """
@@ -201,13 +792,8 @@ class DoubleKeyTable(Generic[K1, K2, V]):
         # where n represents the number of elements in self.table_size
         #best case: O(1),everything including calling linear probe is constant
         """
-        outer_position,inner_position = self._linear_probe(key[0],key[1],False)
-        if self.array[outer_position] is not None and self.array[outer_position][0]==key[0]:
-            inner_table = self.array[outer_position][1]
-            return inner_table[inner_position]
-        else:
-            raise KeyError(key)
-
+        inner_table = self.array[self._outer_probe(key[0], False)][1]
+        return inner_table[key[1]]
 
     def __setitem__(self, key: tuple[K1, K2], data: V) -> None:
         """
@@ -218,17 +804,18 @@ class DoubleKeyTable(Generic[K1, K2, V]):
         #best case: O(1),everything including calling linear probe is constant
         """
 
-        outer_position,inner_position = self._linear_probe(key[0], key[1], True)
-
-        inner_table = self.array[outer_position][1]
-        if self.array[outer_position][0] is None:
-            self.array[outer_position] = (key[0], inner_table)
-
-        elif len(self.array[outer_position][1].keys()) == 0:
-            self.count += 1
-
+        self._before_write()
+        inner_table = self._writable_inner(self._outer_probe(key[0], True))
+        inner_count = len(inner_table)
         inner_table[key[1]] = data
 
+        if len(inner_table) > inner_count:
+            self.pair_count += 1
+            self.version += 1
+            if inner_count == 0:
+                self.count += 1
+
+        # The outer table only holds top-level keys, so only they count towards its load.
         if len(self) > self.table_size / 2:
             self._rehash()
 
@@ -236,59 +823,221 @@ class DoubleKeyTable(Generic[K1, K2, V]):
         """
         Deletes a (key, value) pair in our hash table.
 
+        When it was the last pair for key[0], the outer slot is emptied and the rest of
+        the outer cluster is shifted back, one whole (key1, inner table) pair at a time,
+        hashing each displaced key1 once.
+
         :raises KeyError: when the key doesn't exist.
 
         Complexity
-        # worst case: O(n*m), as it called linear probe which has worst case complexity of O(n),
-        # where n represents the number of elements in self.outer.table, m represents number of elements in
-        # inner table
+        # worst case: O(n*hash1(K) + m), as it called linear probe which has worst case complexity of O(n),
+        # where n represents the number of elements in self.table_size, plus shifting back the rest of the
+        # outer cluster, m represents the cost of deleting from the inner table
         # best case: O(1),everything including calling linear probe is constant
         """
 
-        outer_position, inner_position = self._linear_probe(key[0], key[1], False)
-        inner_table = self.array[outer_position][1]
-        if inner_position is not None:
-            if inner_table.keys() == [key[1]]:
-                self.array[outer_position] = None
-                self.count -= 1
-            else:
-                del inner_table[key[1]]
+        self._before_write()
+        outer_position = self._outer_probe(key[0], False)
+        inner_table = self._writable_inner(outer_position)
+        del inner_table[key[1]]
+        self.pair_count -= 1
+        self.version += 1
+        if len(inner_table) > 0:
+            return
 
+        self._unshare_outer()
+        self.array[outer_position] = None
+        self.count -= 1
+        # Move each following pair of the cluster into the hole, if that does not put it before its home.
+        hole = outer_position
         position = (outer_position + 1) % self.table_size
         while self.array[position] is not None:
-            key2, value = self.array[position]
-            for i in self.iter_keys(key2):
-                new_outer_pos, new_inner_pos = self._linear_probe(key2, i, True)
-                self.array[new_outer_pos][1][i] = value
+            item = self.array[position]
+            if (position - self.hash1(item[0])) % self.table_size >= (position - hole) % self.table_size:
+                self.array[hole] = item
+                self.array[position] = None
+                hole = position
             position = (position + 1) % self.table_size
 
+    def _check_version(self, version: int) -> None:
+        """
+        :raises ConcurrentModificationError: when the table has changed since it was at version.
+        """
+        if self.version != version:
+            raise ConcurrentModificationError("Table changed during iteration.")
+
+    def snapshot(self) -> DoubleKeyTable[K1, K2, V]:
+        """
+        Returns a read-only copy of the table as it is now, which is safe to iterate while
+        this table keeps changing.
+
+        The copy shares the outer array and every inner table with this one. While the
+        snapshot is in use, this table copies the outer array on the next write that changes it,
+        and each inner table on the first write to it, so that only what is written to is copied.
+
+        Complexity:
+        # worst case: O(s), where s is the number of earlier snapshots, plus the copies made by later writes
+        # best case: O(1), same as worst case
+        """
+        snapshot = copy(self)
+        snapshot.read_only = True
+        snapshot.snapshot_refs = []
+        snapshot.probe_stats = None
+        snapshot.inner_probe_stats = None
+        self.generation += 1
+        self.outer_shared = True
+        self._snapshot_in_use()
+        self.snapshot_refs.append(weakref.ref(snapshot))
+        return snapshot
+
+    def _snapshot_in_use(self) -> bool:
+        """
+        Whether any snapshot of this table is still in use, forgetting those that are not.
+
+        Complexity:
+        # worst case: O(s), where s is the number of snapshots
+        # best case: O(1), when there are none
+        """
+        if self.snapshot_refs:
+            self.snapshot_refs = [ref for ref in self.snapshot_refs if ref() is not None]
+        return len(self.snapshot_refs) > 0
+
+    def _before_write(self) -> None:
+        """
+        :raises TypeError: when the table is a snapshot.
+        """
+        if self.read_only:
+            raise TypeError("Snapshots are read-only.")
+
+    def _unshare_outer(self) -> None:
+        """
+        Called before the outer array is changed: copies it if a snapshot still shares it.
+
+        Complexity:
+        # worst case: O(n), where n is self.table_size, to copy it
+        # best case: O(1), when it is not shared
+        """
+        if self.outer_shared:
+            if self._snapshot_in_use():
+                self.array = self.array.copy()
+            self.outer_shared = False
+
+    def _writable_inner(self, outer_position: int) -> InnerTable[K2, V]:
+        """
+        Returns the inner table at outer_position, ready to be written to: replaced by a copy
+        first if it was there when a snapshot still in use was taken.
+
+        Complexity:
+        # worst case: O(m), where m is the table size of the inner table, to copy it
+        # best case: O(1), when it is not shared
+        """
+        key1, inner_table = self.array[outer_position]
+        if inner_table.generation != self.generation:
+            if self._snapshot_in_use():
+                inner_table = inner_table._copy(self.generation)
+                self._unshare_outer()
+                self.array[outer_position] = (key1, inner_table)
+            else:
+                inner_table.generation = self.generation
+        return inner_table
+
     def _rehash(self) -> None:
         """
-        Need to resize table and reinsert all values
+        Need to resize table and move every (key1, inner table) pair into it.
+
+        Inner tables are moved by reference: their arrays are left as they are,
+        and none of the 2nd keys are hashed again.
 
-        :complexity best: O(N*hash(K)) No probing.
-        :complexity worst: O(N*hash(K) + N^2*comp(K)) Lots of probing.
+        :complexity best: O(N*hash1(K)) No probing.
+        :complexity worst: O(N*hash1(K) + N^2) Lots of probing.
         Where N is len(self)
         """
+        if self.size_index + 1 >= len(self.TABLE_SIZES):
+            # Cannot be resized further.
+            return
+        self._resize(self.size_index + 1)
+
+    def _reserve(self, count: int) -> None:
+        """
+        Grow straight to the smallest size that holds count top-level keys without resizing.
+
+        :complexity: See _rehash.
+        """
+        size_index = self.size_index
+        while count > self.TABLE_SIZES[size_index] / 2 and size_index + 1 < len(self.TABLE_SIZES):
+            size_index += 1
+        if size_index != self.size_index:
+            self._resize(size_index)
+
+    def _resize(self, size_index: int) -> None:
+        """
+        Move every (key1, inner table) pair into a new outer array of size TABLE_SIZES[size_index].
+
+        :complexity: See _rehash.
+        """
+        start = perf_counter()
         old_array = self.array
-        self.size_index += 1
-        new_size = self.TABLE_SIZES[self.size_index]
+        self.size_index = size_index
+        self.version += 1
+        self.array = ArrayR(self.TABLE_SIZES[self.size_index])
+        self.outer_shared = False
+        for item in old_array:
+            if item is not None:
+                self._place(item)
+        if self.probe_stats is not None:
+            self.probe_stats.record_rehash(perf_counter() - start)
 
-        # Create a new array with the doubled size
-        self.array = ArrayR(new_size)
-        self.array.hash = lambda k:self.hash1(k)
-        self.count = 0
-        # Rehash and reinsert all values
-        for tuples in old_array:
-            if tuples is not None:
-                key, inner_table = tuples
-                keys_list = inner_table.keys()
-                values_list = inner_table.values()
-                for i in range(len(inner_table.keys())):
-                    key1 = key
-                    key2 = keys_list[i]
-                    value = values_list[i]
-                    self[(key1, key2)] = value
+    def _place(self, item: tuple[K1, InnerTable[K2, V]]) -> None:
+        """
+        Put a (key1, inner table) pair whose key1 is known not to be in the table into
+        the first free slot from its home position. No keys are compared.
+
+        Complexity:
+        # worst case: O(hash1(K) + n), where n is self.table_size
+        # best case: O(hash1(K)), when the home position is free
+        """
+        position = self.hash1(item[0])
+        while self.array[position] is not None:
+            position = (position + 1) % self.table_size
+        self.array[position] = item
+
+    def instrument(self, enabled: bool = True) -> None:
+        """
+        Start recording probe and resize statistics from scratch, or stop recording them.
+        Probes into all inner tables are recorded together.
+
+        Complexity:
+        # worst case: O(1), everything is constant
+        # best case: O(1), everything is constant
+        """
+        self.probe_stats = ProbeStats() if enabled else None
+        self.inner_probe_stats = ProbeStats() if enabled else None
+
+    def stats(self) -> dict:
+        """
+        Returns the outer table size, number of top-level keys, load factor and the number
+        of clusters of each length, along with the (count, table size) of the inner table
+        for each top-level key. If instrumented, also the probe statistics (see LinearProbeTable.stats)
+        of the outer table, and under "inner" those of all inner tables together.
+
+        Complexity:
+        # worst case: O(n), where n is self.table_size
+        # best case: O(n), same as worst case
+        """
+        res = {
+            "table_size": self.table_size,
+            "count": len(self),
+            "load_factor": len(self) / self.table_size,
+            "cluster_lengths": cluster_lengths(item is not None for item in self.array),
+            "inner_occupancy": {},
+        }
+        for item in self.array:
+            if item is not None:
+                res["inner_occupancy"][item[0]] = (len(item[1]), item[1].table_size)
+        if self.probe_stats is not None:
+            res.update(self.probe_stats.as_dict())
+            res["inner"] = self.inner_probe_stats.as_dict()
+        return res
 
     @property
     def table_size(self) -> int:
@@ -303,7 +1052,7 @@ class DoubleKeyTable(Generic[K1, K2, V]):
 
     def __len__(self) -> int:
         """
-        Returns number of elements in the hash table
+        Returns number of top-level keys in the hash table
 
         Complexity:
         # worst case: O(1), everything is constant
@@ -311,6 +1060,145 @@ class DoubleKeyTable(Generic[K1, K2, V]):
         """
         return self.count
 
+    def _hashes1(self, keys: list[K1]) -> list[int]:
+        """
+        Returns hash1 of each of keys, computed in one batch unless `hash1` has been overwritten.
+
+        :complexity: O(L) where L is the total length of the keys.
+        """
+        if "hash1" in self.__dict__ or type(self).hash1 is not DoubleKeyTable.hash1:
+            return [self.hash1(key) for key in keys]
+        return hash_many(keys, self.table_size)
+
+    def _group(self, pairs: list[tuple[K1, K2]]) -> dict[K1, list[int]]:
+        """
+        Returns the indices into pairs of the pairs for each top-level key, in order.
+
+        :complexity: O(N) where N is len(pairs).
+        """
+        groups = {}
+        for index, (key1, _) in enumerate(pairs):
+            groups.setdefault(key1, []).append(index)
+        return groups
+
+    def get_many(self, pairs: Iterable[tuple[K1, K2]]) -> list[V]:
+        """
+        Get the values at each of the (key1, key2) pairs, in order.
+        Each top-level key is hashed and probed for once, and all the 1st and all the
+        2nd keys of a bottom-hash-table are hashed in one batch.
+
+        :raises KeyError: when any of the keys doesn't exist.
+
+        Complexity:
+        # worst case: O(n*m + L), where n is the number of distinct top-level keys, m is self.table_size
+        # (linear probe), and L is the total length of the keys
+        # best case: O(n + L), no probing
+        """
+        pairs = list(pairs)
+        groups = self._group(pairs)
+        res = [None] * len(pairs)
+        for key1, home in zip(groups, self._hashes1(list(groups))):
+            inner_table = self.array[self._outer_probe(key1, False, home)][1]
+            indices = groups[key1]
+            keys2 = [pairs[index][1] for index in indices]
+            for index, key2, inner_home in zip(indices, keys2, inner_table._homes(keys2)):
+                res[index] = inner_table.slot_values[inner_table._linear_probe(key2, False, inner_home)]
+        return res
+
+    def set_many(self, pairs: Iterable[tuple[K1, K2]], values: Iterable[V]) -> None:
+        """
+        Set the value at each of the (key1, key2) pairs to the matching value, in order.
+        Each top-level key is probed for once, and the outer table and each bottom-hash-table
+        are resized at most once, before anything is inserted into them.
+
+        :raises ValueError: when there are not as many values as pairs.
+        :raises FullError: when a table cannot be resized further.
+
+        Complexity:
+        # worst case: O(n*m + N + L), where n is the number of distinct top-level keys, m is self.table_size
+        # (linear probe), N is the number of pairs and L is the total length of the keys
+        # best case: O(n + N + L), no probing
+        """
+        self._before_write()
+        pairs, values = list(pairs), list(values)
+        if len(pairs) != len(values):
+            raise ValueError("There should be one value for each pair.")
+        groups = self._group(pairs)
+        keys1 = list(groups)
+        homes = self._hashes1(keys1)
+
+        if len(self) + len(keys1) > self.table_size / 2:
+            # Only count the top-level keys that are actually new when they might not fit.
+            new_keys = 0
+            for key1, home in zip(keys1, homes):
+                try:
+                    self._outer_probe(key1, False, home)
+                except KeyError:
+                    new_keys += 1
+            size_index = self.size_index
+            self._reserve(len(self) + new_keys)
+            if self.size_index != size_index:
+                homes = self._hashes1(keys1)
+
+        for key1, home in zip(keys1, homes):
+            inner_table = self._writable_inner(self._outer_probe(key1, True, home))
+            inner_count = len(inner_table)
+            keys2 = [pairs[index][1] for index in groups[key1]]
+            inner_table._set_all(keys2, [values[index] for index in groups[key1]])
+            if len(inner_table) != inner_count:
+                self.pair_count += len(inner_table) - inner_count
+                self.version += 1
+            if inner_count == 0:
+                self.count += 1
+
+        # The outer table was sized for the new keys up front, unless it ran out of sizes.
+        if len(self) > self.table_size / 2:
+            self._rehash()
+
+    def total_pairs(self) -> int:
+        """
+        Returns number of (key1, key2) pairs in the hash table
+
+        Complexity:
+        # worst case: O(1), everything is constant
+        # best case: O(1), everything is constant
+        """
+        return self.pair_count
+
+    def save(self, path: str) -> None:
+        """
+        Write the outer and inner slot arrays, keys and values to a flat binary file at path,
+        which `open` can serve lookups from without rebuilding the table.
+        Keys must be strings, and `hash1` and `hash2` must not have been overwritten.
+
+        :raises TypeError: when any key is not a string.
+        :raises ValueError: when `hash1` or `hash2` has been overwritten.
+
+        Complexity:
+        # worst case: O(n + m + L + S), where n is self.table_size, m the total size of the
+        # bottom-hash-tables, L the total length of the keys and S the total size of the values
+        # best case: same as worst case
+        """
+        for name in ("hash1", "hash2"):
+            if name in self.__dict__ or getattr(type(self), name) is not getattr(DoubleKeyTable, name):
+                raise ValueError("Only tables using the default hash functions can be saved.")
+        save_table(self, path)
+
+    @classmethod
+    def open(cls, path: str) -> MappedDoubleKeyTable[K1, K2, V]:
+        """
+        Memory-map a file written by `save`, returning a read-only table that supports
+        `__getitem__`, `__contains__`, `keys`, `values`, `len` and `total_pairs`.
+        Nothing is decoded until it is looked up.
+
+        :raises ValueError: when the file was not written by `save`.
+
+        Complexity:
+        # worst case: O(1), only the header is read
+        # best case: O(1), same as worst case
+        """
+        return MappedDoubleKeyTable(path)
+
     def __str__(self) -> str:
         """
         String representation.
@@ -1,5 +1,7 @@
 from __future__ import annotations
-from typing import Generic, TypeVar
+from itertools import islice
+from typing import Generic, TypeVar, Iterator
+from data_structures.referential_array import ArrayR
 
 K = TypeVar("K")
 V = TypeVar("V")
@@ -9,6 +11,24 @@ class InfiniteHashTable(Generic[K, V]):
     """
     Infinite Hash Table.
 
+    Each level is an array of TABLE_SIZE slots, indexed by `hash` at that level:
+    the character of the key at that depth, or the last slot once the key has ended.
+    A slot holds nothing, a (key, value) pair, or a sub-table one level deeper, shared
+    by the keys that collide there. A key is only pushed down into a sub-table when
+    another key collides with it, and a sub-table left with one key is collapsed back
+    into its parent slot, so every sub-table holds at least two keys.
+
+    Different characters can share a slot (e.g. "a" and "G"), so different keys can
+    end at the same level with the same hashes. No sub-table would tell them apart,
+    so the end-of-key slot holds such keys in a dict of key to value.
+
+    Each sub-table also counts its keys by their character just above its level, and
+    records that character while they all share it (`char`), which lets `iter_sorted`
+    and the prefix searches visit whole sub-tables without looking inside them.
+
+    Every table counts the keys in it and its sub-tables. The top-level table also
+    counts the sub-tables created and collapsed (reclaimed) through it.
+
     Type Arguments:
         - K:    Key Type. In most cases should be string.
                 Otherwise `hash` should be overwritten.
@@ -19,22 +39,54 @@ class InfiniteHashTable(Generic[K, V]):
 
     TABLE_SIZE = 27
 
-    def __init__(self) -> None:
+    def __init__(self, level: int = 0) -> None:
         """
+        :param level: depth of this table, 0 for the top-level table.
+
         Complexity:
         worst case: O(1), initialisation of variables
         best case: O(1)
         """
-        self.level = 0
-        self.key_list = []
-        self.index_list = []
-        self.hash_key_list = []
+        self.level = level
+        self.array: ArrayR[tuple[K, V] | dict[K, V] | InfiniteHashTable[K, V] | None] = ArrayR(self.TABLE_SIZE)
+        self.count = 0
+        # The number of keys in this table with each character at position level - 1.
+        self.char_counts: dict[str, int] = {}
+        # The character at position level - 1 of every key in this table, or None if they differ.
+        self.char: str | None = None
+        self.levels_created = 0
+        self.levels_reclaimed = 0
 
     def hash(self, key: K) -> int:
         if self.level < len(key):
             return ord(key[self.level]) % (self.TABLE_SIZE - 1)
         return self.TABLE_SIZE - 1
 
+    def _find(self, key: K) -> list[tuple[InfiniteHashTable[K, V], int]]:
+        """
+        Returns the table and position of each slot on the way down to key, ending with the slot holding it.
+
+        :raises KeyError: when the key doesn't exist.
+
+        Complexity:
+        #worst complexity: O(len(key)), one level per character of the key
+        #best complexity: O(1), the key is in the top-level table
+        """
+        path = []
+        table = self
+        while True:
+            position = table.hash(key)
+            path.append((table, position))
+            item = table.array[position]
+            if isinstance(item, InfiniteHashTable):
+                table = item
+            elif isinstance(item, dict) and key in item:
+                return path
+            elif isinstance(item, tuple) and item[0] == key:
+                return path
+            else:
+                raise KeyError(key)
+
     def __getitem__(self, key: K) -> V:
         """
         Get the value at a certain key
@@ -42,58 +94,127 @@ class InfiniteHashTable(Generic[K, V]):
         :raises KeyError: when the key doesn't exist.
 
         Complexity:
-        #worst complexity: O(1), everything is constant
-        #best complexity: O(1), everything is constant
+        #worst complexity: O(len(key)), see _find
+        #best complexity: O(1), the key is in the top-level table
         """
+        table, position = self._find(key)[-1]
+        item = table.array[position]
+        return item[key] if isinstance(item, dict) else item[1]
 
+    def __contains__(self, key: K) -> bool:
+        """
+        Complexity: See __getitem__.
+        """
         try:
-            index = self.key_list.index(key)
-            return self.index_list[index]
-        except ValueError:
-            raise KeyError(key)
+            self._find(key)
+        except KeyError:
+            return False
+        return True
 
     def __setitem__(self, key: K, value: V) -> None:
         """
         Set an (key, value) pair in our hash table.
+        A key already at the slot is pushed down into a new sub-table, as many levels as they share.
 
         Complexity:
-        #worst complexity: O(1), everything is constant
-        #best complexity: O(1), everything is constant
+        #worst complexity: O(len(key)), one level per character of the key
+        #best complexity: O(1), the slot in the top-level table is free
         """
-
-        self.key_list.append(key)
-        self.index_list.append(value)
-
-        self.level = 0
-        hashlist = []
-        for i in (key[:4]):
-            hashlist.append(self.hash(key))
-            self.level += 1
-        if len(hashlist) < 4:
-            hashlist.append(26)
-        self.hash_key_list.append(hashlist)
-
-        # print(self.key_list, self.index_list, self.hash_key_list)
-        # raise NotImplementedError()
+        path = []
+        table = self
+        while True:
+            position = table.hash(key)
+            path.append(table)
+            item = table.array[position]
+            if item is None:
+                table.array[position] = (key, value)
+                break
+            elif isinstance(item, InfiniteHashTable):
+                table = item
+            elif isinstance(item, dict):
+                new_key = key not in item
+                item[key] = value
+                if not new_key:
+                    return
+                break
+            elif item[0] == key:
+                table.array[position] = (key, value)
+                return
+            elif position == self.TABLE_SIZE - 1:
+                # Both keys have ended here with the same hashes.
+                table.array[position] = {item[0]: item[1], key: value}
+                break
+            else:
+                sub_table = type(self)(table.level + 1)
+                sub_table.array[sub_table.hash(item[0])] = item
+                sub_table.count = 1
+                sub_table._count_char(item[0][table.level], 1)
+                table.array[position] = sub_table
+                self.levels_created += 1
+                table = sub_table
+
+        for table in path:
+            table.count += 1
+            if table.level > 0:
+                table._count_char(key[table.level - 1], 1)
 
     def __delitem__(self, key: K) -> None:
         """
         Deletes a (key, value) pair in our hash table.
+        Sub-tables left with one key are collapsed into their parent slot, from the bottom up.
 
         :raises KeyError: when the key doesn't exist.
 
         Complexity:
-        #best complexity: O(1)
-        #worst complexity: O(n), where n is the length of the list, where the key to be deleted is found last in the key_list
+        #best complexity: O(1), the key is in the top-level table
+        #worst complexity: O(len(key)), see _find, collapsing at most one sub-table per level
+        """
+        path = self._find(key)
+        table, position = path[-1]
+        item = table.array[position]
+        if isinstance(item, dict):
+            del item[key]
+            if len(item) == 1:
+                table.array[position] = next(iter(item.items()))
+        else:
+            table.array[position] = None
+        for table, _ in path:
+            table.count -= 1
+            if table.level > 0:
+                table._count_char(key[table.level - 1], -1)
+
+        for depth in range(len(path) - 1, 0, -1):
+            table = path[depth][0]
+            if table.count != 1:
+                break
+            parent, position = path[depth - 1]
+            parent.array[position] = table._only_item()
+            self.levels_reclaimed += 1
+
+    def _count_char(self, char: str, change: int) -> None:
+        """
+        Adds change to the number of keys with char at position level - 1,
+        and sets `char` again if all the keys now share one.
 
+        :complexity: O(1)
+        """
+        count = self.char_counts.get(char, 0) + change
+        if count:
+            self.char_counts[char] = count
+        else:
+            del self.char_counts[char]
+        self.char = next(iter(self.char_counts)) if len(self.char_counts) == 1 else None
+
+    def _only_item(self) -> tuple[K, V]:
         """
+        Returns the single (key, value) pair of a table holding one key.
 
-        try:
-            self.hash_key_list.pop(self.key_list.index(key))
-            self.key_list.remove(key)
-            self.index_list.pop()
-        except ValueError:
-            raise KeyError
+        :complexity: O(TABLE_SIZE)
+        """
+        for item in self.array:
+            if item is not None:
+                return item
+        raise KeyError("Table is empty.")
 
     def __len__(self):
         """"
@@ -101,7 +222,147 @@ class InfiniteHashTable(Generic[K, V]):
         # worst complexity: O(1), everything is constant
         # best complexity: O(1), everything is constant
         """
-        return len(self.key_list)
+        return self.count
+
+    def items(self) -> Iterator[tuple[K, V]]:
+        """
+        Returns an iterator of all (key, value) pairs, in slot order at each level.
+
+        :complexity: O(N + T) over the whole iteration, where N is the number of keys
+        and T the number of tables, which is less than N.
+        """
+        # Walks the levels with a stack rather than recursion, so that deep tables fit.
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, InfiniteHashTable):
+                stack.extend(item for item in reversed(node.array) if item is not None)
+            elif isinstance(node, dict):
+                yield from node.items()
+            else:
+                yield node
+
+    def iter_sorted(self) -> Iterator[tuple[K, V]]:
+        """
+        Returns an iterator of all (key, value) pairs in lexicographic order of the keys,
+        without sorting them by comparison. See _sorted.
+
+        :complexity: O(L) over the whole iteration, where L is the total length of the keys.
+        """
+        yield from self._sorted([self], 0)
+
+    def sort_keys(self, current: InfiniteHashTable[K, V] | None = None) -> Iterator[K]:
+        """
+        Returns an iterator of the keys in current (the whole table if None) in lexicographic order.
+
+        :complexity: See iter_sorted.
+        """
+        for key, _ in self._sorted([self if current is None else current], 0):
+            yield key
+
+    def _sorted(self, nodes: list, depth: int) -> Iterator[tuple[K, V]]:
+        """
+        Yields the pairs in nodes, which are pairs and tables whose keys all share their
+        first depth characters, in order of their keys.
+
+        The nodes are split by the character of their keys at depth, as in a radix sort, and
+        a key that ends at depth comes first. A table one level down whose keys share that
+        character goes into its part whole, to be opened at the next depth.
+        Any other table is opened up at this depth.
+
+        The parts still to be split are kept on a stack, smallest on top, rather than recursed into,
+        so that deep tables fit. A pair that is ready to be yielded goes on it with a depth of None.
+
+        :complexity: O(L) over the whole iteration, where L is the total length of the keys in nodes.
+        """
+        stack = [(nodes, depth)]
+        while stack:
+            nodes, depth = stack.pop()
+            if depth is None:
+                yield nodes
+                continue
+
+            ended = []
+            parts = {}
+            nodes = list(nodes)
+            while nodes:
+                node = nodes.pop()
+                if isinstance(node, InfiniteHashTable):
+                    if node.level == depth + 1 and node.char is not None:
+                        parts.setdefault(node.char, []).append(node)
+                    else:
+                        nodes.extend(item for item in node.array if item is not None)
+                elif isinstance(node, dict):
+                    nodes.extend(node.items())
+                elif len(node[0]) == depth:
+                    ended.append(node)
+                else:
+                    parts.setdefault(node[0][depth], []).append(node)
+
+            for char in sorted(parts, reverse=True):
+                part = parts[char]
+                if len(part) == 1 and isinstance(part[0], tuple):
+                    stack.append((part[0], None))
+                else:
+                    stack.append((part, depth + 1))
+            stack.extend((pair, None) for pair in ended)
+
+    def _prefix_node(self, prefix: str) -> tuple[tuple[K, V] | InfiniteHashTable[K, V] | None, bool]:
+        """
+        Follows the characters of prefix down the levels. Returns the pair or table
+        there (None if the slot is empty), which holds every key starting with prefix,
+        and whether all of its keys are known to start with prefix.
+
+        :complexity: O(len(prefix))
+        """
+        node = self
+        shared = True
+        while isinstance(node, InfiniteHashTable) and node.level < len(prefix):
+            node = node.array[node.hash(prefix)]
+            if isinstance(node, InfiniteHashTable) and node.char != prefix[node.level - 1]:
+                shared = False
+        return node, shared
+
+    def keys_with_prefix(self, prefix: str, limit: int | None = None) -> Iterator[K]:
+        """
+        Returns an iterator of the keys starting with prefix in lexicographic order,
+        stopping after limit keys (if not None).
+
+        Complexity:
+        #best-case complexity: O(len(prefix) + L), where L is the total length of the keys returned
+        #worst-case complexity: O(len(prefix) + S), where S is the total length of the keys in the
+        # prefix's sub-table, when it also holds keys whose characters only hash like prefix
+        """
+        node, shared = self._prefix_node(prefix)
+        if node is None:
+            return
+        elif isinstance(node, tuple):
+            if node[0].startswith(prefix):
+                yield node[0]
+            return
+        if shared:
+            pairs = self._sorted([node], len(prefix))
+        else:
+            pairs = (pair for pair in self._sorted([node], 0) if pair[0].startswith(prefix))
+        for key, _ in islice(pairs, limit):
+            yield key
+
+    def count_prefix(self, prefix: str) -> int:
+        """
+        Returns the number of keys starting with prefix, read from the count of the prefix's sub-table.
+
+        Complexity:
+        #best-case complexity: O(len(prefix))
+        #worst-case complexity: O(len(prefix) + S), see keys_with_prefix
+        """
+        node, shared = self._prefix_node(prefix)
+        if node is None:
+            return 0
+        elif isinstance(node, tuple):
+            return int(node[0].startswith(prefix))
+        elif shared:
+            return node.count
+        return sum(1 for key, _ in node.items() if key.startswith(prefix))
 
     def __str__(self) -> str:
         """
@@ -111,45 +372,66 @@ class InfiniteHashTable(Generic[K, V]):
         """
 
         result = ""
-        for i in self.key_list:
-            result += "(" + i + "," + str(self.index_list[self.key_list.index(i)]) + ")\n"
+        for key, value in self.items():
+            result += "(" + str(key) + "," + str(value) + ")\n"
 
         return result
 
 
+    def stats(self) -> dict:
+        """
+        Returns the number of keys, how many keys sit at each depth
+        (the length of their location), how many keys share each top-level slot,
+        and how many sub-tables have been created and reclaimed.
+
+        Complexity:
+        #best-case complexity: O(n), where n is the number of keys, when they are all in the top-level table
+        #worst-case complexity: O(n*d), where d is the depth of the deepest key, see locations
+        """
+        depths = {}
+        top_level_slots = {}
+        for _, location in self.locations():
+            depths[len(location)] = depths.get(len(location), 0) + 1
+            top_level_slots[location[0]] = top_level_slots.get(location[0], 0) + 1
+        return {
+            "count": len(self),
+            "depths": dict(sorted(depths.items())),
+            "top_level_slots": dict(sorted(top_level_slots.items())),
+            "levels_created": self.levels_created,
+            "levels_reclaimed": self.levels_reclaimed,
+        }
+
     def get_location(self, key):
         """
-        Get the sequence of positions required to access this key.
+        Get the sequence of positions required to access this key:
+        the slot taken at each level on the way down from the top-level table.
 
         :raises KeyError: when the key doesn't exist.
 
         Complexity:
-        #best-case complexity: O(1)
-        #Worst-case complexity: O(n*m), where n is the length of the key_list, m is the length of char
-        # where the key is found last in the key_list
+        #best-case complexity: O(1), the key is in the top-level table
+        #Worst-case complexity: O(d), where d is the depth of the key, at most len(key) + 1, see _find
         """
-        try:
-            hash_list = self.hash_key_list[self.key_list.index(key)]
-            #print(self.hash_key_list[self.key_list.index(key)])
-            length_match = 1
-            for Key in self.key_list:
-                if key == Key:
-                    #print(Key,key)
-                    continue
-                match = ""
-                for i in range(min(len(Key), len(key))):
-                    if Key[i] == key[i]:
-                        #print(Key[i], key[i])
-                        match += Key[i]
-                        #print(match)
-                        if length_match < len(match) + 1:
-                            length_match = len(match) + 1
-                            #print(length_match)
-                    else:
-                        break
-                    # print(length_match)
+        return [position for _, position in self._find(key)]
 
-            # print(self.hash_key_list)
-            return self.hash_key_list[self.key_list.index(key)][:min(length_match, 4)]
-        except ValueError:
-            raise KeyError
\ No newline at end of file
+    def locations(self) -> Iterator[tuple[K, list[int]]]:
+        """
+        Returns an iterator of every key with its location (see get_location),
+        found in one walk down the levels rather than by hashing each key again.
+
+        :complexity: O(n*d) over the whole iteration, where n is the number of keys
+        and d the depth of the deepest key, to copy out each location.
+        """
+        # Each node on the stack is paired with the location of its slot.
+        stack = [(self, [])]
+        while stack:
+            node, location = stack.pop()
+            if isinstance(node, InfiniteHashTable):
+                for position in range(len(node.array) - 1, -1, -1):
+                    if node.array[position] is not None:
+                        stack.append((node.array[position], location + [position]))
+            elif isinstance(node, dict):
+                for key in node:
+                    yield key, location[:]
+            else:
+                yield node[0], location
@@ -282,8 +282,7 @@ class MyWindow(arcade.Window):
             t = deserialize(json.loads(f.read()))
         try:
             # Try to add all existing mountains
-            for mountain in t.collect_all_mountains():
-                self.mountain_manager.add_mountain(mountain)
+            self.mountain_manager.add_mountains(t.collect_all_mountains())
         except NotImplementedError:
             pass
         self.mountain = TrailDraw(t)
@@ -0,0 +1,328 @@
+""" Memory-Mapped Double Key Table
+
+Saves the layout of a DoubleKeyTable to a flat binary file, and serves lookups
+straight from a memory map of that file, decoding keys and values only as they are read.
+
+File layout (all integers little-endian, unsigned 64-bit unless stated otherwise):
+    - header:       HEADER: magic, outer size, top-level keys, pairs, inner tables,
+                    and the offsets of the directory, the inner slots and the pool.
+    - outer slots:  OUTER_SLOT per outer slot: 1st key (pool offset, length) and inner table number.
+    - directory:    DIRECTORY_ENTRY per inner table: offset of its first slot, number of slots,
+                    number of pairs, and whether it is inline (searched in order rather than hashed).
+    - inner slots:  INNER_SLOT per inner slot: 2nd key (pool offset, length) and value (pool offset, length).
+    - pool:         the UTF-8 bytes of every distinct key, and each value as a tag byte followed by its bytes.
+
+Empty slots have EMPTY as their key offset. Slots sit at the same positions as in
+the saved table, so a key is found by probing from the same hash.
+"""
+from __future__ import annotations
+
+import mmap
+import pickle
+import struct
+from typing import Generic, TypeVar, Iterator
+from data_structures.batch_hash import hash_string
+
+K1 = TypeVar('K1')
+K2 = TypeVar('K2')
+V = TypeVar('V')
+
+MAGIC = b"DKTMMAP1"
+HEADER = struct.Struct("<8s7Q")
+OUTER_SLOT = struct.Struct("<3Q")
+DIRECTORY_ENTRY = struct.Struct("<4Q")
+INNER_SLOT = struct.Struct("<4Q")
+EMPTY = 2 ** 64 - 1
+
+# Tags of the packed values. Anything else is pickled.
+TAG_NONE, TAG_BOOL, TAG_INT, TAG_FLOAT, TAG_STR, TAG_BYTES, TAG_PICKLE = range(7)
+INT = struct.Struct("<q")
+FLOAT = struct.Struct("<d")
+
+
+def _pack_value(value) -> bytes:
+    """
+    :complexity: O(size of value)
+    """
+    if value is None:
+        return bytes((TAG_NONE,))
+    elif type(value) is bool:
+        return bytes((TAG_BOOL, value))
+    elif type(value) is int and -2 ** 63 <= value < 2 ** 63:
+        return bytes((TAG_INT,)) + INT.pack(value)
+    elif type(value) is float:
+        return bytes((TAG_FLOAT,)) + FLOAT.pack(value)
+    elif type(value) is str:
+        return bytes((TAG_STR,)) + value.encode("utf-8", "surrogatepass")
+    elif type(value) is bytes:
+        return bytes((TAG_BYTES,)) + value
+    return bytes((TAG_PICKLE,)) + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _unpack_value(data: memoryview):
+    """
+    :complexity: O(size of value)
+    """
+    tag = data[0]
+    if tag == TAG_NONE:
+        return None
+    elif tag == TAG_BOOL:
+        return bool(data[1])
+    elif tag == TAG_INT:
+        return INT.unpack_from(data, 1)[0]
+    elif tag == TAG_FLOAT:
+        return FLOAT.unpack_from(data, 1)[0]
+    elif tag == TAG_STR:
+        return str(data[1:], "utf-8", "surrogatepass")
+    elif tag == TAG_BYTES:
+        return bytes(data[1:])
+    return pickle.loads(data[1:])
+
+
+def save_table(table, path: str) -> None:
+    """
+    Write the layout of a DoubleKeyTable to path. Keys shared between inner tables
+    are stored in the pool once. The table must use the default `hash1` and `hash2`,
+    since the layout could not be probed without them (see DoubleKeyTable.save).
+
+    :raises TypeError: when any key is not a string.
+
+    Complexity:
+    # worst case: O(N + M + L + S), where N is the outer tablesize, M the total size of the
+    # inner tables, L the total length of the keys and S the total size of the values
+    # best case: same as worst case
+    """
+    pool = bytearray()
+    strings: dict[str, int] = {}
+
+    def add_string(key) -> tuple[int, int]:
+        if type(key) is not str:
+            raise TypeError("Only tables with string keys can be saved.")
+        data = key.encode("utf-8", "surrogatepass")
+        offset = strings.get(key)
+        if offset is None:
+            offset = strings[key] = len(pool)
+            pool.extend(data)
+        return offset, len(data)
+
+    outer_slots = bytearray(OUTER_SLOT.size * table.table_size)
+    directory = bytearray()
+    inner_slots = bytearray()
+    for position, item in enumerate(table.array):
+        if item is None:
+            OUTER_SLOT.pack_into(outer_slots, position * OUTER_SLOT.size, EMPTY, 0, 0)
+            continue
+        key1, inner_table = item
+        key_offset, key_length = add_string(key1)
+        OUTER_SLOT.pack_into(outer_slots, position * OUTER_SLOT.size,
+                             key_offset, key_length, len(directory) // DIRECTORY_ENTRY.size)
+
+        slots = inner_table.count if inner_table.inline else inner_table.table_size
+        directory += DIRECTORY_ENTRY.pack(len(inner_slots), slots, inner_table.count, inner_table.inline)
+        start = len(inner_slots)
+        inner_slots.extend(bytes(INNER_SLOT.size * slots))
+        for inner_position in range(slots):
+            key2 = inner_table.slot_keys[inner_position]
+            slot_offset = start + inner_position * INNER_SLOT.size
+            if key2 is None:
+                INNER_SLOT.pack_into(inner_slots, slot_offset, EMPTY, 0, 0, 0)
+                continue
+            key_offset, key_length = add_string(key2)
+            value = _pack_value(inner_table.slot_values[inner_position])
+            INNER_SLOT.pack_into(inner_slots, slot_offset, key_offset, key_length, len(pool), len(value))
+            pool.extend(value)
+
+    directory_offset = HEADER.size + len(outer_slots)
+    slots_offset = directory_offset + len(directory)
+    pool_offset = slots_offset + len(inner_slots)
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, table.table_size, len(table), table.total_pairs(),
+                               len(directory) // DIRECTORY_ENTRY.size, directory_offset, slots_offset, pool_offset))
+        for part in (outer_slots, directory, inner_slots, pool):
+            file.write(part)
+
+
+class MappedDoubleKeyTable(Generic[K1, K2, V]):
+    """
+    Read-only Double Hash Table over a file written by `DoubleKeyTable.save`.
+
+    Opening only reads the header: outer and inner slots are probed in the memory
+    map, and keys and values are decoded when they are looked up. Values that were
+    pickled are unpickled on lookup, so only open files from trusted sources.
+
+    Call `close` (or use it as a context manager) to release the file.
+
+    Unless stated otherwise, all methods have O(1) complexity.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        :raises ValueError: when the file was not written by `DoubleKeyTable.save`.
+        """
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        if len(self.map) < HEADER.size or self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a saved DoubleKeyTable.")
+        (_, self.table_size, self.count, self.pair_count, self.inner_tables,
+         self.directory_offset, self.slots_offset, self.pool_offset) = HEADER.unpack_from(self.map)
+
+    def close(self) -> None:
+        self.view.release()
+        self.map.close()
+
+    def __enter__(self) -> MappedDoubleKeyTable[K1, K2, V]:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _pool(self, offset: int, length: int) -> memoryview:
+        start = self.pool_offset + offset
+        return self.view[start:start + length]
+
+    def _string(self, offset: int, length: int) -> str:
+        """
+        :complexity: O(length)
+        """
+        return str(self._pool(offset, length), "utf-8", "surrogatepass")
+
+    def _outer_probe(self, key: K1) -> int:
+        """
+        Find the inner table number of key.
+
+        :raises KeyError: When key is not in the table.
+
+        Complexity:
+        # worst case: O(len(key) + N*len(key)), where N is the outer tablesize
+        # best case: O(len(key)), first position holds the key
+        """
+        data = key.encode("utf-8", "surrogatepass") if type(key) is str else None
+        if data is None or self.table_size < 2:
+            raise KeyError(key)
+        position = hash_string(key, self.table_size)
+        for _ in range(self.table_size):
+            key_offset, key_length, inner = OUTER_SLOT.unpack_from(self.map, HEADER.size + position * OUTER_SLOT.size)
+            if key_offset == EMPTY:
+                break
+            elif key_length == len(data) and self._pool(key_offset, key_length) == data:
+                return inner
+            position = (position + 1) % self.table_size
+        raise KeyError(key)
+
+    def _inner(self, inner: int) -> tuple[int, int, int, bool]:
+        """
+        Returns the offset of the first slot, the number of slots and of pairs of
+        an inner table, and whether it is inline.
+        """
+        start, slots, count, inline = DIRECTORY_ENTRY.unpack_from(
+            self.map, self.directory_offset + inner * DIRECTORY_ENTRY.size)
+        return self.slots_offset + start, slots, count, bool(inline)
+
+    def _inner_probe(self, inner: int, key: K2) -> tuple[int, int, int, int]:
+        """
+        Returns the slot of key in an inner table: the key and the value, as pool offsets and lengths.
+
+        :raises KeyError: When key is not in the inner table.
+
+        Complexity:
+        # worst case: O(len(key) + M*len(key)), where M is the inner tablesize
+        # best case: O(len(key)), first position holds the key
+        """
+        start, slots, _, inline = self._inner(inner)
+        data = key.encode("utf-8", "surrogatepass") if type(key) is str else None
+        if data is None or slots == 0:
+            raise KeyError(key)
+        position = 0 if inline else hash_string(key, slots)
+        for _ in range(slots):
+            slot = INNER_SLOT.unpack_from(self.map, start + position * INNER_SLOT.size)
+            if slot[0] == EMPTY:
+                break
+            elif slot[1] == len(data) and self._pool(slot[0], slot[1]) == data:
+                return slot
+            position = (position + 1) % slots
+        raise KeyError(key)
+
+    def _inner_slots(self, inner: int) -> Iterator[tuple[int, int, int, int]]:
+        """
+        Returns an iterator of the filled slots of an inner table.
+
+        :complexity: O(M) over the whole iteration, where M is the inner tablesize.
+        """
+        start, slots, _, _ = self._inner(inner)
+        for position in range(slots):
+            slot = INNER_SLOT.unpack_from(self.map, start + position * INNER_SLOT.size)
+            if slot[0] != EMPTY:
+                yield slot
+
+    def __getitem__(self, key: tuple[K1, K2]) -> V:
+        """
+        Get the value at a (key1, key2) pair.
+
+        :raises KeyError: when the key doesn't exist.
+
+        Complexity:
+        # worst case: O(N + M + size of value), probing the whole outer and inner tables
+        # best case: O(len(key1) + len(key2) + size of value), no probing
+        """
+        slot = self._inner_probe(self._outer_probe(key[0]), key[1])
+        return _unpack_value(self._pool(slot[2], slot[3]))
+
+    def __contains__(self, key: tuple[K1, K2]) -> bool:
+        """
+        :complexity: See __getitem__, without decoding the value.
+        """
+        try:
+            self._inner_probe(self._outer_probe(key[0]), key[1])
+        except KeyError:
+            return False
+        return True
+
+    def keys(self, key: K1 | None = None) -> list[K1 | K2]:
+        """
+        key = None: returns all top-level keys in the table.
+        key = x: returns all bottom-level keys for top-level key x.
+
+        :raises KeyError: when x is not a top-level key.
+
+        Complexity:
+        # worst case: O(N + L) for all top-level keys, O(len(x) + M + L) for top-level key x,
+        # where L is the total length of the keys returned
+        # best case: same as worst case
+        """
+        if key is None:
+            res = []
+            for position in range(self.table_size):
+                key_offset, key_length, _ = OUTER_SLOT.unpack_from(self.map, HEADER.size + position * OUTER_SLOT.size)
+                if key_offset != EMPTY:
+                    res.append(self._string(key_offset, key_length))
+            return res
+        return [self._string(slot[0], slot[1]) for slot in self._inner_slots(self._outer_probe(key))]
+
+    def values(self, key: K1 | None = None) -> list[V]:
+        """
+        key = None: returns all values in the table.
+        key = x: returns all values for top-level key x.
+
+        :raises KeyError: when x is not a top-level key.
+
+        Complexity:
+        # worst case: O(N + T + S) for all values, O(len(x) + M + S) for top-level key x,
+        # where T is the total size of the inner tables and S the total size of the values returned
+        # best case: same as worst case
+        """
+        inners = range(self.inner_tables) if key is None else [self._outer_probe(key)]
+        return [_unpack_value(self._pool(slot[2], slot[3])) for inner in inners for slot in self._inner_slots(inner)]
+
+    def __len__(self) -> int:
+        """
+        Returns number of top-level keys in the hash table
+        """
+        return self.count
+
+    def total_pairs(self) -> int:
+        """
+        Returns number of (key1, key2) pairs in the hash table
+        """
+        return self.pair_count
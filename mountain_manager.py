@@ -2,7 +2,7 @@ from typing import List
 
 from algorithms.mergesort import mergesort
 from mountain import Mountain
-from data_structures.hash_table import *
+from data_structures.compact_table import CompactProbeTable
 
 class MountainManager:
     def __init__(self) -> None:
@@ -11,7 +11,7 @@ class MountainManager:
         #worst case: O(1), creating hash table and initialised it
         #best case: O(1), same as worst case
         """
-        self.mountain_table = LinearProbeTable[str, Mountain]()
+        self.mountain_table = CompactProbeTable[str, Mountain]()
 
     def add_mountain(self, mountain: Mountain) -> None:
         """
@@ -21,6 +21,14 @@ class MountainManager:
         """
         self.mountain_table[mountain.name] = mountain
 
+    def add_mountains(self, mountains: List[Mountain]) -> None:
+        """
+        Complexity:
+        #worst case: O(n), where n is the number of mountains, the table is resized at most once
+        #best case: O(n), same as worst case
+        """
+        self.mountain_table.update([(mountain.name, mountain) for mountain in mountains])
+
     def remove_mountain(self, mountain: Mountain) -> None:
         """
         Complexity:
@@ -45,7 +53,7 @@ class MountainManager:
         #best case: O(1), when there is only 1 element in self.mountain_table.values()
         """
         mountains = []
-        for mountain in self.mountain_table.values():
+        for mountain in self.mountain_table.iter_values():
             if mountain.difficulty_level == diff:
                 mountains.append(mountain)
         return mountains
@@ -57,11 +65,12 @@ class MountainManager:
         #best case: O(1), when there is only 1 element in self.mountain_table.values()
         """
 
-        max_difficulty = max(mountain.difficulty_level for mountain in self.mountain_table.values())
+        mountains = self.mountain_table.values()
+        max_difficulty = max(mountain.difficulty_level for mountain in mountains)
 
         grouped_mountains = [[] for _ in range(max_difficulty + 1)]
 
-        for mountain in self.mountain_table.values():
+        for mountain in mountains:
             difficulty = mountain.difficulty_level
             grouped_mountains[difficulty].append(mountain)
 
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+from threading import Lock
+from typing import Callable, Generic, TypeVar, Iterable
+from data_structures.batch_hash import hash_string
+from data_structures.hash_table import LinearProbeTable
+from double_key_table import DoubleKeyTable
+
+K1 = TypeVar('K1')
+K2 = TypeVar('K2')
+V = TypeVar('V')
+T = TypeVar('T')
+
+
+class ShardedDoubleKeyTable(Generic[K1, K2, V]):
+    """
+    Sharded Double Hash Table, safe to use from several threads at once.
+
+    Top-level keys are split by `shard_hash` across a number of independent
+    DoubleKeyTables (shards), each with its own lock. The shards resize on their own,
+    and writes to different shards never wait for each other.
+
+    Reads take no lock. Each shard has a sequence number that is odd while a write to it
+    is in progress. A read checks the number before and after, and is repeated under
+    the shard's lock if a write overlapped it.
+
+    Type Arguments:
+        - K1:   1st Key Type. In most cases should be string.
+                Otherwise `shard_hash` and `hash1` should be overwritten.
+        - K2:   2nd Key Type. In most cases should be string.
+                Otherwise `hash2` should be overwritten.
+        - V:    Value Type.
+
+    Unless stated otherwise, all methods have the complexity of the same method on DoubleKeyTable.
+    """
+
+    DEFAULT_SHARDS = 16
+
+    def __init__(self, shards: int = DEFAULT_SHARDS, sizes: list | None = None,
+                 internal_sizes: list | None = None, sorted_index: bool = False) -> None:
+        """
+        :param shards: number of independently locked DoubleKeyTables.
+        :raises ValueError: when shards is less than 1.
+
+        Complexity:
+        # worst case: O(s), where s is the number of shards
+        # best case: O(s), same as worst case
+        """
+        if shards < 1:
+            raise ValueError("There should be at least one shard.")
+        self.shards = [DoubleKeyTable(sizes, internal_sizes, sorted_index) for _ in range(shards)]
+        self.locks = [Lock() for _ in range(shards)]
+        # Odd while a write to the shard is in progress.
+        self.sequences = [0] * shards
+
+    def shard_hash(self, key: K1) -> int:
+        """
+        Hash the 1st key to pick its shard. Same as LinearProbeTable.digest.
+
+        :complexity: O(len(key))
+        """
+        return hash_string(key, LinearProbeTable.DIGEST_MODULUS)
+
+    def _shard_index(self, key: K1) -> int:
+        """
+        :complexity: O(len(key))
+        """
+        return self.shard_hash(key) % len(self.shards)
+
+    def _read(self, index: int, read: Callable[[DoubleKeyTable[K1, K2, V]], T]) -> T:
+        """
+        Returns read(shard) without locking, unless a write to the shard overlapped it.
+
+        Complexity:
+        # worst case: O(r), where r is the cost of read, twice over
+        # best case: O(r)
+        """
+        sequence = self.sequences[index]
+        if sequence % 2 == 0:
+            try:
+                res, error = read(self.shards[index]), None
+            except Exception as e:
+                # A write may have moved things under the read, in which case the error is retried below.
+                res, error = None, e
+            if self.sequences[index] == sequence:
+                if error is not None:
+                    raise error
+                return res
+        with self.locks[index]:
+            return read(self.shards[index])
+
+    def _write(self, index: int, write: Callable[[DoubleKeyTable[K1, K2, V]], T]) -> T:
+        """
+        Returns write(shard), holding the shard's lock and marking the write in progress.
+
+        Complexity:
+        # worst case: O(w), where w is the cost of write, plus waiting for the lock
+        # best case: O(w)
+        """
+        with self.locks[index]:
+            self.sequences[index] += 1
+            try:
+                return write(self.shards[index])
+            finally:
+                self.sequences[index] += 1
+
+    def __getitem__(self, key: tuple[K1, K2]) -> V:
+        """
+        :raises KeyError: when the key doesn't exist.
+        """
+        return self._read(self._shard_index(key[0]), lambda shard: shard[key])
+
+    def __contains__(self, key: tuple[K1, K2]) -> bool:
+        return self._read(self._shard_index(key[0]), lambda shard: key in shard)
+
+    def __setitem__(self, key: tuple[K1, K2], data: V) -> None:
+        self._write(self._shard_index(key[0]), lambda shard: shard.__setitem__(key, data))
+
+    def __delitem__(self, key: tuple[K1, K2]) -> None:
+        """
+        :raises KeyError: when the key doesn't exist.
+        """
+        self._write(self._shard_index(key[0]), lambda shard: shard.__delitem__(key))
+
+    def _group(self, pairs: list[tuple[K1, K2]]) -> dict[int, list[int]]:
+        """
+        Returns the indices into pairs of the pairs for each shard, in order.
+
+        :complexity: O(L) where L is the total length of the 1st keys.
+        """
+        groups = {}
+        for index, (key1, _) in enumerate(pairs):
+            groups.setdefault(self._shard_index(key1), []).append(index)
+        return groups
+
+    def get_many(self, pairs: Iterable[tuple[K1, K2]]) -> list[V]:
+        """
+        Get the values at each of the (key1, key2) pairs, in order, reading each shard once.
+
+        :raises KeyError: when any of the keys doesn't exist.
+        """
+        pairs = list(pairs)
+        res = [None] * len(pairs)
+        for shard_index, indices in self._group(pairs).items():
+            shard_pairs = [pairs[index] for index in indices]
+            values = self._read(shard_index, lambda shard: shard.get_many(shard_pairs))
+            for index, value in zip(indices, values):
+                res[index] = value
+        return res
+
+    def set_many(self, pairs: Iterable[tuple[K1, K2]], values: Iterable[V]) -> None:
+        """
+        Set the value at each of the (key1, key2) pairs to the matching value,
+        taking each shard's lock once.
+
+        :raises ValueError: when there are not as many values as pairs.
+        """
+        pairs, values = list(pairs), list(values)
+        if len(pairs) != len(values):
+            raise ValueError("There should be one value for each pair.")
+        for shard_index, indices in self._group(pairs).items():
+            shard_pairs = [pairs[index] for index in indices]
+            shard_values = [values[index] for index in indices]
+            self._write(shard_index, lambda shard: shard.set_many(shard_pairs, shard_values))
+
+    def keys(self, key: K1 | None = None) -> list[K1 | K2]:
+        """
+        key = None: returns all top-level keys in the table, from a snapshot of each shard.
+        key = x: returns all bottom-level keys for top-level key x.
+
+        :raises KeyError: when x is not a top-level key.
+        """
+        if key is None:
+            res = []
+            for index in range(len(self.shards)):
+                res.extend(self._write(index, DoubleKeyTable.snapshot).keys())
+            return res
+        return self._read(self._shard_index(key), lambda shard: shard.keys(key))
+
+    def values(self, key: K1 | None = None) -> list[V]:
+        """
+        key = None: returns all values in the table, from a snapshot of each shard.
+        key = x: returns all values for top-level key x.
+
+        :raises KeyError: when x is not a top-level key.
+        """
+        if key is None:
+            res = []
+            for index in range(len(self.shards)):
+                res.extend(self._write(index, DoubleKeyTable.snapshot).values())
+            return res
+        return self._read(self._shard_index(key), lambda shard: shard.values(key))
+
+    def __len__(self) -> int:
+        """
+        Returns number of top-level keys in the hash table.
+        Only exact while no writes are in progress.
+
+        Complexity:
+        # worst case: O(s), where s is the number of shards
+        # best case: O(s), same as worst case
+        """
+        return sum(len(shard) for shard in self.shards)
+
+    def total_pairs(self) -> int:
+        """
+        Returns number of (key1, key2) pairs in the hash table.
+        Only exact while no writes are in progress.
+
+        Complexity:
+        # worst case: O(s), where s is the number of shards
+        # best case: O(s), same as worst case
+        """
+        return sum(shard.total_pairs() for shard in self.shards)
@@ -1,7 +1,13 @@
+import os
+import tempfile
 import unittest
+from threading import Thread
+from unittest import mock
 from ed_utils.decorators import number
 
-from double_key_table import DoubleKeyTable
+from data_structures.hash_table import ConcurrentModificationError
+from double_key_table import DoubleKeyTable, InnerTable
+from sharded_double_key_table import ShardedDoubleKeyTable
 
 class TestDoubleHash(unittest.TestCase):
 
@@ -123,3 +129,414 @@ class TestDoubleHash(unittest.TestCase):
         # with an iterator.
         self.assertRaises(BaseException, lambda: next(key_iterator))
         self.assertRaises(BaseException, lambda: next(value_iterator))
+
+    @number("3.6")
+    def test_stats(self):
+        # Disable resizing / rehashing.
+        dt = DoubleKeyTable(sizes=[12], internal_sizes=[5])
+        dt.hash1 = lambda k: ord(k[0]) % 12
+        dt.hash2 = lambda k, sub_table: ord(k[-1]) % 5
+        dt["Tim", "Jen"] = 1
+        dt.instrument()
+        dt["Amy", "Ben"] = 2
+        dt["Het", "Liz"] = 3
+        dt["Tim", "Bob"] = 4
+
+        stats = dt.stats()
+        self.assertEqual(stats["count"], 3)
+        self.assertEqual(stats["cluster_lengths"], {1: 1, 2: 1})
+        self.assertEqual(stats["inner_occupancy"], {"Tim": (2, 5), "Amy": (1, 5), "Het": (1, 5)})
+        self.assertEqual(stats["hit_probe_lengths"], {0: 1})
+        self.assertEqual(stats["miss_probe_lengths"], {0: 1, 1: 1})
+        self.assertEqual(stats["collisions"], 1)
+        self.assertEqual(set(stats["inner"]["miss_probe_lengths"]), {0})
+
+    @number("3.7")
+    def test_resize_moves_inner_tables(self):
+        dt = DoubleKeyTable()
+        for i in range(20):
+            dt["Tim", f"k{i}"] = i
+        tim = dt.array[dt._linear_probe("Tim", "k0", False)[0]][1]
+        hashed = []
+        hash2 = dt.hash2
+        dt.hash2 = lambda k, sub_table: hashed.append(k) or hash2(k, sub_table)
+
+        # Three more top-level keys grow the outer table from 5 to 13.
+        for key1 in ("Amy", "May", "Ivy"):
+            dt[key1, "Bob"] = 0
+        self.assertEqual(dt.table_size, 13)
+        # The existing inner table was moved, not rebuilt (the new ones are inline, so hash nothing).
+        self.assertEqual(hashed, [])
+        self.assertIs(dt.array[dt._linear_probe("Tim", "k0", False)[0]][1], tim)
+        self.assertEqual(len(dt), 4)
+        for i in range(20):
+            self.assertEqual(dt.values("Tim")[dt.keys("Tim").index(f"k{i}")], i)
+
+    @number("3.8")
+    def test_delete_cluster(self):
+        # Disable resizing / rehashing.
+        dt = DoubleKeyTable(sizes=[12], internal_sizes=[5])
+        dt.hash1 = lambda k: ord(k[0]) % 12
+        dt.hash2 = lambda k, sub_table: ord(k[-1]) % 5
+
+        dt["Wes", "Bob"] = 1    # 87 % 12 = 3
+        dt["Kat", "Jen"] = 2    # 75 % 12 = 3 -> 4
+        dt["Kat", "Liz"] = 3
+        dt["Lou", "Amy"] = 4    # 76 % 12 = 4 -> 5
+        dt["Zoe", "Tom"] = 5    # 90 % 12 = 6
+        dt["Tim", "Ben"] = 6    # 84 % 12 = 0
+        dt["Sam", "Ivy"] = 7    # 83 % 12 = 11
+        dt["Gus", "May"] = 8    # 71 % 12 = 11 -> 0 -> 1
+
+        # Not the last pair of Kat, so nothing moves.
+        del dt["Kat", "Jen"]
+        self.assertEqual(dt._linear_probe("Lou", "Amy", False), (5, 1))
+        self.assertRaises(KeyError, lambda: dt._linear_probe("Kat", "Jen", False))
+
+        del dt["Wes", "Bob"]
+        self.assertEqual(len(dt), 6)
+        self.assertEqual(dt._linear_probe("Kat", "Liz", False)[0], 3)
+        self.assertEqual(dt._linear_probe("Lou", "Amy", False)[0], 4)
+        # Zoe is already home.
+        self.assertEqual(dt._linear_probe("Zoe", "Tom", False)[0], 6)
+        self.assertIsNone(dt.array[5])
+        self.assertEqual(dt.values("Lou"), [4])
+
+        # Across the end of the table.
+        del dt["Sam", "Ivy"]
+        self.assertEqual(dt._linear_probe("Gus", "May", False)[0], 11)
+        self.assertEqual(dt._linear_probe("Tim", "Ben", False)[0], 0)
+        self.assertIsNone(dt.array[1])
+        self.assertEqual(set(dt.keys()), {"Kat", "Lou", "Zoe", "Tim", "Gus"})
+        self.assertRaises(KeyError, lambda: dt._linear_probe("Sam", "Ivy", False))
+
+    @number("3.9")
+    def test_counts(self):
+        dt = DoubleKeyTable()
+        for i in range(30):
+            dt[f"region-{i % 4}", f"mountain-{i}"] = i
+        self.assertEqual(len(dt), 4)
+        self.assertEqual(dt.total_pairs(), 30)
+        self.assertEqual(dt["region-1", "mountain-5"], 5)
+        self.assertIn(("region-2", "mountain-6"), dt)
+        self.assertNotIn(("region-2", "mountain-5"), dt)
+        self.assertNotIn(("region-9", "mountain-5"), dt)
+
+        # Inserts never list an inner table's keys.
+        with mock.patch.object(InnerTable, "keys", None):
+            dt["region-1", "mountain-5"] = -5
+            self.assertEqual(dt["region-1", "mountain-5"], -5)
+            self.assertEqual(dt.total_pairs(), 30)
+            dt["region-4", "mountain-30"] = 30
+            self.assertEqual((len(dt), dt.total_pairs()), (5, 31))
+
+        del dt["region-4", "mountain-30"]
+        del dt["region-0", "mountain-0"]
+        self.assertEqual((len(dt), dt.total_pairs()), (4, 29))
+        self.assertRaises(KeyError, lambda: dt["region-0", "mountain-0"])
+
+    @number("3.10")
+    def test_subtable(self):
+        # Disable resizing / rehashing.
+        dt = DoubleKeyTable(sizes=[12], internal_sizes=[5])
+        hashed = []
+        dt.hash1 = lambda k: hashed.append(k) or ord(k[0]) % 12
+        dt.hash2 = lambda k, sub_table: ord(k[-1]) % 5
+        dt["Tim", "Jen"] = 1
+        dt["Amy", "Ben"] = 2
+        dt["May", "Ben"] = 3
+        dt["May", "Tom"] = 5
+
+        hashed.clear()
+        self.assertEqual(set(dt.keys("May")), {"Ben", "Tom"})
+        self.assertEqual(set(dt.iter_values("May")), {3, 5})
+        self.assertEqual(hashed, ["May", "May"])
+        self.assertRaises(KeyError, lambda: dt.keys("Het"))
+        self.assertRaises(KeyError, lambda: next(dt.iter_keys("Het")))
+
+        may = dt.subtable("May")
+        self.assertEqual(len(may), 2)
+        self.assertEqual(may["Tom"], 5)
+        dt["May", "Jim"] = 7
+        self.assertIn("Jim", may)
+        self.assertEqual(set(may), {"Ben", "Tom", "Jim"})
+        self.assertEqual(dict(may.items()), {"Ben": 3, "Tom": 5, "Jim": 7})
+        with self.assertRaises(TypeError):
+            may["Liz"] = 8
+        self.assertRaises(KeyError, lambda: dt.subtable("Het"))
+
+    @number("3.11")
+    def test_inline_inner_tables(self):
+        dt = DoubleKeyTable()
+        hashed = []
+        hash2 = dt.hash2
+        dt.hash2 = lambda k, sub_table: hashed.append(k) or hash2(k, sub_table)
+        for i in range(4):
+            dt["Tim", f"k{i}"] = i
+        tim = dt.array[dt._linear_probe("Tim", "k0", False)[0]][1]
+        self.assertFalse(hasattr(tim, "__dict__"))
+        self.assertTrue(tim.inline)
+        self.assertEqual(dt._linear_probe("Tim", "k2", False)[1], 2)
+        self.assertEqual(hashed, [])
+
+        dt["Tim", "k4"] = 4
+        self.assertFalse(tim.inline)
+        self.assertEqual(tim.table_size, 13)
+        self.assertEqual({k: dt["Tim", k] for k in dt.keys("Tim")}, {f"k{i}": i for i in range(5)})
+
+        del dt["Tim", "k0"]
+        self.assertTrue(tim.inline)
+        self.assertEqual(sorted(dt.keys("Tim")), ["k1", "k2", "k3", "k4"])
+        self.assertEqual(dt["Tim", "k4"], 4)
+        for i in range(1, 5):
+            del dt["Tim", f"k{i}"]
+        self.assertEqual((len(dt), dt.total_pairs()), (0, 0))
+
+        # A 2nd key hash2 cannot take is only rejected once the pairs would be spread,
+        # and they stay inline rather than being lost.
+        for i in range(4):
+            dt["Ann", i] = i
+        self.assertRaises(TypeError, dt.__setitem__, ("Ann", 4), 4)
+        ann = dt.array[dt._outer_probe("Ann", False)][1]
+        self.assertTrue(ann.inline)
+        self.assertEqual((len(ann), dt.total_pairs()), (4, 4))
+        self.assertEqual(dt.keys("Ann"), [0, 1, 2, 3])
+        self.assertEqual(dt["Ann", 0], 0)
+
+    @number("3.12")
+    def test_get_set_many(self):
+        pairs = [(f"region-{i % 10}", f"mountain-{i}") for i in range(1000)]
+        dt = DoubleKeyTable()
+        dt.instrument()
+        resize = InnerTable._resize
+        with mock.patch.object(InnerTable, "_resize", autospec=True, side_effect=resize) as inner_resizes:
+            dt.set_many(pairs, range(1000))
+        # One outer resize, and at most one per inner table.
+        self.assertEqual(dt.stats()["rehashes"], 1)
+        self.assertLessEqual(inner_resizes.call_count, 10)
+        self.assertEqual((len(dt), dt.total_pairs()), (10, 1000))
+        self.assertEqual(dt.get_many(pairs), list(range(1000)))
+        self.assertEqual([dt[pair] for pair in pairs[::7]], list(range(0, 1000, 7)))
+
+        # Updates and new keys mixed, matching one at a time inserts.
+        more = pairs[::3] + [("region-10", "mountain-0"), ("region-3", "new")]
+        dt.set_many(more, [-1] * len(more))
+        single = DoubleKeyTable()
+        for i, pair in enumerate(pairs):
+            single[pair] = i
+        for pair in more:
+            single[pair] = -1
+        self.assertEqual((len(dt), dt.total_pairs()), (len(single), single.total_pairs()))
+        self.assertEqual(dt.get_many(pairs + more), [single[pair] for pair in pairs + more])
+
+        self.assertRaises(KeyError, lambda: dt.get_many([("region-1", "mountain-1"), ("region-1", "missing")]))
+        self.assertRaises(KeyError, lambda: dt.get_many([("missing", "mountain-1")]))
+        self.assertRaises(ValueError, lambda: dt.set_many(pairs, [1]))
+
+        # Overwritten hash functions are still used.
+        dt = DoubleKeyTable(sizes=[12], internal_sizes=[5])
+        dt.hash1 = lambda k: ord(k[0]) % 12
+        dt.hash2 = lambda k, sub_table: ord(k[-1]) % 5
+        dt.set_many([("May", "Ben"), ("May", "Tom"), ("May", "Jim"), ("Het", "Liz")], [3, 5, 7, 8])
+        self.assertEqual(dt._linear_probe("May", "Jim", False), (5, 1))
+        self.assertEqual(dt._linear_probe("Het", "Liz", False), (0, 2))
+        self.assertEqual(dt.get_many([("Het", "Liz"), ("May", "Jim")]), [8, 7])
+
+    @number("3.13")
+    def test_sorted_index(self):
+        names = ["linden", "lincoln", "lin", "aspen", "matterhorn", "lion", "k2", "line", "mont blanc"]
+        indexed = DoubleKeyTable(sorted_index=True)
+        plain = DoubleKeyTable()
+        for dt in (indexed, plain):
+            for i, name in enumerate(names):
+                dt["alps", name] = i
+            dt["andes", "aconcagua"] = 0
+            del dt["alps", "lion"]
+            self.assertEqual(dt.prefix_keys("alps", "lin"), ["lin", "lincoln", "linden", "line"])
+            self.assertEqual(dt.prefix_keys("alps", "z"), [])
+            self.assertEqual(dt.range_keys("alps", "a", "m"),
+                             ["aspen", "k2", "lin", "lincoln", "linden", "line"])
+            self.assertEqual(dt.range_keys("alps", "line"), ["line", "matterhorn", "mont blanc"])
+            self.assertEqual(dt.range_keys("alps", "m", "a"), [])
+            self.assertEqual(dt.subtable("andes").range_keys(), ["aconcagua"])
+            self.assertRaises(KeyError, lambda: dt.prefix_keys("rockies", "a"))
+
+        # Kept up to date through inline, spread and collapsed inner tables.
+        alps = indexed.array[indexed._outer_probe("alps", False)][1]
+        self.assertEqual(alps.sorted_keys, sorted(set(names) - {"lion"}))
+        for name in names[:6]:
+            if name != "lion":
+                del indexed["alps", name]
+        self.assertTrue(alps.inline)
+        self.assertEqual(alps.sorted_keys, ["k2", "line", "mont blanc"])
+        self.assertIsNone(plain.array[plain._outer_probe("alps", False)][1].sorted_keys)
+
+    @number("3.14")
+    def test_snapshot(self):
+        dt = DoubleKeyTable()
+        for i in range(40):
+            dt[f"region-{i % 4}", f"mountain-{i}"] = i
+
+        keys = dt.iter_keys()
+        next(keys)
+        dt["region-0", "mountain-0"] = -1
+        next(keys)
+        dt["region-0", "new"] = 0
+        self.assertRaises(ConcurrentModificationError, lambda: next(keys))
+        values = dt.iter_values("region-1")
+        next(values)
+        del dt["region-1", "mountain-1"]
+        self.assertRaises(ConcurrentModificationError, lambda: next(values))
+
+        snapshot = dt.snapshot()
+        expected = {(key1, key2): snapshot[key1, key2] for key1 in snapshot.keys() for key2 in snapshot.keys(key1)}
+        seen = []
+        for key1 in snapshot.iter_keys():
+            for key2 in snapshot.iter_keys(key1):
+                seen.append((key1, key2))
+                dt["region-0", f"more-{len(seen)}"] = 0
+            dt[f"other-{key1}", "x"] = 0
+        self.assertEqual(set(seen), set(expected))
+        self.assertEqual(len(snapshot), 4)
+        self.assertEqual(snapshot.total_pairs(), len(expected))
+        self.assertEqual(dt.total_pairs(), len(expected) + len(seen) + 4)
+        self.assertEqual(len(dt), 8)
+        self.assertRaises(TypeError, snapshot.__setitem__, ("region-0", "x"), 1)
+        self.assertRaises(TypeError, snapshot.__delitem__, ("region-0", "mountain-4"))
+
+        # Only the inner tables written to are copied.
+        snapshot = dt.snapshot()
+        dt["region-2", "mountain-2"] = -2
+        self.assertEqual(snapshot["region-2", "mountain-2"], 2)
+        self.assertIsNot(dt.subtable("region-2")._table, snapshot.subtable("region-2")._table)
+        self.assertIs(dt.subtable("region-3")._table, snapshot.subtable("region-3")._table)
+        # And none once the snapshot is no longer used.
+        del snapshot
+        region3 = dt.subtable("region-3")._table
+        dt["region-3", "mountain-3"] = -3
+        self.assertIs(dt.subtable("region-3")._table, region3)
+
+        # Views and iterators taken before a snapshot follow the copy made on the next write.
+        view = dt.subtable("region-1")
+        values = dt.iter_values("region-1")
+        next(values)
+        snapshot = dt.snapshot()
+        dt["region-1", "mountain-5"] = -5
+        self.assertEqual(view["mountain-5"], -5)
+        self.assertEqual(snapshot["region-1", "mountain-5"], 5)
+        self.assertEqual(len(list(values)), len(view) - 1)
+        values = dt.iter_values("region-1")
+        next(values)
+        snapshot = dt.snapshot()
+        dt["region-1", "new"] = 1
+        self.assertIn("new", view)
+        self.assertNotIn("new", snapshot.subtable("region-1"))
+        self.assertRaises(ConcurrentModificationError, lambda: next(values))
+        del snapshot
+        for key2 in view.keys():
+            del dt["region-1", key2]
+        self.assertEqual((len(view), list(view)), (0, []))
+
+
+class TestShardedDoubleKeyTable(unittest.TestCase):
+
+    @number("3.15")
+    def test_matches_double_key_table(self):
+        pairs = [(f"region-{i % 30}", f"mountain-{i}") for i in range(300)]
+        st = ShardedDoubleKeyTable(shards=4)
+        dt = DoubleKeyTable()
+        for i, pair in enumerate(pairs):
+            st[pair] = i
+            dt[pair] = i
+        st.set_many(pairs[::2], [-1] * 150)
+        dt.set_many(pairs[::2], [-1] * 150)
+        del st["region-1", "mountain-1"]
+        del dt["region-1", "mountain-1"]
+
+        self.assertEqual((len(st), st.total_pairs()), (len(dt), dt.total_pairs()))
+        self.assertEqual(sorted(st.keys()), sorted(dt.keys()))
+        self.assertEqual(sorted(st.values()), sorted(dt.values()))
+        self.assertEqual(sorted(st.keys("region-3")), sorted(dt.keys("region-3")))
+        self.assertEqual(st.get_many(pairs[2:]), dt.get_many(pairs[2:]))
+        self.assertNotIn(("region-1", "mountain-1"), st)
+        self.assertRaises(KeyError, lambda: st["region-1", "mountain-1"])
+        self.assertRaises(KeyError, lambda: st.keys("missing"))
+        # Every shard took some of the top-level keys, and resized on its own.
+        self.assertTrue(all(len(shard) > 0 for shard in st.shards))
+        self.assertRaises(ValueError, lambda: ShardedDoubleKeyTable(shards=0))
+
+    @number("3.16")
+    def test_threads(self):
+        st = ShardedDoubleKeyTable(shards=8)
+        errors = []
+
+        def write(thread: int) -> None:
+            for i in range(500):
+                st[f"region-{i % 50}", f"mountain-{thread}-{i}"] = i
+
+        def read() -> None:
+            for i in range(500):
+                try:
+                    value = st["region-0", "mountain-0-0"]
+                except KeyError:
+                    continue
+                if value != 0:
+                    errors.append(value)
+
+        threads = [Thread(target=write, args=(thread,)) for thread in range(8)] + [Thread(target=read)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual((len(st), st.total_pairs()), (50, 4000))
+        self.assertEqual(st["region-7", "mountain-3-107"], 107)
+
+
+class TestMappedDoubleKeyTable(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "table.dkt")
+
+    @number("3.17")
+    def test_save_open(self):
+        values = [None, True, 7, -2 ** 70, 1.5, "Kosciuszko", b"bytes", ["a", 1]]
+        for dt in (DoubleKeyTable(), DoubleKeyTable(sizes=[31], internal_sizes=[7, 17])):
+            pairs = [(f"region-{i % 6}", f"mountain-{i}") for i in range(40)]
+            for pair, value in zip(pairs, values * 5):
+                dt[pair] = value
+            dt.save(self.path)
+
+            with DoubleKeyTable.open(self.path) as mt:
+                for pair, value in zip(pairs, values * 5):
+                    self.assertEqual(mt[pair], value)
+                    self.assertIs(type(mt[pair]), type(value))
+                self.assertEqual((len(mt), mt.total_pairs()), (len(dt), dt.total_pairs()))
+                self.assertEqual(mt.keys(), dt.keys())
+                self.assertEqual(mt.values(), dt.values())
+                for key in dt.keys():
+                    self.assertEqual(mt.keys(key), dt.keys(key))
+                    self.assertEqual(mt.values(key), dt.values(key))
+                self.assertIn(("region-1", "mountain-1"), mt)
+                self.assertNotIn(("region-1", "mountain-2"), mt)
+                self.assertRaises(KeyError, lambda: mt["missing", "mountain-1"])
+                self.assertRaises(KeyError, lambda: mt.keys("missing"))
+
+    @number("3.18")
+    def test_save_unsupported(self):
+        dt = DoubleKeyTable()
+        # Small inner tables are not hashed, so a 2nd key hash2 cannot take
+        # is accepted until the table spreads (see 3.11).
+        dt["a", 1] = 1
+        self.assertRaises(TypeError, lambda: dt.save(self.path))
+
+        dt = DoubleKeyTable()
+        dt.hash1 = lambda k: 0
+        dt["a", "b"] = 1
+        self.assertRaises(ValueError, lambda: dt.save(self.path))
+
+        with open(self.path, "wb") as file:
+            file.write(b"not a table")
+        self.assertRaises(ValueError, lambda: DoubleKeyTable.open(self.path))
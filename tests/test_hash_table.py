@@ -0,0 +1,497 @@
+import tracemalloc
+import unittest
+from ed_utils.decorators import number
+
+from data_structures import batch_hash
+from data_structures.batch_hash import hash_many
+from data_structures.compact_table import CompactProbeTable
+from data_structures.hash_table import ConcurrentModificationError, LinearProbeTable
+from data_structures.incremental_table import IncrementalRehashTable
+from data_structures.parallel_array_table import ParallelArrayTable
+from data_structures.robin_hood_table import RobinHoodTable
+from double_key_table import DoubleKeyTable
+
+class TestLinearProbeTable(unittest.TestCase):
+
+    @number("8.1")
+    def test_cached_digest(self):
+        lp = LinearProbeTable()
+        hashed = []
+        digest = lp.digest
+        lp.digest = lambda k: hashed.append(k) or digest(k)
+
+        for i in range(100):
+            lp[f"key{i}"] = i
+        self.assertEqual(len(hashed), 100)
+        # Growing went through several sizes without hashing any key again.
+        self.assertGreater(lp.size_index, 3)
+        for i in range(100):
+            self.assertEqual(lp[f"key{i}"], i)
+            self.assertEqual(lp.hash(f"key{i}"), lp.digest(f"key{i}") % lp.table_size)
+        del lp["key50"]
+        self.assertNotIn("key50", lp)
+        self.assertEqual(len(lp), 99)
+
+    @number("8.2")
+    def test_overwritten_hash(self):
+        # Disable resizing / rehashing.
+        lp = LinearProbeTable(sizes=[5])
+        lp.hash = lambda k: ord(k[0]) % 5
+        lp["a"] = 1
+        lp["f"] = 2
+        self.assertEqual(lp._linear_probe("a", False), 2)
+        self.assertEqual(lp._linear_probe("f", False), 3)
+        del lp["a"]
+        self.assertEqual(lp._linear_probe("f", False), 2)
+
+    @number("8.3")
+    def test_tombstones(self):
+        # Disable resizing / rehashing.
+        lp = LinearProbeTable(sizes=[13], tombstones=True, tombstone_threshold=0.2)
+        lp.hash = lambda k: ord(k[0]) % 13
+        lp["a"] = 1     # 6
+        lp["n"] = 2     # 6 -> 7
+        lp["b"] = 3     # 7 -> 8
+        del lp["a"]
+        self.assertEqual(lp.tombstone_count, 1)
+        # The rest of the cluster is left where it was.
+        self.assertEqual(lp._linear_probe("n", False), 7)
+        self.assertEqual(lp._linear_probe("b", False), 8)
+        self.assertNotIn("a", lp)
+        # Inserting reuses the tombstone.
+        lp["a"] = 4
+        self.assertEqual(lp._linear_probe("a", False), 6)
+        self.assertEqual(lp.tombstone_count, 0)
+
+        # Deleting the end of a cluster leaves no tombstones behind.
+        del lp["n"]
+        del lp["b"]
+        self.assertEqual(lp.tombstone_count, 0)
+        self.assertEqual(len(lp), 1)
+
+        lp["n"] = 2
+        lp["b"] = 3
+        lp["c"] = 5     # 8 -> 9
+        del lp["a"]
+        del lp["n"]
+        self.assertEqual(lp.tombstone_count, 2)
+        # The third tombstone passes 20% of the table, so it is compacted.
+        del lp["b"]
+        self.assertEqual(lp.tombstone_count, 0)
+        self.assertEqual(lp._linear_probe("c", False), 8)
+        self.assertEqual(lp.keys(), ["c"])
+
+    @number("8.9")
+    def test_bulk_load(self):
+        items = [(f"m{i}", i) for i in range(1000)]
+        lp = LinearProbeTable.from_items(iter(items), expected=1000)
+        # Smallest size holding 1000 entries at most half full.
+        self.assertEqual(lp.table_size, 3079)
+        self.assertEqual(len(lp), 1000)
+
+        rebuilds = []
+        rebuild = lp._rebuild
+        lp._rebuild = lambda size: rebuilds.append(size) or rebuild(size)
+        lp.update(iter((f"n{i}", i) for i in range(2000)))
+        self.assertEqual(rebuilds, [6151])
+        lp.update([("m1", -1)])
+        self.assertEqual(rebuilds, [6151])
+        self.assertEqual(len(lp), 3000)
+        self.assertEqual(lp["m1"], -1)
+        self.assertEqual(lp["n1999"], 1999)
+
+        for table_type in (RobinHoodTable, ParallelArrayTable, IncrementalRehashTable):
+            table = table_type.from_items(items)
+            self.assertEqual(table.table_size, 3079)
+            self.assertEqual(sorted(table.values()), list(range(1000)))
+
+    @number("8.10")
+    def test_load_factors(self):
+        self.assertRaises(ValueError, lambda: LinearProbeTable(max_load_factor=1))
+        self.assertRaises(ValueError, lambda: LinearProbeTable(min_load_factor=0.3))
+
+        lp = LinearProbeTable(max_load_factor=0.75, min_load_factor=0.2)
+        for i in range(200):
+            lp[f"m{i}"] = i
+        # 200 entries is under 75% of 389, but not 193.
+        self.assertEqual(lp.table_size, 389)
+        for i in range(127):
+            del lp[f"m{i}"]
+        # Under 20% of 389 since 77 entries, but 193 is too small to be at most 37.5% full.
+        self.assertEqual(len(lp), 73)
+        self.assertEqual(lp.table_size, 389)
+        del lp["m127"]
+        self.assertEqual(lp.table_size, 193)
+        self.assertEqual(sorted(lp.values()), list(range(128, 200)))
+
+        for table_type in (RobinHoodTable, ParallelArrayTable, IncrementalRehashTable):
+            table = table_type(min_load_factor=0.1)
+            for i in range(1000):
+                table[f"m{i}"] = i
+            for i in range(995):
+                del table[f"m{i}"]
+            self.assertEqual(table.table_size, 29)
+            self.assertEqual(sorted(table.keys()), ["m995", "m996", "m997", "m998", "m999"])
+
+    @number("8.11")
+    def test_generated_sizes(self):
+        class SmallTable(LinearProbeTable):
+            TABLE_SIZES = [5, 13]
+
+        lp = SmallTable()
+        for i in range(100):
+            lp[f"m{i}"] = i
+        self.assertEqual(lp.TABLE_SIZES, [5, 13, 29, 59, 127, 257])
+        self.assertEqual(SmallTable.TABLE_SIZES, [5, 13])
+        self.assertEqual(lp.table_size, 257)
+        self.assertEqual(lp["m99"], 99)
+
+        # Sizes given to the constructor are never extended.
+        lp = LinearProbeTable(sizes=[5, 13])
+        for i in range(10):
+            lp[f"m{i}"] = i
+        self.assertEqual(lp.table_size, 13)
+
+
+class TestRobinHoodTable(unittest.TestCase):
+
+    @number("8.4")
+    def test_displacement(self):
+        # Disable resizing / rehashing.
+        rh = RobinHoodTable(sizes=[13])
+        rh.hash = lambda k: ord(k[0]) % 13
+        rh["a"] = 1     # home 6
+        rh["n"] = 2     # home 6
+        rh["b"] = 3     # home 7, takes 8
+        rh["o"] = 4     # home 7, ties with b so goes after it
+        rh["Z"] = 5     # home 12
+        rh["M"] = 6     # home 12, wraps to 0
+        self.assertEqual(rh._linear_probe("b", False), 8)
+        self.assertEqual(rh._linear_probe("o", False), 9)
+        self.assertEqual(rh._linear_probe("M", False), 0)
+        rh["O"] = 7     # home 1
+        self.assertEqual(rh._linear_probe("O", False), 1)
+
+        # "N" has home 0, so at slot 1 it is further from home than "O":
+        # it takes that slot and "O" shifts along.
+        self.assertRaises(KeyError, lambda: rh._linear_probe("N", False))
+        self.assertEqual(rh._linear_probe("N", True), 1)
+        rh["N"] = 8
+        self.assertEqual(rh._linear_probe("N", False), 1)
+        self.assertEqual(rh._linear_probe("O", False), 2)
+
+        # Backward shift deletion.
+        del rh["a"]
+        self.assertEqual(rh._linear_probe("n", False), 6)
+        self.assertEqual(rh._linear_probe("b", False), 7)
+        self.assertEqual(rh._linear_probe("o", False), 8)
+        del rh["M"]
+        self.assertEqual(rh._linear_probe("N", False), 0)
+        self.assertEqual(rh._linear_probe("O", False), 1)
+        self.assertEqual(len(rh), 6)
+        self.assertEqual(set(rh.keys()), {"n", "b", "o", "Z", "N", "O"})
+
+    @number("8.5")
+    def test_resize(self):
+        rh = RobinHoodTable()
+        for i in range(1000):
+            rh[f"default-{i:04}"] = i
+        self.assertEqual(len(rh), 1000)
+        self.assertEqual(rh.table_size, 3079)
+        for i in range(0, 1000, 2):
+            del rh[f"default-{i:04}"]
+        for i in range(1000):
+            self.assertEqual(f"default-{i:04}" in rh, i % 2 == 1)
+        self.assertEqual(sorted(rh.values()), list(range(1, 1000, 2)))
+
+        # Positional arguments line up with LinearProbeTable.
+        rh = RobinHoodTable(None, False, 0.25, 0.6, 0.1)
+        self.assertEqual((rh.max_load_factor, rh.min_load_factor), (0.6, 0.1))
+        self.assertRaises(ValueError, RobinHoodTable, None, True)
+
+
+class TestParallelArrayTable(unittest.TestCase):
+
+    @number("8.6")
+    def test_matches_linear_probe(self):
+        for tombstones in (False, True):
+            lp = LinearProbeTable(tombstones=tombstones)
+            pa = ParallelArrayTable(tombstones=tombstones)
+            for i in range(500):
+                lp[f"m{i}"] = i
+                pa[f"m{i}"] = i
+            for i in range(0, 500, 3):
+                del lp[f"m{i}"]
+                del pa[f"m{i}"]
+            pa["m1"] = lp["m1"] = -1
+            self.assertEqual(len(pa), len(lp))
+            self.assertEqual(pa.table_size, lp.table_size)
+            self.assertEqual(pa.tombstone_count, lp.tombstone_count)
+            for i in range(500):
+                self.assertEqual(pa._linear_probe(f"m{i}", True), lp._linear_probe(f"m{i}", True))
+            self.assertEqual(pa.keys(), lp.keys())
+            self.assertEqual(pa.values(), lp.values())
+            self.assertEqual(list(pa.items()), list(lp.items()))
+            self.assertEqual(list(pa.iter_values()), lp.values())
+
+    @number("8.7")
+    def test_overwritten_hash(self):
+        pa = ParallelArrayTable(sizes=[5, 13])
+        pa.hash = lambda k: ord(k[0]) % pa.table_size
+        pa["a"] = 1
+        pa["f"] = 2
+        self.assertEqual(pa._linear_probe("f", False), 3)
+        pa["k"] = 3
+        # Resized to 13.
+        self.assertEqual(pa._linear_probe("a", False), 6)
+        self.assertEqual(pa._linear_probe("k", False), 3)
+        del pa["a"]
+        self.assertEqual(pa["f"], 2)
+        self.assertEqual(str(pa), "(k,3)\n(f,2)\n")
+
+
+class TestIncrementalRehashTable(unittest.TestCase):
+
+    @number("8.8")
+    def test_migration(self):
+        for tombstones in (False, True):
+            ir = IncrementalRehashTable(tombstones=tombstones)
+            ir.MIGRATION_STEP = 4
+            for i in range(200):
+                ir[f"m{i}"] = i
+                if i == 26:
+                    # 27 entries passed half of 53 slots, moving into 97.
+                    self.assertEqual(ir.table_size, 97)
+                    self.assertTrue(ir.is_migrating())
+            for i in range(200):
+                self.assertEqual(ir[f"m{i}"], i)
+
+            # Resize, then update and delete keys while some are still in the old array.
+            ir._rehash()
+            self.assertTrue(ir.is_migrating())
+            ir["m3"] = -3
+            del ir["m150"]
+            del ir["m199"]
+            self.assertRaises(KeyError, lambda: ir["m150"])
+            self.assertEqual(ir["m3"], -3)
+            self.assertEqual(len(ir), 198)
+            self.assertEqual(len(ir.keys()), 198)
+            ir["m150"] = 150
+            self.assertEqual(len(ir), 199)
+
+            ir._migrate()
+            self.assertFalse(ir.is_migrating())
+            self.assertEqual(sorted(ir.values())[:3], [-3, 0, 1])
+            self.assertEqual(len(ir.values()), 199)
+            self.assertNotIn("m199", ir)
+
+
+class TestCompactProbeTable(unittest.TestCase):
+
+    @number("8.12")
+    def test_insertion_order(self):
+        ct = CompactProbeTable()
+        names = [f"default-{i:04}" for i in range(300)]
+        for name in reversed(names):
+            ct[name] = len(name)
+        ct[names[-1]] = 0
+        self.assertEqual(ct.keys(), names[::-1])
+        self.assertEqual(ct.values()[:2], [0, 12])
+        self.assertEqual(next(ct.items()), (names[-1], 0))
+
+        for name in names[:200]:
+            del ct[name]
+            self.assertNotIn(name, ct)
+        self.assertEqual(list(ct.iter_keys()), names[:199:-1])
+        # Holes never outnumber live entries.
+        self.assertLessEqual(len(ct.entry_keys), 2 * len(ct))
+        for name in names[200:]:
+            self.assertEqual(ct[name], len(name) if name != names[-1] else 0)
+
+        ct["new"] = 1
+        self.assertEqual(ct.keys()[-1], "new")
+        self.assertEqual(len(ct), 101)
+
+        # Positional arguments line up with LinearProbeTable.
+        ct = CompactProbeTable(None, False, 0.25, 0.6, 0.1)
+        self.assertEqual((ct.max_load_factor, ct.min_load_factor), (0.6, 0.1))
+
+    @number("8.13")
+    def test_deleted_slots(self):
+        # Disable resizing / rehashing.
+        ct = CompactProbeTable(sizes=[13])
+        ct.hash = lambda k: ord(k[0]) % 13
+        ct["a"] = 1     # 6
+        ct["n"] = 2     # 6 -> 7
+        del ct["a"]
+        # The slot is not reused.
+        self.assertEqual(ct._linear_probe("n", False), 7)
+        self.assertEqual(ct._linear_probe("a", True), 8)
+        self.assertEqual(ct.tombstone_count, 1)
+        for key in "abcdef":
+            ct[key] = 0
+        # 7 entries and a deleted slot would pass half of 13, so the deleted slot was dropped,
+        # and the entries placed again in insertion order.
+        self.assertEqual(ct.tombstone_count, 0)
+        self.assertEqual(ct.table_size, 13)
+        self.assertEqual(ct._linear_probe("n", False), 6)
+        self.assertEqual(ct._linear_probe("a", False), 7)
+        self.assertEqual(ct.keys(), ["n", "a", "b", "c", "d", "e", "f"])
+
+
+class TestStats(unittest.TestCase):
+
+    @number("8.14")
+    def test_stats(self):
+        # Disable resizing / rehashing.
+        lp = LinearProbeTable(sizes=[13])
+        lp.hash = lambda k: ord(k[0]) % 13
+        lp["a"] = 1     # 6
+        lp["n"] = 2     # 6 -> 7
+        lp["Z"] = 3     # 12
+        stats = lp.stats()
+        self.assertEqual(stats["cluster_lengths"], {1: 1, 2: 1})
+        for key in ("hit_probe_lengths", "miss_probe_lengths", "collisions", "rehashes", "rehash_time"):
+            self.assertNotIn(key, stats)
+
+        lp.instrument()
+        lp["M"] = 4     # 12 -> 0
+        lp["n"] = 5
+        self.assertNotIn("b", lp)   # 7 -> 8
+        stats = lp.stats()
+        self.assertEqual(stats["count"], 4)
+        self.assertEqual(stats["load_factor"], 4 / 13)
+        self.assertEqual(stats["cluster_lengths"], {2: 2})
+        self.assertEqual(stats["hit_probe_lengths"], {1: 1})
+        self.assertEqual(stats["miss_probe_lengths"], {1: 2})
+        self.assertEqual(stats["collisions"], 1)
+        self.assertEqual(stats["rehashes"], 0)
+
+        for table_type in (LinearProbeTable, RobinHoodTable, ParallelArrayTable,
+                           IncrementalRehashTable, CompactProbeTable):
+            table = table_type()
+            table.instrument()
+            for i in range(100):
+                table[f"m{i}"] = i
+            if isinstance(table, IncrementalRehashTable):
+                # The last resize is still moving entries out of the old array.
+                self.assertTrue(table.is_migrating())
+            stats = table.stats()
+            self.assertEqual(sum(stats["miss_probe_lengths"].values()), 100)
+            self.assertEqual(stats["rehashes"], 6)
+            self.assertEqual(sum(length * n for length, n in stats["cluster_lengths"].items()), 100)
+            table.instrument(False)
+            self.assertNotIn("rehashes", table.stats())
+
+
+class TestBatchHash(unittest.TestCase):
+
+    KEYS = ["", "a", "Mt Fuji", "Mönch", "\x00", "a\x00", "\x00a", "K2" * 40] + [f"mountain-{i}" for i in range(200)]
+
+    @number("8.15")
+    def test_matches_scalar(self):
+        lp = LinearProbeTable()
+        self.assertEqual(hash_many(self.KEYS, LinearProbeTable.DIGEST_MODULUS), [lp.digest(k) for k in self.KEYS])
+        for size in (5, 13, 1572869):
+            dt = DoubleKeyTable(sizes=[size])
+            self.assertEqual(hash_many(self.KEYS, size), [dt.hash1(k) for k in self.KEYS])
+        self.assertEqual(hash_many([], 13), [])
+        if batch_hash.np is not None:
+            self.assertEqual(batch_hash._hash_many_numpy(self.KEYS, 13), batch_hash._hash_many_python(self.KEYS, 13))
+
+    @number("8.16")
+    def test_bulk_operations(self):
+        items = [(k, i) for i, k in enumerate(self.KEYS)]
+        for table_type in (LinearProbeTable, RobinHoodTable, ParallelArrayTable,
+                           IncrementalRehashTable, CompactProbeTable):
+            table = table_type.from_items(iter(items), expected=len(items))
+            self.assertEqual(table.get_many(self.KEYS), list(range(len(self.KEYS))))
+            table.update([("a", -1), ("new", -2)])
+            self.assertEqual(table.get_many(["new", "a"]), [-2, -1])
+            self.assertEqual(table[self.KEYS[2]], 2)
+            with self.assertRaises(KeyError):
+                table.get_many(["a", "missing"])
+
+        # Positions still come from an overwritten hash.
+        lp = LinearProbeTable(sizes=[13])
+        lp.hash = lambda k: ord(k[0]) % 13
+        lp.update([("a", 1), ("n", 2)])
+        self.assertEqual(lp._linear_probe("n", False), 7)
+        self.assertEqual(lp.get_many(["n", "a"]), [2, 1])
+
+    @number("8.19")
+    def test_long_key_memory(self):
+        # One long key must not pad the code points of every other key out to its length.
+        keys = [f"mountain-{i}" for i in range(2000)] + ["K2" * 10000]
+        tracemalloc.start()
+        try:
+            hashes = hash_many(keys, 13)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(hashes, batch_hash._hash_many_python(keys, 13))
+        # No more than one full matrix of 4 byte code points.
+        self.assertLess(peak, 4 * batch_hash.CHUNK_CELLS)
+
+
+class TestSnapshots(unittest.TestCase):
+
+    TABLE_TYPES = (LinearProbeTable, RobinHoodTable, ParallelArrayTable, IncrementalRehashTable, CompactProbeTable)
+
+    @number("8.17")
+    def test_fail_fast(self):
+        for table_type in self.TABLE_TYPES:
+            table = table_type()
+            for i in range(10):
+                table[f"m{i}"] = i
+            # Updating a value is not a modification of the key set.
+            items = table.items()
+            key, _ = next(items)
+            table[key] = -1
+            next(items)
+            table["new"] = 10
+            self.assertRaises(ConcurrentModificationError, lambda: next(items))
+
+            keys = table.iter_keys()
+            next(keys)
+            del table["new"]
+            self.assertRaises(ConcurrentModificationError, lambda: list(keys))
+            self.assertEqual(len(list(table.iter_values())), 10)
+
+    @number("8.18")
+    def test_snapshot(self):
+        for table_type in self.TABLE_TYPES:
+            table = table_type()
+            for i in range(100):
+                table[f"m{i}"] = i
+            snapshot = table.snapshot()
+            self.assertIs(table.snapshot(), snapshot)
+            seen = {}
+            for i, (key, value) in enumerate(snapshot.items()):
+                seen[key] = value
+                # Writes while iterating the snapshot, including resizes.
+                table[f"n{i}"] = i
+                table["m0"] = -1
+                if i < 50:
+                    del table[f"m{i + 50}"]
+            self.assertEqual(seen, {f"m{i}": i for i in range(100)})
+            self.assertEqual(snapshot["m0"], 0)
+            self.assertEqual(len(snapshot), 100)
+            self.assertEqual(table["m0"], -1)
+            self.assertNotIn("m50", table)
+            self.assertEqual(len(table), 150)
+            self.assertRaises(TypeError, snapshot.__setitem__, "m1", 5)
+            self.assertRaises(TypeError, snapshot.__delitem__, "m1")
+            # Rejected before the snapshot could be resized for the new keys.
+            size = snapshot.table_size
+            self.assertRaises(TypeError, snapshot.update, [(f"n{i}", i) for i in range(1000)])
+            self.assertEqual((snapshot.table_size, len(snapshot)), (size, 100))
+
+        # Once a snapshot is no longer used, writing copies nothing.
+        lp = LinearProbeTable()
+        lp["a"] = 1
+        snapshot = lp.snapshot()
+        array = lp.array
+        del snapshot
+        lp["b"] = 2
+        self.assertIs(lp.array, array)
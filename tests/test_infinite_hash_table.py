@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 from ed_utils.decorators import number
 
 from infinite_hash_table import InfiniteHashTable
@@ -66,4 +67,176 @@ class TestInfiniteHash(unittest.TestCase):
 
         ih["lin"] = 10
         self.assertEqual(ih.get_location("lin"), [4])
-        self.assertEqual(len(ih), 1)
\ No newline at end of file
+        self.assertEqual(len(ih), 1)
+
+    @number("4.3")
+    def test_overwrite_and_many_keys(self):
+        ih = InfiniteHashTable()
+        ih["lin"] = 1
+        ih["lin"] = 2
+        self.assertEqual(ih["lin"], 2)
+        self.assertEqual(len(ih), 1)
+
+        keys = [f"peak{i}" for i in range(2000)]
+        for i, key in enumerate(keys):
+            ih[key] = i
+        self.assertEqual(len(ih), 2001)
+        self.assertEqual(ih["peak1234"], 1234)
+        self.assertIn("peak0", ih)
+        self.assertNotIn("peak", ih)
+        self.assertRaises(KeyError, lambda: ih["peak2000"])
+        # "peak123" is the start of "peak1230" to "peak1239", so it sits in the end-of-key slot below them.
+        self.assertEqual(ih.get_location("peak123"), [ord(c) % 26 for c in "peak123"] + [26])
+
+        for key in keys:
+            del ih[key]
+        self.assertEqual(len(ih), 1)
+        self.assertEqual(ih.get_location("lin"), [4])
+        self.assertRaises(KeyError, lambda: ih.__delitem__("peak0"))
+
+    @number("4.4")
+    def test_same_hashes(self):
+        ih = InfiniteHashTable()
+        # ord("G") % 26 == ord("a") % 26, so "Ga" and "aa" hash alike at every level.
+        ih["Ga"] = 1
+        ih["aa"] = 2
+        ih["aaa"] = 3
+        self.assertEqual((ih["Ga"], ih["aa"], ih["aaa"]), (1, 2, 3))
+        self.assertEqual(ih.get_location("Ga"), [19, 19, 26])
+        self.assertEqual(ih.get_location("aa"), [19, 19, 26])
+        self.assertEqual(len(ih), 3)
+        ih["aa"] = 4
+        self.assertEqual((ih["aa"], len(ih)), (4, 3))
+        self.assertEqual(sorted(ih.items()), [("Ga", 1), ("aa", 4), ("aaa", 3)])
+
+        del ih["Ga"]
+        self.assertRaises(KeyError, lambda: ih["Ga"])
+        del ih["aaa"]
+        self.assertEqual(ih.get_location("aa"), [19])
+        self.assertEqual(ih["aa"], 4)
+
+    @number("4.5")
+    def test_locations(self):
+        ih = InfiniteHashTable()
+        for i, key in enumerate(["lin", "leg", "mine", "linked", "limp", "mining", "jake", "linger"]):
+            ih[key] = i
+        locations = dict(ih.locations())
+        self.assertEqual(len(locations), len(ih))
+        for key, location in locations.items():
+            self.assertEqual(location, ih.get_location(key))
+        self.assertEqual(locations["linked"], [4, 1, 6, 3])
+        self.assertEqual(ih.stats()["depths"], {1: 1, 2: 1, 3: 1, 4: 5})
+        self.assertEqual(list(InfiniteHashTable().locations()), [])
+
+    @number("4.6")
+    def test_collapse_counters(self):
+        ih = InfiniteHashTable()
+        ih["lin"] = 1
+        ih["linked"] = 2
+        ih["linger"] = 3
+        # "lin" and "linked" share three characters, so three levels were created for them.
+        self.assertEqual(ih.stats()["levels_created"], 3)
+        self.assertEqual(ih.get_location("linked"), [4, 1, 6, 3])
+
+        del ih["linger"]
+        self.assertEqual(ih.get_location("linked"), [4, 1, 6, 3])
+        self.assertEqual(ih.stats()["levels_reclaimed"], 0)
+
+        # The last key below "l" moves back up to the top-level table.
+        del ih["lin"]
+        self.assertEqual(ih.get_location("linked"), [4])
+        self.assertEqual(ih.stats()["levels_reclaimed"], 3)
+
+        for i in range(1000):
+            ih[f"peak{i}"] = i
+        for i in range(1000):
+            del ih[f"peak{i}"]
+        stats = ih.stats()
+        self.assertEqual(stats["depths"], {1: 1})
+        self.assertEqual(stats["levels_created"], stats["levels_reclaimed"])
+
+    @number("4.7")
+    def test_sorted(self):
+        ih = InfiniteHashTable()
+        keys = ["lin", "leg", "mine", "linked", "limp", "mining", "jake", "linger",
+                "Ga", "aa", "a", "Mt Kosciuszko", "Mt Townsend", "zebra", "", "h"]
+        for i, key in enumerate(keys):
+            ih[key] = i
+        self.assertEqual(list(ih.sort_keys()), sorted(keys))
+        self.assertEqual(list(ih.iter_sorted()), sorted((key, i) for i, key in enumerate(keys)))
+
+        # Sorting a sub-table only sorts the keys below it.
+        sub_table = ih.array[ih.hash("lin")]
+        self.assertEqual(list(ih.sort_keys(sub_table)), ["leg", "limp", "lin", "linger", "linked"])
+
+        del ih["lin"]
+        del ih["Ga"]
+        keys.remove("lin")
+        keys.remove("Ga")
+        self.assertEqual(list(ih.sort_keys()), sorted(keys))
+        self.assertEqual(list(InfiniteHashTable().sort_keys()), [])
+
+    @number("4.8")
+    def test_prefix(self):
+        ih = InfiniteHashTable()
+        keys = ["lin", "leg", "mine", "linked", "limp", "mining", "jake", "linger", "Ga", "aa", "aab"]
+        for i, key in enumerate(keys):
+            ih[key] = i
+        self.assertEqual(list(ih.keys_with_prefix("lin")), ["lin", "linger", "linked"])
+        self.assertEqual(list(ih.keys_with_prefix("li", limit=2)), ["limp", "lin"])
+        self.assertEqual(list(ih.keys_with_prefix("j")), ["jake"])
+        self.assertEqual(list(ih.keys_with_prefix("jakes")), [])
+        self.assertEqual(list(ih.keys_with_prefix("x")), [])
+        self.assertEqual(list(ih.keys_with_prefix("")), sorted(keys))
+        # "Ga" hashes like "aa" but does not start with "a".
+        self.assertEqual(list(ih.keys_with_prefix("a")), ["aa", "aab"])
+
+        self.assertEqual(ih.count_prefix("lin"), 3)
+        self.assertEqual(ih.count_prefix("l"), 5)
+        self.assertEqual(ih.count_prefix("a"), 2)
+        self.assertEqual(ih.count_prefix("G"), 1)
+        self.assertEqual(ih.count_prefix(""), len(keys))
+        self.assertEqual(ih.count_prefix("mountain"), 0)
+
+        del ih["linger"]
+        ih["lint"] = 11
+        self.assertEqual(ih.count_prefix("lin"), 3)
+        self.assertEqual(list(ih.keys_with_prefix("lin")), ["lin", "linked", "lint"])
+
+    @number("4.9")
+    def test_deep_keys(self):
+        # Keys sharing 1200 characters sit 1200 levels down, deeper than the recursion limit.
+        ih = InfiniteHashTable()
+        keys = ["a" * 1200, "a" * 1200 + "b", "a" * 1199 + "G", "a" * 1300]
+        for i, key in enumerate(keys):
+            ih[key] = i
+        self.assertEqual(sorted(ih.items()), sorted((key, i) for i, key in enumerate(keys)))
+        self.assertEqual(list(ih.sort_keys()), sorted(keys))
+        self.assertEqual(dict(ih.locations())[keys[1]], ih.get_location(keys[1]))
+        self.assertEqual(ih.stats()["count"], 4)
+        self.assertEqual(list(ih.keys_with_prefix("a" * 1200)), sorted(keys[:2] + keys[3:]))
+        self.assertEqual(ih.count_prefix("a" * 1200), 3)
+        del ih[keys[3]]
+        self.assertEqual(ih.count_prefix("a" * 1200), 2)
+
+    @number("4.10")
+    def test_prefix_after_collision(self):
+        ih = InfiniteHashTable()
+        keys = [f"alp{i:02}" for i in range(50)]
+        for i, key in enumerate(keys):
+            ih[key] = i
+        # "G" shares a slot with "a", so "Gzz" goes into the sub-table of "a" keys.
+        ih["Gzz"] = 50
+        self.assertIsNone(ih.array[ih.hash("a")].char)
+        self.assertEqual(ih.count_prefix("alp"), 50)
+        self.assertEqual(list(ih.keys_with_prefix("alp", limit=2)), keys[:2])
+        self.assertEqual(list(ih.keys_with_prefix("G")), ["Gzz"])
+
+        # Once it is gone the keys share "a" again, so counts come straight from the sub-table.
+        del ih["Gzz"]
+        self.assertEqual(ih.array[ih.hash("a")].char, "a")
+        with mock.patch.object(InfiniteHashTable, "items", side_effect=AssertionError("scanned")):
+            self.assertEqual(ih.count_prefix("alp"), 50)
+            self.assertEqual(ih.count_prefix("alp1"), 10)
+        self.assertEqual(list(ih.keys_with_prefix("alp", limit=2)), keys[:2])
+        self.assertEqual(list(ih.sort_keys()), keys)